@@ -22,7 +22,7 @@ try:
     import sys
     import os
     sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
-    from utils.jwt_utils import generate_access_token, generate_refresh_token
+    from utils.jwt_utils import generate_access_token, generate_refresh_token, token_required, revoke_token
     JWT_AVAILABLE = True
 except ImportError as e:
     logger.error(f"无法导入JWT工具，请确保jwt_utils模块可用: {e}")
@@ -139,6 +139,39 @@ def refresh_token():
             'error_code': 'INTERNAL_ERROR'
         }), 500
 
+# 退出登录接口
+@auth_bp.route('/logout', methods=['POST'])
+@token_required
+def logout(current_user):
+    """
+    退出登录：吊销当前access token（请求体中提供refresh_token时一并吊销）
+    
+    未配置共享缓存后端时服务端不支持吊销，返回tokens_revoked=false，客户端需自行删除token
+    """
+    try:
+        access_token = request.headers.get('Authorization').split(' ')[1]
+        revoked = revoke_token(access_token)
+        
+        data = request.get_json(silent=True) or {}
+        if data.get('refresh_token'):
+            revoked = revoke_token(data['refresh_token']) and revoked
+        
+        logger.info(f"用户退出登录: {current_user['username']} (UUID: {current_user['uuid']}), token已吊销: {revoked}")
+        
+        return jsonify({
+            'status': 'success',
+            'message': '退出登录成功' if revoked else '退出登录成功，服务端未吊销token，请在客户端删除',
+            'tokens_revoked': revoked
+        })
+        
+    except Exception as e:
+        logger.error(f"退出登录失败: {e}")
+        return jsonify({
+            'status': 'error',
+            'message': '退出登录失败，请稍后重试',
+            'error_code': 'INTERNAL_ERROR'
+        }), 500
+
 # 用户登录接口
 @auth_bp.route('/login', methods=['POST'])
 def login():
@@ -177,8 +210,8 @@ def login():
         
         # 生成JWT token
         if generate_access_token and generate_refresh_token:
-            access_token = generate_access_token(user['uuid'], username)
-            refresh_token = generate_refresh_token(user['uuid'], username)
+            access_token = generate_access_token(user['uuid'], username, user['full_name'])
+            refresh_token = generate_refresh_token(user['uuid'], username, user['full_name'])
         else:
             logger.warning("JWT工具不可用，无法生成token")
             access_token = None
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""
+健康数据汇总表回填
+
+执行 deploy_mysql/migrations/004 创建汇总表后运行一次，根据已有的原始数据重建小时/天汇总；
+也可用于修正单个用户的汇总。
+运行方式（在backend目录下）：python -m api.v1.health.data.backfill_rollups [--user UUID]
+"""
+
+import sys
+import time
+import logging
+import argparse
+
+from api.v1.health.data.health_data_manager import health_data_manager
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Rebuild health data hourly/daily rollups')
+    parser.add_argument('--user', type=str, default=None,
+                        help='Only rebuild rollups for this user UUID (default: all users)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    start = time.perf_counter()
+    try:
+        health_data_manager.rebuild_rollups(args.user)
+    except Exception as e:
+        logging.error(f"回填健康数据汇总失败: {e}")
+        return 1
+
+    logging.info(f"回填完成，耗时 {time.perf_counter() - start:.1f} 秒")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
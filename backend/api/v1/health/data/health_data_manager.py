@@ -4,9 +4,13 @@
 提供健康数据的数据库操作功能，包括查询、添加、统计等
 """
 
+import os
+import re
+import json
 import logging
 import datetime
-from typing import Dict, List, Optional, Any
+from contextlib import nullcontext
+from typing import Callable, Dict, List, Optional, Any, Iterable, Tuple
 
 # 导入数据库连接器
 try:
@@ -19,16 +23,58 @@ except ImportError:
         
         def execute_update(self, query, params=None):
             return 1
+        
+        def execute_transaction(self, queries_and_params):
+            return 1
+        
+        def execute_batch(self, query, params_seq, extra_queries=None, expected_rowcount=None):
+            return len(params_seq)
+        
+        def connection_scope(self):
+            return nullcontext(self)
     
     db_connector = MockDBConnector()
 
 logger = logging.getLogger(__name__)
 
+# MySQL错误码：表不存在（未执行汇总表迁移）
+ER_NO_SUCH_TABLE = 1146
+
+# 与MySQL的 CAST(value AS DECIMAL) 一致：取字符串开头的数字部分（如血压"120/80"取120）
+_NUMERIC_PREFIX = re.compile(r'\s*([-+]?(?:\d+\.?\d*|\.\d+))')
+
+# 同一规则的MySQL写法：重建汇总时只统计能解析出数字的值（CAST会把其余的值当作0）
+_NUMERIC_PREFIX_SQL = "value REGEXP '^[[:space:]]*[-+]?([0-9]+[.]?[0-9]*|[.][0-9]+)'"
+
+def parse_numeric_value(value: Any) -> Optional[float]:
+    """把健康数据值解析为数字，无法解析时返回None"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    match = _NUMERIC_PREFIX.match(str(value))
+    return float(match.group(1)) if match else None
+
+# 支持写入的健康数据类型
+HEALTH_DATA_TYPES = frozenset(['heart_rate', 'steps', 'sleep', 'weight', 'blood_pressure', 'calories'])
+
+def parse_timestamp(value: Any) -> datetime.datetime:
+    """解析ISO格式的时间戳字符串，格式错误时抛出ValueError"""
+    if isinstance(value, datetime.datetime):
+        return value
+    if not isinstance(value, str):
+        raise ValueError(f"时间戳必须是ISO格式字符串: {value!r}")
+    return datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+
 class HealthDataManager:
     """健康数据管理器"""
     
+    # 汇总表：按小时和按天汇总每个用户每种数据类型的 count/sum/min/max/last
+    HOURLY_ROLLUP_TABLE = "health_data_rollup_hourly"
+    DAILY_ROLLUP_TABLE = "health_data_rollup_daily"
+    
     def __init__(self):
         self.table_name = "health_data"
+        # 统计是否使用汇总表；汇总表不存在时自动关闭，回退到扫描原始数据
+        self.rollups_enabled = os.getenv('HEALTH_ROLLUPS_ENABLED', 'True').lower() == 'true'
         
     def get_health_data(self, user_uuid: str, data_type: str = 'all') -> Dict[str, Any]:
         """
@@ -68,14 +114,14 @@ class HealthDataManager:
             # 按数据类型组织数据
             health_data = {}
             for row in results:
-                data_type = row[0]
+                data_type = row['data_type']
                 if data_type not in health_data:
                     health_data[data_type] = []
                 
                 health_data[data_type].append({
-                    'value': row[1],
-                    'timestamp': row[2].isoformat() if row[2] else None,
-                    'metadata': row[3] or {}
+                    'value': row['value'],
+                    'timestamp': row['timestamp'].isoformat() if row['timestamp'] else None,
+                    'metadata': row['metadata'] or {}
                 })
             
             # 为每种数据类型添加统计信息
@@ -134,11 +180,15 @@ class HealthDataManager:
                 data_type, 
                 str(value), 
                 timestamp, 
-                metadata or {}, 
+                json.dumps(metadata or {}), 
                 datetime.datetime.now()
             )
             
-            rows_affected = db_connector.execute_update(query, params)
+            # 原始记录和小时/天汇总在同一个事务中写入
+            rows_affected = self._write_with_rollups(
+                lambda rollup_queries: db_connector.execute_transaction([(query, params)] + rollup_queries),
+                user_uuid, [(data_type, value, timestamp)]
+            )
             
             if rows_affected > 0:
                 logger.info(f"健康数据添加成功: 用户 {user_uuid}, 类型 {data_type}, 值 {value}")
@@ -151,10 +201,288 @@ class HealthDataManager:
             logger.error(f"添加健康数据失败: {e}")
             return False
     
+    def add_health_data_bulk(self, user_uuid: str, records: Iterable[Tuple[int, Any]],
+                             dedupe: bool = True, chunk_size: int = 500,
+                             max_errors: int = 1000) -> Dict[str, Any]:
+        """
+        批量添加健康数据
+        
+        记录按chunk_size分块：每块先一次性校验，再用一条多行INSERT（executemany）和汇总更新
+        在一个事务中写入；某一块写入失败只影响该块的记录。records可以是生成器（如逐行解析的NDJSON），
+        内存中最多保留一块记录。
+        dedupe时按 (data_type, timestamp)（时间精确到秒）跳过块内重复和已入库的记录，计入duplicates：
+        前面的块在查询下一块之前已提交，同一请求跨块的重复由已入库查询发现，不需要保留整个请求的键。
+        去重是写入前的查询，同一批数据并发上传时仍可能重复写入。
+        
+        Args:
+            user_uuid: 用户UUID
+            records: [(序号, 原始记录), ...]，原始记录为包含data_type/value/timestamp/metadata的字典，
+                     解析失败的记录可传入异常对象，会作为该序号的错误返回
+            dedupe: 是否按 (user_uuid, data_type, timestamp) 去重（请求内和已入库的数据）
+            chunk_size: 每个事务写入的记录数
+            max_errors: 返回的错误明细数量上限
+        
+        Returns:
+            {'received', 'inserted', 'duplicates', 'failed', 'errors': [{'index', 'error_code', 'message'}]}
+        """
+        summary = {'received': 0, 'inserted': 0, 'duplicates': 0, 'failed': 0, 'errors': []}
+        
+        def record_error(index, error_code, message):
+            summary['failed'] += 1
+            if len(summary['errors']) < max_errors:
+                summary['errors'].append({'index': index, 'error_code': error_code, 'message': message})
+        
+        chunk = []
+        for index, raw in records:
+            summary['received'] += 1
+            chunk.append((index, raw))
+            if len(chunk) >= chunk_size:
+                self._ingest_chunk(user_uuid, chunk, dedupe, summary, record_error)
+                chunk = []
+        if chunk:
+            self._ingest_chunk(user_uuid, chunk, dedupe, summary, record_error)
+        
+        summary['errors_truncated'] = summary['failed'] > len(summary['errors'])
+        logger.info(f"批量添加健康数据: 用户 {user_uuid}, 收到 {summary['received']}, "
+                    f"写入 {summary['inserted']}, 重复 {summary['duplicates']}, 失败 {summary['failed']}")
+        return summary
+    
+    def _ingest_chunk(self, user_uuid: str, chunk: List[Tuple[int, Any]], dedupe: bool,
+                      summary: Dict[str, Any], record_error: Callable) -> None:
+        """校验、去重并在一个事务中写入一块记录"""
+        valid = []
+        seen = set()
+        for index, raw in chunk:
+            error = self._validate_record(raw)
+            if error:
+                record_error(index, *error)
+                continue
+            # DATETIME列只保存到秒且不带时区，去重键与入库值保持一致
+            timestamp = raw.get('timestamp')
+            timestamp = parse_timestamp(timestamp) if timestamp else datetime.datetime.now()
+            timestamp = timestamp.replace(tzinfo=None, microsecond=0)
+            if dedupe:
+                key = (raw['data_type'], timestamp)
+                if key in seen:
+                    summary['duplicates'] += 1
+                    continue
+                seen.add(key)
+            valid.append((index, raw['data_type'], raw['value'], timestamp, raw.get('metadata') or {}))
+        
+        if not valid:
+            return
+        
+        query = f"""
+            INSERT INTO {self.table_name}
+            (user_uuid, data_type, value, timestamp, metadata, created_at)
+            VALUES (%s, %s, %s, %s, %s, %s)
+        """
+        try:
+            if dedupe:
+                existing = self._existing_keys(user_uuid, valid)
+                to_insert = [item for item in valid if (item[1], item[3]) not in existing]
+                summary['duplicates'] += len(valid) - len(to_insert)
+                valid = to_insert
+                if not valid:
+                    return
+            now = datetime.datetime.now()
+            params_seq = [
+                (user_uuid, data_type, str(value), timestamp, json.dumps(metadata), now)
+                for _, data_type, value, timestamp, metadata in valid
+            ]
+            self._write_with_rollups(
+                lambda rollup_queries: db_connector.execute_batch(query, params_seq, rollup_queries),
+                user_uuid, [(data_type, value, timestamp) for _, data_type, value, timestamp, _ in valid]
+            )
+            summary['inserted'] += len(valid)
+        except Exception as e:
+            logger.error(f"批量写入健康数据失败: 用户 {user_uuid}, {len(valid)} 条, {e}")
+            for item in valid:
+                record_error(item[0], 'WRITE_FAILED', '写入数据库失败')
+    
+    @staticmethod
+    def _validate_record(raw: Any) -> Optional[Tuple[str, str]]:
+        """校验单条记录，合法返回None，否则返回 (错误码, 错误信息)"""
+        if isinstance(raw, Exception):
+            return 'INVALID_JSON', f'无法解析的记录: {raw}'
+        if not isinstance(raw, dict):
+            return 'INVALID_RECORD', '记录必须是JSON对象'
+        data_type = raw.get('data_type')
+        if not data_type:
+            return 'MISSING_FIELD', '缺少必需字段: data_type'
+        if data_type not in HEALTH_DATA_TYPES:
+            return 'INVALID_DATA_TYPE', f'不支持的数据类型: {data_type}'
+        value = raw.get('value')
+        if value is None or value == '':
+            return 'MISSING_FIELD', '缺少必需字段: value'
+        if isinstance(value, (dict, list, bool)):
+            return 'INVALID_VALUE', '数据值必须是数字或字符串'
+        metadata = raw.get('metadata')
+        if metadata is not None and not isinstance(metadata, dict):
+            return 'INVALID_METADATA', 'metadata必须是JSON对象'
+        timestamp = raw.get('timestamp')
+        if timestamp:
+            try:
+                parse_timestamp(timestamp)
+            except ValueError:
+                return 'INVALID_TIMESTAMP', f'时间戳格式错误: {timestamp}'
+        return None
+    
+    def _existing_keys(self, user_uuid: str, valid: List[tuple]) -> set:
+        """一次查询取出本块时间范围内已入库的 (数据类型, 时间)"""
+        data_types = sorted({item[1] for item in valid})
+        timestamps = [item[3] for item in valid]
+        placeholders = ", ".join(["%s"] * len(data_types))
+        query = f"""
+            SELECT data_type, timestamp
+            FROM {self.table_name}
+            WHERE user_uuid = %s AND data_type IN ({placeholders})
+              AND timestamp BETWEEN %s AND %s
+        """
+        rows = db_connector.execute_query(
+            query, (user_uuid, *data_types, min(timestamps), max(timestamps))
+        )
+        return {(row['data_type'], row['timestamp']) for row in rows}
+    
+    def _write_with_rollups(self, write: Callable[[List[Tuple[str, tuple]]], int], user_uuid: str,
+                            records: Iterable[Tuple[str, Any, datetime.datetime]]) -> int:
+        """
+        写入原始数据并在同一事务中增量更新汇总表
+        
+        Args:
+            write: 执行写入的函数，参数为需要在同一事务中追加执行的汇总语句，返回影响行数
+            user_uuid: 用户UUID
+            records: 本次写入的 [(数据类型, 值, 时间), ...]
+        
+        汇总表不存在时关闭汇总功能，只写入原始数据（统计回退到扫描原始数据）
+        """
+        if not self.rollups_enabled:
+            return write([])
+        
+        rollup_queries = self._rollup_upserts(user_uuid, records)
+        try:
+            return write(rollup_queries)
+        except Exception as e:
+            if getattr(e, 'errno', None) != ER_NO_SUCH_TABLE:
+                raise
+            self.rollups_enabled = False
+            logger.error(f"健康数据汇总表不存在，已关闭汇总功能（请执行 deploy_mysql/migrations/004）: {e}")
+            return write([])
+    
+    def _rollup_upserts(self, user_uuid: str,
+                        records: Iterable[Tuple[str, Any, datetime.datetime]]) -> List[Tuple[str, tuple]]:
+        """
+        把一批记录先在内存中按 (数据类型, 时间桶) 合并，再生成汇总表的 INSERT ... ON DUPLICATE KEY UPDATE
+        
+        Args:
+            user_uuid: 用户UUID
+            records: [(数据类型, 值, 时间), ...]，无法解析为数字的值不计入汇总
+        
+        Returns:
+            [(query, params), ...]
+        """
+        buckets: Dict[Tuple[str, str, datetime.datetime], List] = {}
+        for data_type, value, timestamp in records:
+            number = parse_numeric_value(value)
+            if number is None:
+                continue
+            for table, bucket_start in (
+                (self.HOURLY_ROLLUP_TABLE, timestamp.replace(minute=0, second=0, microsecond=0)),
+                (self.DAILY_ROLLUP_TABLE, timestamp.replace(hour=0, minute=0, second=0, microsecond=0))
+            ):
+                key = (table, data_type, bucket_start)
+                bucket = buckets.get(key)
+                if bucket is None:
+                    # [count, sum, min, max, last_value, last_timestamp]
+                    buckets[key] = [1, number, number, number, number, timestamp]
+                else:
+                    bucket[0] += 1
+                    bucket[1] += number
+                    bucket[2] = min(bucket[2], number)
+                    bucket[3] = max(bucket[3], number)
+                    if timestamp >= bucket[5]:
+                        bucket[4], bucket[5] = number, timestamp
+        
+        queries = []
+        for (table, data_type, bucket_start), (count, total, low, high, last, last_ts) in buckets.items():
+            # last_value必须在last_timestamp之前赋值（MySQL按从左到右的顺序使用已更新的列值）
+            query = f"""
+            INSERT INTO {table}
+            (user_uuid, data_type, bucket_start, sample_count, value_sum, value_min, value_max,
+             last_value, last_timestamp)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE
+                sample_count = sample_count + VALUES(sample_count),
+                value_sum = value_sum + VALUES(value_sum),
+                value_min = LEAST(value_min, VALUES(value_min)),
+                value_max = GREATEST(value_max, VALUES(value_max)),
+                last_value = IF(VALUES(last_timestamp) >= last_timestamp, VALUES(last_value), last_value),
+                last_timestamp = GREATEST(last_timestamp, VALUES(last_timestamp))
+            """
+            queries.append((query, (user_uuid, data_type, bucket_start, count, total, low, high, last, last_ts)))
+        return queries
+    
+    def rebuild_rollups(self, user_uuid: Optional[str] = None) -> None:
+        """
+        根据原始数据重建汇总表（全部用户或指定用户），用于首次上线回填和删除数据后的修正
+        
+        Args:
+            user_uuid: 用户UUID，为None时重建所有用户
+        """
+        user_filter = "WHERE user_uuid = %s" if user_uuid else ""
+        params = (user_uuid,) if user_uuid else ()
+        # 与增量更新（_rollup_upserts）一致：无法解析为数字的值不计入汇总
+        raw_filter = f"WHERE {_NUMERIC_PREFIX_SQL}" + (" AND user_uuid = %s" if user_uuid else "")
+        
+        for table, bucket_expr in (
+            (self.HOURLY_ROLLUP_TABLE, "TIMESTAMP(DATE(timestamp), MAKETIME(HOUR(timestamp), 0, 0))"),
+            (self.DAILY_ROLLUP_TABLE, "TIMESTAMP(DATE(timestamp))")
+        ):
+            # 每个时间桶内最新一条记录的值作为last_value
+            insert_query = f"""
+            INSERT INTO {table}
+            (user_uuid, data_type, bucket_start, sample_count, value_sum, value_min, value_max,
+             last_value, last_timestamp)
+            SELECT user_uuid, data_type, bucket_start,
+                   COUNT(*), SUM(num_value), MIN(num_value), MAX(num_value),
+                   MAX(CASE WHEN rn = 1 THEN num_value END), MAX(timestamp)
+            FROM (
+                SELECT user_uuid, data_type, timestamp,
+                       {bucket_expr} AS bucket_start,
+                       CAST(value AS DECIMAL(20, 4)) AS num_value,
+                       ROW_NUMBER() OVER (
+                           PARTITION BY user_uuid, data_type, {bucket_expr}
+                           ORDER BY timestamp DESC
+                       ) AS rn
+                FROM {self.table_name}
+                {raw_filter}
+            ) raw
+            GROUP BY user_uuid, data_type, bucket_start
+            """
+            db_connector.execute_transaction([
+                (f"DELETE FROM {table} {user_filter}", params),
+                (insert_query, params)
+            ])
+            logger.info(f"健康数据汇总表已重建: {table}" + (f", 用户 {user_uuid}" if user_uuid else ""))
+    
+    # 计算趋势使用的最近数据点数量
+    TREND_WINDOW = 5
+    
+    # 斜率超过该阈值才判定为上升或下降
+    TREND_SLOPE_THRESHOLD = 0.1
+    
     def get_health_stats(self, user_uuid: str, period: str = 'week') -> Dict[str, Any]:
         """
         获取健康数据统计
         
+        一次查询返回所有数据类型的聚合值、最新值和趋势：窗口函数按数据类型给统计周期内的行
+        编号（最新为1），同一遍聚合中算出计数/均值/极值、编号为1的最新值，以及最近TREND_WINDOW个
+        数据点的线性回归求和项，Python端只需按数据类型做常数次运算得到斜率。
+        
+        启用汇总表时，day读取小时汇总，week/month读取天汇总，每种数据类型最多约30行；
+        统计起点对齐到所在小时/天的开始，趋势基于最近TREND_WINDOW个时间桶的均值。
+        汇总表不可用时回退到扫描原始数据。
+        
         Args:
             user_uuid: 用户UUID
             period: 统计周期 (day, week, month)
@@ -174,115 +502,127 @@ class HealthDataManager:
             else:
                 start_date = end_date - datetime.timedelta(weeks=1)  # 默认一周
             
-            # 查询统计数据
-            query = f"""
-            SELECT data_type, 
-                   COUNT(*) as count,
-                   AVG(CAST(value AS DECIMAL)) as avg_value,
-                   MIN(CAST(value AS DECIMAL)) as min_value,
-                   MAX(CAST(value AS DECIMAL)) as max_value
-            FROM {self.table_name} 
-            WHERE user_uuid = %s AND timestamp >= %s
-            GROUP BY data_type
-            """
+            results = None
+            if self.rollups_enabled:
+                try:
+                    results = db_connector.execute_query(*self._rollup_stats_query(user_uuid, period, start_date))
+                except Exception as e:
+                    if getattr(e, 'errno', None) != ER_NO_SUCH_TABLE:
+                        raise
+                    self.rollups_enabled = False
+                    logger.error(f"健康数据汇总表不存在，统计回退到原始数据: {e}")
+            if results is None:
+                results = db_connector.execute_query(*self._raw_stats_query(user_uuid, start_date))
             
-            params = (user_uuid, start_date)
-            results = db_connector.execute_query(query, params)
-            
-            # 按数据类型统计
             stats = {}
             for row in results:
-                data_type = row[0]
-                count = row[1]
-                avg_value = float(row[2]) if row[2] is not None else None
-                min_value = float(row[3]) if row[3] is not None else None
-                max_value = float(row[4]) if row[4] is not None else None
-                
-                stats[data_type] = {
+                stats[row['data_type']] = {
                     'stats': {
-                        'count': count,
-                        'average': avg_value,
-                        'max': max_value,
-                        'min': min_value,
-                        'latest': None,  # 需要额外查询最新值
-                        'trend': 'no_data'  # 需要额外计算趋势
+                        'count': int(row['count']),
+                        'average': self._to_float(row['avg_value']),
+                        'max': self._to_float(row['max_value']),
+                        'min': self._to_float(row['min_value']),
+                        'latest': self._to_float(row['latest_value']),
+                        'trend': self._trend_from_sums(
+                            row['trend_n'], row['sum_x'], row['sum_y'], row['sum_xy'], row['sum_xx']
+                        )
                     }
                 }
             
-            # 计算统计指标（已通过SQL查询获得基本统计信息）
-            # 这里可以添加获取最新值和计算趋势的逻辑
-            for data_type, data in stats.items():
-                # 获取最新值
-                latest_query = f"""
-                SELECT value 
-                FROM {self.table_name} 
-                WHERE user_uuid = %s AND data_type = %s 
-                ORDER BY timestamp DESC 
-                LIMIT 1
-                """
-                latest_params = (user_uuid, data_type)
-                latest_result = db_connector.execute_query(latest_query, latest_params)
-                
-                if latest_result:
-                    data['stats']['latest'] = float(latest_result[0][0]) if latest_result[0][0] is not None else None
-                
-                # 计算趋势（简化版本，使用最近5个值）
-                trend_query = f"""
-                SELECT value 
-                FROM {self.table_name} 
-                WHERE user_uuid = %s AND data_type = %s 
-                ORDER BY timestamp DESC 
-                LIMIT 5
-                """
-                trend_params = (user_uuid, data_type)
-                trend_results = db_connector.execute_query(trend_query, trend_params)
-                
-                if len(trend_results) >= 2:
-                    trend_values = [float(row[0]) for row in trend_results if row[0] is not None]
-                    if trend_values:
-                        data['stats']['trend'] = self._calculate_trend(trend_values)
-            
             return stats
             
         except Exception as e:
             logger.error(f"获取健康数据统计失败: {e}")
             return {}
     
-    def _calculate_trend(self, values: List[float]) -> str:
+    # 趋势的横坐标取 -rn（越新越大），斜率与横坐标的平移无关
+    _TREND_COLUMNS = """
+                   COUNT(CASE WHEN rn <= %s THEN y END) AS trend_n,
+                   SUM(CASE WHEN rn <= %s AND y IS NOT NULL THEN -rn END) AS sum_x,
+                   SUM(CASE WHEN rn <= %s THEN y END) AS sum_y,
+                   SUM(CASE WHEN rn <= %s THEN -rn * y END) AS sum_xy,
+                   SUM(CASE WHEN rn <= %s AND y IS NOT NULL THEN rn * rn END) AS sum_xx"""
+    
+    def _raw_stats_query(self, user_uuid: str, start_date: datetime.datetime) -> Tuple[str, tuple]:
+        """扫描统计周期内的原始数据"""
+        query = f"""
+            WITH ranked AS (
+                SELECT data_type,
+                       CAST(value AS DECIMAL(20, 4)) AS y,
+                       ROW_NUMBER() OVER (PARTITION BY data_type ORDER BY timestamp DESC) AS rn
+                FROM {self.table_name}
+                WHERE user_uuid = %s AND timestamp >= %s
+            )
+            SELECT data_type,
+                   COUNT(*) AS count,
+                   AVG(y) AS avg_value,
+                   MIN(y) AS min_value,
+                   MAX(y) AS max_value,
+                   MAX(CASE WHEN rn = 1 THEN y END) AS latest_value,{self._TREND_COLUMNS}
+            FROM ranked
+            GROUP BY data_type
+            """
+        window = self.TREND_WINDOW
+        return query, (user_uuid, start_date, window, window, window, window, window)
+    
+    def _rollup_stats_query(self, user_uuid: str, period: str,
+                            start_date: datetime.datetime) -> Tuple[str, tuple]:
+        """读取统计周期内的小时汇总（day）或天汇总（week/month）"""
+        if period == 'day':
+            table = self.HOURLY_ROLLUP_TABLE
+            bucket_start = start_date.replace(minute=0, second=0, microsecond=0)
+        else:
+            table = self.DAILY_ROLLUP_TABLE
+            bucket_start = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
+        
+        query = f"""
+            WITH ranked AS (
+                SELECT data_type, sample_count, value_sum, value_min, value_max, last_value,
+                       value_sum / sample_count AS y,
+                       ROW_NUMBER() OVER (PARTITION BY data_type ORDER BY bucket_start DESC) AS rn
+                FROM {table}
+                WHERE user_uuid = %s AND bucket_start >= %s AND sample_count > 0
+            )
+            SELECT data_type,
+                   SUM(sample_count) AS count,
+                   SUM(value_sum) / SUM(sample_count) AS avg_value,
+                   MIN(value_min) AS min_value,
+                   MAX(value_max) AS max_value,
+                   MAX(CASE WHEN rn = 1 THEN last_value END) AS latest_value,{self._TREND_COLUMNS}
+            FROM ranked
+            GROUP BY data_type
+            """
+        window = self.TREND_WINDOW
+        return query, (user_uuid, bucket_start, window, window, window, window, window)
+    
+    @staticmethod
+    def _to_float(value: Any) -> Optional[float]:
+        return float(value) if value is not None else None
+    
+    def _trend_from_sums(self, n: int, sum_x: Any, sum_y: Any, sum_xy: Any, sum_xx: Any) -> str:
         """
-        计算数据趋势
+        根据线性回归的求和项计算数据趋势
         
         Args:
-            values: 数值列表
+            n: 数据点数量
+            sum_x, sum_y, sum_xy, sum_xx: 横坐标（时间顺序）与数值的求和项
         
         Returns:
             趋势描述 (increasing, decreasing, stable, no_data)
         """
-        if len(values) < 2:
+        if not n or n < 2:
             return 'no_data'
         
-        # 取最近5个值计算趋势
-        recent_values = values[-5:]
-        
-        # 计算斜率
-        x = list(range(len(recent_values)))
-        y = recent_values
-        
-        n = len(x)
-        sum_x = sum(x)
-        sum_y = sum(y)
-        sum_xy = sum(x[i] * y[i] for i in range(n))
-        sum_x2 = sum(x_i * x_i for x_i in x)
-        
-        try:
-            slope = (n * sum_xy - sum_x * sum_y) / (n * sum_x2 - sum_x * sum_x)
-        except ZeroDivisionError:
+        sum_x, sum_y, sum_xy, sum_xx = float(sum_x), float(sum_y), float(sum_xy), float(sum_xx)
+        denominator = n * sum_xx - sum_x * sum_x
+        if denominator == 0:
             return 'stable'
+        slope = (n * sum_xy - sum_x * sum_y) / denominator
         
         # 根据斜率判断趋势
-        if slope > 0.1:
+        if slope > self.TREND_SLOPE_THRESHOLD:
             return 'increasing'
-        elif slope < -0.1:
+        elif slope < -self.TREND_SLOPE_THRESHOLD:
             return 'decreasing'
         else:
             return 'stable'
@@ -313,10 +653,10 @@ class HealthDataManager:
             records = []
             for row in results:
                 records.append({
-                    'data_type': row[0],
-                    'value': row[1],
-                    'timestamp': row[2].isoformat() if row[2] else None,
-                    'metadata': row[3] or {}
+                    'data_type': row['data_type'],
+                    'value': row['value'],
+                    'timestamp': row['timestamp'].isoformat() if row['timestamp'] else None,
+                    'metadata': row['metadata'] or {}
                 })
             
             return records
@@ -365,6 +705,12 @@ class HealthDataManager:
             
             if rows_affected > 0:
                 logger.info(f"健康数据删除成功: 用户 {user_uuid}")
+                # 删除无法增量扣减min/max/last，按原始数据重建该用户的汇总
+                if self.rollups_enabled:
+                    try:
+                        self.rebuild_rollups(user_uuid)
+                    except Exception as e:
+                        logger.error(f"重建健康数据汇总失败: 用户 {user_uuid}, {e}")
                 return True
             else:
                 logger.warning(f"未找到要删除的健康数据: 用户 {user_uuid}")
@@ -5,11 +5,20 @@
 """
 
 from flask import request, jsonify
+import os
+import json
 import logging
 from . import data_bp
 
 logger = logging.getLogger(__name__)
 
+# 批量写入：JSON数组的最大记录数（更大的同步请使用NDJSON流式上传）和每个事务写入的记录数
+BULK_MAX_RECORDS = int(os.getenv('HEALTH_BULK_MAX_RECORDS', 10000))
+BULK_CHUNK_SIZE = int(os.getenv('HEALTH_BULK_CHUNK_SIZE', 500))
+
+# 按行解析的NDJSON请求类型
+NDJSON_MIMETYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl')
+
 # 导入数据库管理器和JWT验证装饰器
 try:
     from .health_data_manager import health_data_manager
@@ -149,6 +158,80 @@ def add_health_data(current_user):
             'error_code': 'INTERNAL_ERROR'
         }), 500
 
+def _iter_ndjson_records():
+    """逐行读取NDJSON请求体，解析失败的行以异常对象返回，由管理器记为该行的错误"""
+    index = 0
+    for line in request.stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield index, json.loads(line)
+        except ValueError as e:
+            yield index, e
+        index += 1
+
+# 批量添加健康数据接口
+@data_bp.route('/bulk', methods=['POST'])
+@token_required
+def add_health_data_bulk(current_user):
+    """
+    批量添加健康数据
+    
+    请求体为记录数组、{"records": [...]}，或NDJSON（Content-Type: application/x-ndjson，每行一条记录）。
+    查询参数dedupe=false时不按 (data_type, timestamp) 去重。
+    """
+    
+    user_uuid = request.uuid
+    dedupe = request.args.get('dedupe', 'true').lower() != 'false'
+    
+    if request.mimetype in NDJSON_MIMETYPES:
+        records = _iter_ndjson_records()
+    else:
+        data = request.get_json(silent=True)
+        if isinstance(data, dict):
+            data = data.get('records')
+        if not isinstance(data, list):
+            return jsonify({
+                'status': 'error',
+                'message': '请求体必须是记录数组、包含records数组的对象或NDJSON',
+                'error_code': 'INVALID_PAYLOAD'
+            }), 400
+        if len(data) > BULK_MAX_RECORDS:
+            return jsonify({
+                'status': 'error',
+                'message': f'单次最多提交 {BULK_MAX_RECORDS} 条记录，更多数据请使用NDJSON流式上传',
+                'error_code': 'TOO_MANY_RECORDS'
+            }), 413
+        records = enumerate(data)
+    
+    try:
+        summary = health_data_manager.add_health_data_bulk(
+            user_uuid, records, dedupe=dedupe, chunk_size=BULK_CHUNK_SIZE
+        )
+    except Exception as e:
+        logger.error(f"批量添加健康数据失败: {e}")
+        return jsonify({
+            'status': 'error',
+            'message': '批量添加健康数据失败，请稍后重试',
+            'error_code': 'INTERNAL_ERROR'
+        }), 500
+    
+    summary['uuid'] = user_uuid
+    if summary['failed'] and not summary['inserted'] and not summary['duplicates']:
+        return jsonify({
+            'status': 'error',
+            'message': '所有记录均未写入',
+            'error_code': 'BULK_INGEST_FAILED',
+            'data': summary
+        }), 400
+    
+    return jsonify({
+        'status': 'success' if not summary['failed'] else 'partial_success',
+        'message': '批量添加健康数据完成',
+        'data': summary
+    })
+
 # 获取健康数据统计接口
 @data_bp.route('/stats', methods=['GET'])
 @token_required
@@ -12,6 +12,9 @@ import logging
 import datetime
 from . import mental_bp
 from utils.jwt_utils import token_required, token_optional
+from utils.db_connector import db_connector
+from utils.http_client import create_upstream_client
+from utils.sse_relay import SSEFrameWatcher, relay_sse
 from ..sessions.session_manager import session_manager
 
 logger = logging.getLogger(__name__)
@@ -32,6 +35,12 @@ headers = {
     "Content-Type": "application/json"
 }
 
+# Mental Agent上游客户端（keep-alive连接池、超时和重试）
+mental_agent_client = create_upstream_client('mental_agent', read_timeout=60)
+
+# 流式对话默认是否原样转发Mental Agent的SSE事件（请求参数relay可单独指定）
+STREAM_RELAY_DEFAULT = os.getenv("MENTAL_STREAM_RELAY", "false").lower() == "true"
+
 # === 处理会话和消息存储 ===
 def handle_session_and_storage(user_uuid, session_id, user_input, ai_response):
     """
@@ -50,49 +59,43 @@ def handle_session_and_storage(user_uuid, session_id, user_input, ai_response):
     is_new_session = False
     
     try:
-        # 如果没有提供session_id，创建新会话
-        if not actual_session_id:
-            session_info = session_manager.create_session(user_uuid, 'mental')
-            if session_info:
-                actual_session_id = session_info['session_id']
-                is_new_session = True
-                logger.info(f"创建新心理健康会话: {actual_session_id}")
-            else:
-                logger.error("创建新心理健康会话失败")
-                return None, None, False
-        else:
-            # 检查会话是否存在且属于当前用户
-            session_info = session_manager.get_session(actual_session_id)
-            if not session_info or session_info['user_uuid'] != user_uuid:
-                logger.warning(f"心理健康会话不存在或不属于当前用户: {actual_session_id}")
-                # 创建新会话
+        # 会话校验、conversation_id查询和消息写入复用同一个连接
+        with db_connector.connection_scope():
+            # 如果没有提供session_id，创建新会话
+            if not actual_session_id:
                 session_info = session_manager.create_session(user_uuid, 'mental')
                 if session_info:
                     actual_session_id = session_info['session_id']
                     is_new_session = True
-                    logger.info(f"创建新心理健康会话替代无效会话: {actual_session_id}")
+                    logger.info(f"创建新心理健康会话: {actual_session_id}")
                 else:
                     logger.error("创建新心理健康会话失败")
                     return None, None, False
+            else:
+                # 一次查询（缓存命中时不查询）完成会话归属校验并取得conversation_id
+                session_info = session_manager.resolve_session(actual_session_id, user_uuid)
+                if not session_info:
+                    logger.warning(f"心理健康会话不存在或不属于当前用户: {actual_session_id}")
+                    # 创建新会话
+                    session_info = session_manager.create_session(user_uuid, 'mental')
+                    if session_info:
+                        actual_session_id = session_info['session_id']
+                        is_new_session = True
+                        logger.info(f"创建新心理健康会话替代无效会话: {actual_session_id}")
+                    else:
+                        logger.error("创建新心理健康会话失败")
+                        return None, None, False
+        
+            conversation_id = session_info['conversation_id']
+        
+            # 用户消息和AI回复在一个事务中写入
+            if user_input or ai_response:
+                session_manager.add_turn(actual_session_id, user_input, ai_response, {
+                    'conversation_id': conversation_id,
+                    'timestamp': datetime.datetime.now().isoformat()
+                })
         
-        # 获取或创建conversation_id
-        conversation_id = session_manager.get_or_create_conversation_id(actual_session_id)
-        
-        # 存储用户消息
-        if user_input:
-            session_manager.add_message(actual_session_id, 'user', user_input, {
-                'conversation_id': conversation_id,
-                'timestamp': datetime.datetime.now().isoformat()
-            })
-        
-        # 存储AI回复
-        if ai_response:
-            session_manager.add_message(actual_session_id, 'assistant', ai_response, {
-                'conversation_id': conversation_id,
-                'timestamp': datetime.datetime.now().isoformat()
-            })
-        
-        return actual_session_id, conversation_id, is_new_session
+            return actual_session_id, conversation_id, is_new_session
         
     except Exception as e:
         logger.error(f"处理心理健康会话存储异常: {e}")
@@ -110,9 +113,9 @@ def call_mental_agent(endpoint, payload=None, method='POST', timeout=60):
         }
         
         if method.upper() == 'GET':
-            response = requests.get(url, headers=headers, timeout=timeout)
+            response = mental_agent_client.get(url, headers=headers, read_timeout=timeout)
         else:
-            response = requests.post(url, headers=headers, json=payload, timeout=timeout)
+            response = mental_agent_client.post(url, headers=headers, json=payload, read_timeout=timeout)
         
         if response.status_code != 200:
             logger.error(f"Mental Agent服务调用失败: {response.status_code} - {response.text}")
@@ -167,11 +170,13 @@ def mental_text_chat(current_user):
         
         # 处理会话存储
         actual_session_id = session_id
+        conversation_id = None
         is_new_session = False
         
         if user_uuid and user_uuid != "anonymous_user":
+            # 用户消息与AI回复在调用结束后作为一轮一起写入
             actual_session_id, conversation_id, is_new_session = handle_session_and_storage(
-                user_uuid, session_id, user_input, None  # 先不存储AI回复
+                user_uuid, session_id, None, None
             )
             
             if not actual_session_id:
@@ -182,30 +187,40 @@ def mental_text_chat(current_user):
                     "data": None
                 }), 500
         
+        user_metadata = {
+            'conversation_id': conversation_id,
+            'timestamp': datetime.datetime.now().isoformat()
+        }
+        
         # 调用Mental Agent聊天接口
         payload = {
             "message": user_input,
             "session_id": actual_session_id or "anonymous_session"
         }
         
-        result = call_mental_agent(CHAT_ENDPOINT, payload)
-        
-        if not result or 'response' not in result:
-            logger.error("Mental Agent聊天接口调用失败")
-            return jsonify({
-                "status": "error",
-                "message": "心理健康服务暂时不可用，请稍后重试",
-                "data": None
-            }), 500
-        
-        ai_response = result.get('response', '')
-        
-        # 存储AI回复（仅在提供了user_uuid时）
-        if user_uuid and user_uuid != "anonymous_user" and ai_response:
-            session_manager.add_message(actual_session_id, 'assistant', ai_response, {
+        ai_response = None
+        ai_metadata = None
+        try:
+            result = call_mental_agent(CHAT_ENDPOINT, payload)
+            
+            if not result or 'response' not in result:
+                logger.error("Mental Agent聊天接口调用失败")
+                return jsonify({
+                    "status": "error",
+                    "message": "心理健康服务暂时不可用，请稍后重试",
+                    "data": None
+                }), 500
+            
+            ai_response = result.get('response', '')
+            ai_metadata = {
                 'conversation_id': result.get('session_id', 'default'),
                 'timestamp': datetime.datetime.now().isoformat()
-            })
+            }
+        finally:
+            # 一轮对话的消息一次写入；AI调用失败时只写入用户消息（仅在提供了user_uuid时）
+            if user_uuid and user_uuid != "anonymous_user":
+                session_manager.add_turn(actual_session_id, user_input, ai_response,
+                                         user_metadata, ai_metadata)
 
         # 构建响应数据
         response_data = {
@@ -231,6 +246,63 @@ def mental_text_chat(current_user):
             "data": None
         }), 500
 
+# === 流式对话原样转发 ===
+def relay_mental_stream(user_uuid, session_id, is_new_session, user_input, user_metadata, payload):
+    """
+    原样转发Mental Agent的SSE事件（chunk / complete / error）
+    
+    不逐帧解析和重新封装，只解析complete事件取完整回复用于保存；会话信息通过响应头
+    X-Session-Id、X-New-Session返回。客户端中途断开时取消上游请求，只保存用户消息。
+    """
+    url = f"{MENTAL_AGENT_BASE_URL}{CHAT_STREAM_ENDPOINT}"
+    try:
+        response = mental_agent_client.post(url, headers=headers, json=payload, stream=True)
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Mental Agent流式聊天接口调用失败: {e}")
+        if user_uuid and user_uuid != "anonymous_user":
+            session_manager.add_turn(session_id, user_input, None, user_metadata, None)
+        return jsonify({
+            "status": "error",
+            "message": "心理健康服务暂时不可用",
+            "data": None
+        }), 503
+    
+    if response.status_code != 200:
+        logger.error(f"Mental Agent流式聊天接口调用失败: {response.status_code}")
+        response.close()
+        if user_uuid and user_uuid != "anonymous_user":
+            session_manager.add_turn(session_id, user_input, None, user_metadata, None)
+        return jsonify({
+            "status": "error",
+            "message": "心理健康服务暂时不可用",
+            "data": None
+        }), 503
+    
+    completed = {}
+    watcher = SSEFrameWatcher('complete', lambda event: completed.update(event.get('data') or {}))
+    environ = request.environ
+    
+    def generate():
+        try:
+            yield from relay_sse(response, environ, watcher)
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Mental Agent流式转发中断: {e}")
+        finally:
+            # 收到complete事件才保存AI回复，中途断开或出错时只保存用户消息
+            ai_response = completed.get('full_content') if completed else None
+            ai_metadata = {
+                'conversation_id': completed.get('conversation_id'),
+                'timestamp': datetime.datetime.now().isoformat()
+            } if completed else None
+            if user_uuid and user_uuid != "anonymous_user":
+                session_manager.add_turn(session_id, user_input, ai_response,
+                                         user_metadata, ai_metadata)
+    
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no',
+                             'X-Session-Id': session_id or '',
+                             'X-New-Session': 'true' if is_new_session else 'false'})
+
 # === 流式对话接口 ===
 @mental_bp.route('/chat/stream', methods=['POST'])
 @token_required
@@ -268,11 +340,13 @@ def mental_text_chat_stream(current_user):
         
         # 处理会话存储
         actual_session_id = session_id
+        conversation_id = None
         is_new_session = False
         
         if user_uuid and user_uuid != "anonymous_user":
+            # 用户消息与AI回复在调用结束后作为一轮一起写入
             actual_session_id, conversation_id, is_new_session = handle_session_and_storage(
-                user_uuid, session_id, user_input, None  # 先不存储AI回复
+                user_uuid, session_id, None, None
             )
             
             if not actual_session_id:
@@ -283,16 +357,32 @@ def mental_text_chat_stream(current_user):
                     "data": None
                 }), 500
         
+        user_metadata = {
+            'conversation_id': conversation_id,
+            'timestamp': datetime.datetime.now().isoformat()
+        }
+        
         # 调用Mental Agent流式聊天接口
         payload = {
             "message": user_input,
             "session_id": actual_session_id or "anonymous_session"
         }
         
+        relay = data.get('relay', STREAM_RELAY_DEFAULT)
+        if isinstance(relay, str):
+            relay = relay.lower() in ('1', 'true', 'yes')
+        
+        if relay:
+            return relay_mental_stream(user_uuid, actual_session_id, is_new_session,
+                                       user_input, user_metadata, payload)
+        
         def generate():
+            ai_response = None
+            ai_metadata = None
+            response = None
             try:
                 url = f"{MENTAL_AGENT_BASE_URL}{CHAT_STREAM_ENDPOINT}"
-                response = requests.post(url, headers=headers, json=payload, stream=True, timeout=60)
+                response = mental_agent_client.post(url, headers=headers, json=payload, stream=True)
                 
                 if response.status_code != 200:
                     logger.error(f"Mental Agent流式聊天接口调用失败: {response.status_code}")
@@ -304,7 +394,7 @@ def mental_text_chat_stream(current_user):
                     yield f"data: {error_data}\n\n"
                     return
                 
-                ai_response = ""
+                streamed_response = ""
                 for line in response.iter_lines():
                     if line:
                         try:
@@ -319,7 +409,7 @@ def mental_text_chat_stream(current_user):
                                     chunk_data = data_json.get('data', {})
                                     chunk = chunk_data.get('content', '')
                                     if chunk:
-                                        ai_response += chunk
+                                        streamed_response += chunk
                                         chunk_data = json.dumps({
                                             'status': 'success',
                                             'message': '流式回复中',
@@ -339,12 +429,12 @@ def mental_text_chat_stream(current_user):
                             logger.error(f"流式数据处理异常: {e}")
                             continue
                 
-                # 存储完整的AI回复（仅在提供了user_uuid时）
-                if user_uuid and user_uuid != "anonymous_user" and ai_response:
-                    session_manager.add_message(actual_session_id, 'assistant', ai_response, {
-                        'conversation_id': 'stream_conversation',
-                        'timestamp': datetime.datetime.now().isoformat()
-                    })
+                # 流正常结束才保存完整的AI回复，客户端中途断开时只保存用户消息
+                ai_response = streamed_response
+                ai_metadata = {
+                    'conversation_id': 'stream_conversation',
+                    'timestamp': datetime.datetime.now().isoformat()
+                }
                 
                 complete_data = json.dumps({
                     'status': 'success',
@@ -383,6 +473,14 @@ def mental_text_chat_stream(current_user):
                     'data': None
                 })
                 yield f"data: {error_data}\n\n"
+            finally:
+                # 连接归还连接池
+                if response is not None:
+                    response.close()
+                # 一轮对话的消息一次写入（仅在提供了user_uuid时）
+                if user_uuid and user_uuid != "anonymous_user":
+                    session_manager.add_turn(actual_session_id, user_input, ai_response,
+                                             user_metadata, ai_metadata)
         
         return Response(stream_with_context(generate()), mimetype='text/plain')
             
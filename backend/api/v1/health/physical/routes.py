@@ -10,17 +10,29 @@ import json
 import uuid
 import os
 import logging
+import time
 import datetime
+import functools
 from . import physical_bp
 from utils.jwt_utils import token_required, token_optional
+from utils.db_connector import db_connector
+from utils.latency_stats import get_latency_stats
+from utils.http_client import create_upstream_client
 from ..sessions.session_manager import session_manager
+from ..sessions.chat_history_cache import chat_history_cache, build_chat_history
 
 logger = logging.getLogger(__name__)
 
 # === Coze API 配置 ===
 API_KEY = os.getenv("COZE_API_KEY", "pat_DyjwNAuK4thhVGMDE7WusSNFPFYwfiEEwYOs7WbOoZ9QJjNpXoQXPkNERk2Ld2aO")
 BOT_ID = "7559087768224432170"  # Coze Agent ID
-BASE_URL = "https://api.coze.cn/open_api/v2/chat"
+BASE_URL = os.getenv("COZE_CHAT_URL", "https://api.coze.cn/open_api/v2/chat")
+# 非流式调用等待完整回复的最长秒数；流式调用时两段增量之间的最长等待秒数
+READ_TIMEOUT = int(os.getenv("COZE_READ_TIMEOUT", 120))
+STREAM_READ_TIMEOUT = int(os.getenv("COZE_STREAM_READ_TIMEOUT", 60))
+
+# Coze上游客户端（keep-alive连接池、超时和重试）
+coze_client = create_upstream_client('coze', read_timeout=READ_TIMEOUT)
 
 # === 请求头 ===
 headers = {
@@ -33,92 +45,52 @@ def generate_conversation_id():
     return str(uuid.uuid4())
 
 # === 从数据库获取历史会话记录 ===
+def load_recent_turns_from_db(session_id, max_turns=10):
+    """
+    从数据库加载指定会话最近的完整对话轮次（用户消息后紧跟AI回复）
+    
+    Args:
+        session_id: 会话ID
+        max_turns: 最多返回的轮数
+        
+    Returns:
+        list: [(用户消息, AI回复), ...]，按时间升序
+    """
+    # 获取会话最新的50条消息（按时间升序返回），没有回复的用户消息不计入
+    messages = session_manager.get_session_messages(session_id, limit=50)
+    
+    turns = []
+    pending_user = None
+    for msg in messages:
+        if msg['message_type'] == 'user':
+            pending_user = msg['content']
+        elif msg['message_type'] == 'assistant' and pending_user is not None:
+            turns.append((pending_user, msg['content']))
+            pending_user = None
+    return turns[-max_turns:]
+
 def get_chat_history_from_db(session_id):
     """
-    从数据库获取指定会话的历史记录，最多10轮对话（20条记录）
+    获取指定会话的历史记录，最多10轮对话（20条记录）
+    
+    优先使用本进程的对话窗口缓存，未命中时从数据库加载并初始化缓存
     
     Args:
         session_id: 会话ID
         
     Returns:
-        list: 格式化的chat_history列表，包含role和content字段
+        list: 格式化的chat_history列表，包含role和content字段，最早的对话在前面（Coze API要求）
     """
+    chat_history = chat_history_cache.get(session_id)
+    if chat_history is not None:
+        return chat_history
+    
     try:
-        # 获取会话的所有消息，按时间升序排列
-        messages = session_manager.get_session_messages(session_id, limit=50)
-        
-        if not messages:
-            return []
-        
-        # 过滤出user和assistant类型的消息
-        filtered_messages = [msg for msg in messages if msg['message_type'] in ['user', 'assistant']]
-        
-        # 按时间倒序排列，获取最新的消息
-        filtered_messages.sort(key=lambda x: x['timestamp'], reverse=True)
-        
-        # 构建成对的对话历史
-        chat_history = []
-        user_message = None
-        
-        for msg in filtered_messages:
-            if msg['message_type'] == 'user':
-                # 如果已经有user消息，说明找到了一个完整的对话轮次
-                if user_message:
-                    # 将assistant消息添加到历史（如果存在）
-                    if chat_history and chat_history[-1]['role'] == 'assistant':
-                        # 已经添加了assistant消息，现在添加user消息
-                        chat_history.append({
-                            "role": "user",
-                            "content": user_message['content'],
-                            "content_type": "text"
-                        })
-                    else:
-                        # 先添加user消息，再添加assistant消息
-                        chat_history.append({
-                            "role": "user",
-                            "content": user_message['content'],
-                            "content_type": "text"
-                        })
-                        # 如果当前消息是user，但还没有对应的assistant，跳过
-                        
-                # 保存当前user消息
-                user_message = msg
-                
-            elif msg['message_type'] == 'assistant' and user_message:
-                # 找到一对完整的对话：user -> assistant
-                # 先添加assistant消息
-                chat_history.append({
-                    "role": "assistant",
-                    "content": msg['content'],
-                    "content_type": "text"
-                })
-                # 再添加user消息
-                chat_history.append({
-                    "role": "user",
-                    "content": user_message['content'],
-                    "content_type": "text"
-                })
-                
-                # 重置user_message，准备下一轮
-                user_message = None
-                
-                # 检查是否达到10轮对话（20条记录）
-                if len(chat_history) >= 20:
-                    break
-        
-        # 处理最后一条user消息（如果没有对应的assistant消息）
-        if user_message and len(chat_history) < 20:
-            chat_history.append({
-                "role": "user",
-                "content": user_message['content'],
-                "content_type": "text"
-            })
-        
-        # 反转列表，使最早的对话在前面（Coze API要求）
-        chat_history.reverse()
-        
-        # 限制最多20条记录
-        chat_history = chat_history[:20]
+        # 先取版本号再读数据库：读取期间有新的一轮提交时，窗口下次使用即失效
+        version = chat_history_cache.current_version(session_id)
+        turns = load_recent_turns_from_db(session_id, chat_history_cache.max_turns)
+        chat_history_cache.seed(session_id, turns, version)
+        chat_history = build_chat_history(turns)
         
         logger.info(f"从数据库获取历史记录成功: session_id={session_id}, 记录数={len(chat_history)}")
         return chat_history
@@ -145,100 +117,156 @@ def handle_session_and_storage(user_uuid, session_id, user_input, ai_response):
     is_new_session = False
     
     try:
-        # 如果没有提供session_id，创建新会话
-        if not actual_session_id:
-            session_info = session_manager.create_session(user_uuid, 'physical')
-            if session_info:
-                actual_session_id = session_info['session_id']
-                is_new_session = True
-                logger.info(f"创建新会话: {actual_session_id}")
-            else:
-                logger.error("创建新会话失败")
-                return None, None, False
-        else:
-            # 检查会话是否存在且属于当前用户
-            session_info = session_manager.get_session(actual_session_id)
-            if not session_info or session_info['user_uuid'] != user_uuid:
-                logger.warning(f"会话不存在或不属于当前用户: {actual_session_id}")
-                # 创建新会话
+        # 会话校验、conversation_id查询和消息写入复用同一个连接
+        with db_connector.connection_scope():
+            # 如果没有提供session_id，创建新会话
+            if not actual_session_id:
                 session_info = session_manager.create_session(user_uuid, 'physical')
                 if session_info:
                     actual_session_id = session_info['session_id']
                     is_new_session = True
-                    logger.info(f"创建新会话替代无效会话: {actual_session_id}")
+                    logger.info(f"创建新会话: {actual_session_id}")
                 else:
                     logger.error("创建新会话失败")
                     return None, None, False
+            else:
+                # 一次查询（缓存命中时不查询）完成会话归属校验并取得conversation_id
+                session_info = session_manager.resolve_session(actual_session_id, user_uuid)
+                if not session_info:
+                    logger.warning(f"会话不存在或不属于当前用户: {actual_session_id}")
+                    # 创建新会话
+                    session_info = session_manager.create_session(user_uuid, 'physical')
+                    if session_info:
+                        actual_session_id = session_info['session_id']
+                        is_new_session = True
+                        logger.info(f"创建新会话替代无效会话: {actual_session_id}")
+                    else:
+                        logger.error("创建新会话失败")
+                        return None, None, False
         
-        # 获取或创建conversation_id
-        conversation_id = session_manager.get_or_create_conversation_id(actual_session_id)
-        
-        # 存储用户消息
-        if user_input:
-            session_manager.add_message(actual_session_id, 'user', user_input, {
-                'conversation_id': conversation_id,
-                'timestamp': datetime.datetime.now().isoformat()
-            })
+            conversation_id = session_info['conversation_id']
         
-        # 存储AI回复
-        if ai_response:
-            session_manager.add_message(actual_session_id, 'assistant', ai_response, {
-                'conversation_id': conversation_id,
-                'timestamp': datetime.datetime.now().isoformat()
-            })
+            # 用户消息和AI回复在一个事务中写入
+            if user_input or ai_response:
+                session_manager.add_turn(actual_session_id, user_input, ai_response, {
+                    'conversation_id': conversation_id,
+                    'timestamp': datetime.datetime.now().isoformat()
+                })
         
-        return actual_session_id, conversation_id, is_new_session
+            return actual_session_id, conversation_id, is_new_session
         
     except Exception as e:
         logger.error(f"处理会话存储异常: {e}")
         return actual_session_id, None, is_new_session
 
-# === 调用AI模型处理健康对话 ===
-def call_health_agent(user_input, session_id=None, user_uuid=None):
-    """调用Coze AI模型处理身体健康对话"""
+# === 调用AI模型前的会话处理 ===
+def prepare_health_agent_call(user_input, session_id=None, user_uuid=None, stream=False):
+    """
+    校验会话、加载历史记录并构造Coze请求体
     
-    try:
-        # 处理会话存储（仅在提供了user_uuid时）
-        conversation_id = None
-        actual_session_id = session_id
-        is_new_session = False
-        chat_history = []  # 初始化chat_history
-        
-        if user_uuid and user_uuid != "anonymous_user":
+    Returns:
+        tuple: (调用上下文, 错误结果)，会话管理失败时调用上下文为None
+    """
+    context = {
+        'session_id': session_id,
+        'conversation_id': None,
+        'is_new_session': False,
+        'store_turn': bool(user_uuid and user_uuid != "anonymous_user"),
+        'user_message_time': datetime.datetime.now().isoformat()
+    }
+    chat_history = []
+    
+    if context['store_turn']:
+        # 调用AI之前的所有数据库操作复用同一个连接，调用AI期间不占用连接
+        with db_connector.connection_scope():
+            # 用户消息与AI回复在调用结束后作为一轮一起写入
             actual_session_id, conversation_id, is_new_session = handle_session_and_storage(
-                user_uuid, session_id, user_input, None  # 先不存储AI回复
+                user_uuid, session_id, None, None
             )
             
             if not actual_session_id:
                 logger.error("会话存储失败")
-                return {
+                return None, {
                     "status": "error",
                     "message": "会话管理失败，请重试",
                     "data": None
                 }
             
-            # 如果提供了session_id，从数据库获取历史会话记录
-            if actual_session_id:
-                chat_history = get_chat_history_from_db(actual_session_id)
-        
-        # 如果没有conversation_id（匿名用户或新会话），生成一个
-        if not conversation_id:
-            conversation_id = generate_conversation_id()
-        
-        # 构造请求体
-        payload = {
-            "conversation_id": conversation_id,
-            "bot_id": BOT_ID,
-            "user": user_uuid or "anonymous_user",
-            "query": user_input,
-            "stream": False
-        }
-        
-        # 如果有历史记录，添加到payload中
-        if chat_history:
-            payload["chat_history"] = chat_history
+            context.update(session_id=actual_session_id, conversation_id=conversation_id,
+                           is_new_session=is_new_session)
+            # 从数据库获取历史会话记录
+            chat_history = get_chat_history_from_db(actual_session_id)
+    
+    # 如果没有conversation_id（匿名用户或新会话），生成一个
+    if not context['conversation_id']:
+        context['conversation_id'] = generate_conversation_id()
+    
+    # 构造请求体
+    payload = {
+        "conversation_id": context['conversation_id'],
+        "bot_id": BOT_ID,
+        "user": user_uuid or "anonymous_user",
+        "query": user_input,
+        "stream": stream
+    }
+    
+    # 如果有历史记录，添加到payload中
+    if chat_history:
+        payload["chat_history"] = chat_history
+    
+    context['payload'] = payload
+    return context, None
+
+def build_response_data(context, user_input, ai_response):
+    """构建对话成功时返回的数据"""
+    response_data = {
+        "response": ai_response,
+        "user_input": user_input,
+        "type": "physical",
+        "conversation_id": context['conversation_id']
+    }
+    
+    # 添加会话相关信息（如果适用）
+    if context['session_id']:
+        response_data["session_id"] = context['session_id']
+        response_data["is_new_session"] = context['is_new_session']
+    return response_data
+
+def store_health_turn(context, user_input, ai_response):
+    """一轮对话的消息一次写入；AI调用失败时只写入用户消息"""
+    if not (context and context['store_turn'] and context['session_id']):
+        return
+    
+    actual_session_id = context['session_id']
+    conversation_id = context['conversation_id']
+    on_stored = None
+    if ai_response:
+        # 消息提交后才追加到对话窗口缓存并更新版本号（后台写入时由写入线程在提交后调用）
+        chat_history_cache.begin_turn(actual_session_id)
+        on_stored = functools.partial(chat_history_cache.finish_turn, actual_session_id, user_input, ai_response)
+    session_manager.add_turn(actual_session_id, user_input, ai_response, {
+        'conversation_id': conversation_id,
+        'timestamp': context['user_message_time']
+    }, {
+        'conversation_id': conversation_id,
+        'timestamp': datetime.datetime.now().isoformat()
+    }, on_stored=on_stored)
+
+# === 调用AI模型处理健康对话 ===
+def call_health_agent(user_input, session_id=None, user_uuid=None):
+    """调用Coze AI模型处理身体健康对话"""
+    
+    context = None
+    ai_response = None
+    response = None
+    started = time.perf_counter()
+    
+    try:
+        context, error = prepare_health_agent_call(user_input, session_id, user_uuid)
+        if error:
+            return error
         
-        response = requests.post(BASE_URL, headers=headers, data=json.dumps(payload))
+        response = coze_client.post(BASE_URL, headers=headers, data=json.dumps(context['payload']))
         
         if response.status_code != 200:
             logger.error(f"AI模型调用失败: {response.status_code} - {response.text}")
@@ -270,30 +298,13 @@ def call_health_agent(user_input, session_id=None, user_uuid=None):
                 "data": None
             }
         
-        # 存储AI回复（仅在提供了user_uuid时）
-        if user_uuid and user_uuid != "anonymous_user":
-            session_manager.add_message(actual_session_id, 'assistant', ai_response, {
-                'conversation_id': conversation_id,
-                'timestamp': datetime.datetime.now().isoformat()
-            })
-
-        # 构建响应数据
-        response_data = {
-            "response": ai_response,
-            "user_input": user_input,
-            "type": "physical",
-            "conversation_id": conversation_id
-        }
-        
-        # 添加会话相关信息（如果适用）
-        if actual_session_id:
-            response_data["session_id"] = actual_session_id
-            response_data["is_new_session"] = is_new_session
+        # 非流式调用的首字延迟即完整回复的生成时间
+        get_latency_stats('physical_chat_ttft').observe(time.perf_counter() - started)
 
         return {
             "status": "success",
             "message": "身体健康对话处理完成",
-            "data": response_data
+            "data": build_response_data(context, user_input, ai_response)
         }
 
     except requests.exceptions.RequestException as e:
@@ -304,7 +315,7 @@ def call_health_agent(user_input, session_id=None, user_uuid=None):
             "data": None
         }
     except json.JSONDecodeError:
-        logger.error(f"JSON解析失败: {response.text[:200]}")
+        logger.error(f"JSON解析失败: {response.text[:200] if response is not None else ''}")
         return {
             "status": "error",
             "message": "服务响应格式错误，请稍后重试",
@@ -317,6 +328,99 @@ def call_health_agent(user_input, session_id=None, user_uuid=None):
             "message": "系统内部错误，请稍后重试",
             "data": None
         }
+    finally:
+        store_health_turn(context, user_input, ai_response)
+
+# === 流式调用AI模型 ===
+class CozeStreamError(Exception):
+    """Coze流式接口返回的错误事件"""
+
+def iter_answer_deltas(response):
+    """
+    解析Coze流式响应（SSE），按到达顺序返回answer消息的增量文本
+    
+    收到done事件时结束；收到error事件时抛出CozeStreamError
+    """
+    # chunk_size=None：数据到达即返回，不等凑满固定大小的缓冲区
+    for line in response.iter_lines(chunk_size=None):
+        if not line or not line.startswith(b'data:'):
+            continue
+        try:
+            event = json.loads(line[5:])
+        except json.JSONDecodeError:
+            logger.warning(f"无法解析的流式数据: {line[:200]}")
+            continue
+        
+        event_type = event.get('event')
+        if event_type == 'message':
+            message = event.get('message') or {}
+            if message.get('type') == 'answer' and message.get('content'):
+                yield message['content']
+        elif event_type == 'done':
+            return
+        elif event_type == 'error':
+            error_info = event.get('error_information') or {}
+            raise CozeStreamError(f"{error_info.get('code')} {error_info.get('msg')}")
+    
+    # 连接在done事件之前关闭，回复不完整
+    raise CozeStreamError("流式响应意外结束")
+
+def sse_event(data):
+    return f"data: {json.dumps(data)}\n\n"
+
+def stream_health_agent(user_input, session_id=None, user_uuid=None):
+    """
+    以流式方式调用Coze AI模型，生成发送给客户端的SSE事件
+    
+    上游每到达一段增量就立即转发；流正常结束后才保存完整的AI回复，
+    上游出错或客户端中途断开时只保存用户消息。
+    """
+    context = None
+    ai_response = None
+    started = time.perf_counter()
+    
+    try:
+        context, error = prepare_health_agent_call(user_input, session_id, user_uuid, stream=True)
+        if error:
+            yield sse_event({'type': 'error', 'message': error['message']})
+            return
+        
+        with coze_client.post(BASE_URL, headers=headers, data=json.dumps(context['payload']),
+                              stream=True, read_timeout=STREAM_READ_TIMEOUT) as response:
+            if response.status_code != 200:
+                logger.error(f"AI模型流式调用失败: {response.status_code} - {response.text[:200]}")
+                yield sse_event({'type': 'error', 'message': 'AI服务暂时不可用，请稍后重试'})
+                return
+            
+            parts = []
+            for delta in iter_answer_deltas(response):
+                if not parts:
+                    get_latency_stats('physical_chat_stream_ttft').observe(time.perf_counter() - started)
+                parts.append(delta)
+                yield sse_event({'chunk': delta, 'type': 'chunk'})
+        
+        streamed_response = "".join(parts).strip()
+        if not streamed_response:
+            logger.warning("AI模型未返回有效回复")
+            yield sse_event({'type': 'error', 'message': 'AI模型暂时无法处理您的请求，请稍后重试'})
+            return
+        
+        ai_response = streamed_response
+        get_latency_stats('physical_chat_stream_total').observe(time.perf_counter() - started)
+        logger.info(f"身体健康流式对话处理成功: {user_input[:50]}...")
+        yield sse_event({'type': 'complete', 'data': build_response_data(context, user_input, ai_response)})
+    
+    except CozeStreamError as e:
+        logger.error(f"AI模型流式响应错误: {e}")
+        yield sse_event({'type': 'error', 'message': 'AI服务暂时不可用，请稍后重试'})
+    except requests.exceptions.RequestException as e:
+        logger.error(f"网络请求失败: {e}")
+        yield sse_event({'type': 'error', 'message': '网络连接失败，请检查网络后重试'})
+    except Exception as e:
+        logger.error(f"流式对话异常: {e}")
+        yield sse_event({'type': 'error', 'message': '系统内部错误，请稍后重试'})
+    finally:
+        store_health_turn(context, user_input, ai_response)
 
 # === 非流式对话接口 ===
 @physical_bp.route('/chat', methods=['POST'])
@@ -387,24 +491,7 @@ def physical_text_chat_stream(current_user):
     # 获取可选的session_id
     session_id = data.get('session_id')
     
-    # 构造流式响应
-    def generate():
-        # 模拟流式响应（实际应调用流式AI接口）
-        result = call_health_agent(user_input, session_id, user_uuid)
-        
-        if result['status'] == 'success':
-            response_data = result['data']
-            # 模拟分块输出
-            response_text = response_data.get('response', '')
-            chunk_size = 50
-            
-            for i in range(0, len(response_text), chunk_size):
-                chunk = response_text[i:i+chunk_size]
-                yield f"data: {json.dumps({'chunk': chunk, 'type': 'chunk'})}\n\n"
-                
-            # 发送完成信号
-            yield f"data: {json.dumps({'type': 'complete', 'data': response_data})}\n\n"
-        else:
-            yield f"data: {json.dumps({'type': 'error', 'message': result['message']})}\n\n"
-    
-    return Response(stream_with_context(generate()), mimetype='text/plain')
\ No newline at end of file
+    # 上游增量到达即转发；关闭代理缓冲，保证客户端及时收到每一段
+    return Response(stream_with_context(stream_health_agent(user_input, session_id, user_uuid)),
+                    mimetype='text/plain',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
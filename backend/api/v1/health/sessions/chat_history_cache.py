@@ -0,0 +1,208 @@
+"""
+对话历史窗口缓存
+
+按会话缓存最近N轮对话（环形缓冲区），构建Coze请求的chat_history时不必每轮都读数据库：
+首次使用时从数据库加载一次，之后每轮对话完成后O(1)追加，最旧的一轮自动移出窗口；
+会话长时间空闲或会话数超过上限时按LRU淘汰。
+
+多个gunicorn工作进程各自持有缓存，因此每个会话在共享缓存（cache_manager）中保存一个版本号，
+任何进程追加一轮对话都会原子地递增版本号（cache_manager.incr）；本地窗口的版本号与之不一致时视为未命中，
+从数据库重新加载。递增得到的新版本号恰好比本地窗口的版本号大1时，说明期间没有其他进程追加过，
+窗口追加这一轮后仍然完整；否则窗口缺少其他进程追加的对话，直接丢弃。
+只有一个工作进程或配置了共享缓存后端（CACHE_BACKEND）时版本号才能在进程间可见，
+其余情况下缓存自动停用，每轮都从数据库读取。
+
+版本号与数据库的先后顺序：
+- 从数据库加载前先读取版本号（current_version），加载期间有新的一轮提交时，窗口带着旧版本号，下次使用即重新加载
+- 一轮对话在消息提交之后才追加并更新版本号（finish_turn，后台写入时由写入线程在提交后调用），
+  其他进程不会在提交前按新版本号缓存缺少这一轮的历史；提交前（begin_turn之后）本进程不使用该会话的窗口
+"""
+
+import os
+import time
+import logging
+from collections import OrderedDict, deque
+from threading import Lock
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from utils.cache_manager import cache_manager
+
+logger = logging.getLogger(__name__)
+
+
+class _HistoryWindow:
+    """单个会话的对话窗口"""
+
+    __slots__ = ('turns', 'version', 'last_used')
+
+    def __init__(self, turns: Sequence[Tuple[str, str]], max_turns: int, version: Optional[int]):
+        self.turns = deque(turns, maxlen=max_turns)
+        self.version = version
+        self.last_used = time.time()
+
+
+class ChatHistoryCache:
+    """按会话缓存最近N轮对话"""
+
+    def __init__(self, max_turns: int = 10, max_sessions: int = 1000, idle_ttl: int = 1800,
+                 enabled: bool = True):
+        self.max_turns = max_turns
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.enabled = enabled
+        self._windows: 'OrderedDict[str, _HistoryWindow]' = OrderedDict()
+        # 会话ID -> 已写入但尚未提交的对话轮数
+        self._pending: Dict[str, int] = {}
+        self._lock = Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, session_id: str) -> Optional[List[Dict[str, str]]]:
+        """获取会话的chat_history，未缓存、已过期或被其他进程更新过时返回None"""
+        if not self.enabled:
+            return None
+
+        version = cache_manager.get(self._version_key(session_id))
+        now = time.time()
+        with self._lock:
+            if self._pending.get(session_id):
+                # 有尚未提交的一轮对话，窗口中还没有它
+                self._misses += 1
+                return None
+            window = self._windows.get(session_id)
+            if window is None or now - window.last_used > self.idle_ttl or window.version != version:
+                if window is not None:
+                    del self._windows[session_id]
+                self._misses += 1
+                return None
+            window.last_used = now
+            self._windows.move_to_end(session_id)
+            self._hits += 1
+            return build_chat_history(window.turns)
+
+    def current_version(self, session_id: str) -> Optional[int]:
+        """会话当前的共享版本号；从数据库加载对话之前读取，传给seed"""
+        if not self.enabled:
+            return None
+        return cache_manager.get(self._version_key(session_id))
+
+    def seed(self, session_id: str, turns: Sequence[Tuple[str, str]], version: Optional[int]) -> None:
+        """
+        用数据库中加载的对话（按时间升序）初始化会话窗口
+
+        version必须是加载之前通过current_version读取的版本号：加载期间提交的对话会更新版本号，
+        使这个窗口在下次使用时失效，而不是把旧的历史标记为最新版本。
+        """
+        if not self.enabled:
+            return
+
+        with self._lock:
+            if self._pending.get(session_id):
+                return
+            self._windows[session_id] = _HistoryWindow(turns, self.max_turns, version)
+            self._windows.move_to_end(session_id)
+            self._evict()
+
+    def begin_turn(self, session_id: str) -> None:
+        """一轮对话开始写入数据库（提交之前），本进程在提交前不使用该会话的窗口"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._pending[session_id] = self._pending.get(session_id, 0) + 1
+
+    def finish_turn(self, session_id: str, user_input: str, ai_response: str, committed: bool) -> None:
+        """begin_turn对应的写入结束：提交成功时追加到窗口并更新版本号，写入失败时窗口保持不变"""
+        if not self.enabled:
+            return
+        with self._lock:
+            remaining = self._pending.get(session_id, 0) - 1
+            if remaining > 0:
+                self._pending[session_id] = remaining
+            else:
+                self._pending.pop(session_id, None)
+        if committed:
+            self.append_turn(session_id, user_input, ai_response)
+
+    def append_turn(self, session_id: str, user_input: str, ai_response: str) -> None:
+        """
+        一轮对话提交后追加到窗口，并递增共享版本号使其他进程的窗口失效
+
+        递增后的版本号不是本地窗口版本号加1时（其他进程也追加过），窗口缺少那一轮，直接丢弃；
+        共享缓存不可用、无法递增时同样丢弃，并删除版本号让其他进程重新加载。
+        """
+        if not self.enabled:
+            return
+
+        key = self._version_key(session_id)
+        version = cache_manager.incr(key, self.idle_ttl)
+        if version is None:
+            self.invalidate(session_id)
+            return
+        with self._lock:
+            window = self._windows.get(session_id)
+            if window is None:
+                # 本进程没有窗口时不追加，下次使用时从数据库加载
+                return
+            # 版本号不存在（从未追加过或已过期）时按0计算
+            if (window.version or 0) != version - 1:
+                del self._windows[session_id]
+                return
+            window.turns.append((user_input, ai_response))
+            window.version = version
+            window.last_used = time.time()
+            self._windows.move_to_end(session_id)
+
+    def invalidate(self, session_id: str) -> None:
+        with self._lock:
+            self._windows.pop(session_id, None)
+        cache_manager.delete(self._version_key(session_id))
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'sessions': len(self._windows),
+                'pending_turns': sum(self._pending.values()),
+                'max_sessions': self.max_sessions,
+                'hits': self._hits,
+                'misses': self._misses
+            }
+
+    def _evict(self) -> None:
+        """淘汰空闲过久和超出数量上限的会话窗口（调用方需持有锁）"""
+        now = time.time()
+        while self._windows:
+            oldest_id, oldest = next(iter(self._windows.items()))
+            if len(self._windows) > self.max_sessions or now - oldest.last_used > self.idle_ttl:
+                del self._windows[oldest_id]
+            else:
+                break
+
+    @staticmethod
+    def _version_key(session_id: str) -> str:
+        return f"chat_history_version:{session_id}"
+
+
+def build_chat_history(turns: Sequence[Tuple[str, str]]) -> List[Dict[str, str]]:
+    """把对话轮次转换为Coze API的chat_history格式（最早的对话在前面）"""
+    chat_history = []
+    for user_input, ai_response in turns:
+        chat_history.append({"role": "user", "content": user_input, "content_type": "text"})
+        chat_history.append({"role": "assistant", "content": ai_response, "content_type": "text"})
+    return chat_history
+
+
+def _cache_enabled() -> bool:
+    """只有一个工作进程或配置了共享缓存后端时，版本号才能在所有进程间可见"""
+    if os.getenv('CHAT_HISTORY_CACHE', 'True').lower() != 'true':
+        return False
+    return int(os.getenv('GUNICORN_WORKERS', '2')) <= 1 or cache_manager.shared
+
+
+# 创建全局对话历史缓存实例
+chat_history_cache = ChatHistoryCache(
+    max_turns=10,
+    max_sessions=int(os.getenv('CHAT_HISTORY_CACHE_SESSIONS', 1000)),
+    idle_ttl=int(os.getenv('CHAT_HISTORY_CACHE_TTL', 1800)),
+    enabled=_cache_enabled()
+)
@@ -4,28 +4,97 @@
 提供对话会话的创建、查询、管理接口
 """
 
+import base64
+import datetime
+
 from flask import request, jsonify
 from . import sessions_bp
+from .session_manager import session_manager, SESSION_TYPES
+from utils.jwt_utils import token_required
+
+# 每页会话数量
+DEFAULT_SESSION_PAGE_SIZE = 20
+MAX_SESSION_PAGE_SIZE = 100
+
+def _encode_session_cursor(session):
+    """把会话的 (updated_at, id) 编码为不透明的翻页游标"""
+    raw = f"{session['updated_at'].isoformat()}|{session['id']}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+def _decode_session_cursor(cursor):
+    """解析翻页游标，格式不正确时返回None"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+        updated_at, session_pk = raw.split('|', 1)
+        return datetime.datetime.fromisoformat(updated_at), int(session_pk)
+    except (ValueError, UnicodeError):
+        return None
+
+def _format_time(value):
+    return value.isoformat() if value else None
 
 # 获取会话列表接口
 @sessions_bp.route('', methods=['GET'])
-def get_sessions():
-    """获取会话列表"""
-    user_uuid = request.args.get('uuid')
+@token_required
+def get_sessions(current_user):
+    """获取会话列表（按更新时间倒序，附带最后消息预览和消息数，通过cursor游标翻页）"""
+    try:
+        limit = int(request.args.get('limit', DEFAULT_SESSION_PAGE_SIZE))
+    except ValueError:
+        limit = None
+    if limit is None or limit < 1 or limit > MAX_SESSION_PAGE_SIZE:
+        return jsonify({
+            'status': 'error',
+            'message': f'limit必须为1到{MAX_SESSION_PAGE_SIZE}之间的整数',
+            'error_code': 'INVALID_PARAMETER'
+        }), 400
+    
+    cursor = request.args.get('cursor')
+    before = None
+    if cursor:
+        before = _decode_session_cursor(cursor)
+        if before is None:
+            return jsonify({
+                'status': 'error',
+                'message': '无效的cursor',
+                'error_code': 'INVALID_PARAMETER'
+            }), 400
+    
+    session_type = request.args.get('type')
+    if session_type and session_type not in SESSION_TYPES:
+        return jsonify({
+            'status': 'error',
+            'message': f'type必须为{"、".join(SESSION_TYPES)}之一',
+            'error_code': 'INVALID_PARAMETER'
+        }), 400
+    
+    # 多取一条判断是否还有更多
+    rows = session_manager.list_user_sessions(current_user['uuid'], limit + 1,
+                                              session_type=session_type, before=before)
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    
+    sessions = [{
+        'session_id': row['session_id'],
+        'title': row['title'],
+        'category': row['session_type'],
+        'created_at': _format_time(row['created_at']),
+        'updated_at': _format_time(row['updated_at']),
+        'last_message_preview': row['last_message_preview'],
+        'message_count': row['message_count'],
+        'last_message_at': _format_time(row['last_message_at'])
+    } for row in rows]
     
     return jsonify({
         'status': 'success',
         'message': '获取会话列表成功',
         'data': {
-            'sessions': [
-                {
-                    'id': 'session_001',
-                    'title': '健康咨询会话',
-                    'created_at': '2024-01-01T10:00:00Z',
-                    'message_count': 5
-                }
-            ],
-            'uuid': user_uuid
+            'sessions': sessions,
+            'pagination': {
+                'limit': limit,
+                'has_more': has_more,
+                'next_cursor': _encode_session_cursor(rows[-1]) if has_more else None
+            }
         }
     })
 
@@ -45,31 +114,132 @@ def create_session():
         }
     })
 
+# 每页消息数量
+DEFAULT_MESSAGE_PAGE_SIZE = 20
+MAX_MESSAGE_PAGE_SIZE = 100
+
+def _parse_message_page_args():
+    """
+    解析消息分页参数：limit、before_id、after_id
+    
+    Returns:
+        tuple: (limit, before_id, after_id, 错误响应)，参数有误时错误响应不为None
+    """
+    try:
+        limit = int(request.args.get('limit', DEFAULT_MESSAGE_PAGE_SIZE))
+        before_id = request.args.get('before_id', type=int)
+        after_id = request.args.get('after_id', type=int)
+    except ValueError:
+        limit, before_id, after_id = None, None, None
+    
+    if limit is None or limit < 1 or limit > MAX_MESSAGE_PAGE_SIZE:
+        return None, None, None, (jsonify({
+            'status': 'error',
+            'message': f'limit必须为1到{MAX_MESSAGE_PAGE_SIZE}之间的整数',
+            'error_code': 'INVALID_PARAMETER'
+        }), 400)
+    if before_id is not None and after_id is not None:
+        return None, None, None, (jsonify({
+            'status': 'error',
+            'message': 'before_id和after_id不能同时使用',
+            'error_code': 'INVALID_PARAMETER'
+        }), 400)
+    return limit, before_id, after_id, None
+
+def _get_message_page(session_id, limit, before_id, after_id):
+    """
+    按游标获取一页消息（多取一条判断是否还有更多）
+    
+    Returns:
+        dict: messages为按时间升序的消息列表，pagination中before_id/after_id为继续向前/向后翻页的游标
+    """
+    rows = session_manager.get_session_messages(session_id, limit=limit + 1,
+                                                before_id=before_id, after_id=after_id)
+    has_more = len(rows) > limit
+    if has_more:
+        # 多取的一条在翻页方向的最远端
+        rows = rows[:limit] if after_id is not None else rows[1:]
+    
+    messages = [{
+        'message_id': row['id'],
+        'role': row['message_type'],
+        'content': row['content'],
+        'timestamp': row['timestamp']
+    } for row in rows]
+    
+    return {
+        'messages': messages,
+        'pagination': {
+            'limit': limit,
+            'has_more': has_more,
+            'before_id': messages[0]['message_id'] if messages else before_id,
+            'after_id': messages[-1]['message_id'] if messages else after_id
+        }
+    }
+
+def _get_owned_session(current_user, session_id):
+    """获取属于当前用户的会话，不存在或无权限时返回None"""
+    session_info = session_manager.get_session(session_id)
+    if not session_info or session_info['user_uuid'] != current_user['uuid']:
+        return None
+    return session_info
+
 # 获取会话详情接口
 @sessions_bp.route('/<session_id>', methods=['GET'])
-def get_session_detail(session_id):
-    """获取会话详情"""
+@token_required
+def get_session_detail(current_user, session_id):
+    """获取会话详情（附带最新一页消息，更早的消息通过before_id游标获取）"""
+    limit, before_id, after_id, error = _parse_message_page_args()
+    if error:
+        return error
+    
+    session_info = _get_owned_session(current_user, session_id)
+    if not session_info:
+        return jsonify({
+            'status': 'error',
+            'message': '会话不存在或无权限访问',
+            'error_code': 'SESSION_NOT_FOUND'
+        }), 404
+    
+    page = _get_message_page(session_id, limit, before_id, after_id)
     return jsonify({
         'status': 'success',
         'message': '获取会话详情成功',
         'data': {
             'session_id': session_id,
-            'title': '健康咨询会话',
-            'created_at': '2024-01-01T10:00:00Z',
-            'messages': [
-                {
-                    'id': 'msg_001',
-                    'role': 'user',
-                    'content': '你好，我想咨询健康问题',
-                    'timestamp': '2024-01-01T10:00:00Z'
-                },
-                {
-                    'id': 'msg_002',
-                    'role': 'assistant',
-                    'content': '您好，请问有什么健康问题需要咨询？',
-                    'timestamp': '2024-01-01T10:01:00Z'
-                }
-            ]
+            'title': session_info['title'],
+            'category': session_info['session_type'],
+            'created_at': session_info['created_at'],
+            'updated_at': session_info['updated_at'],
+            'messages': page['messages'],
+            'pagination': page['pagination']
+        }
+    })
+
+# 分页获取会话消息接口
+@sessions_bp.route('/<session_id>/messages', methods=['GET'])
+@token_required
+def get_session_messages(current_user, session_id):
+    """按游标分页获取会话消息（before_id向前翻页，after_id获取新消息）"""
+    limit, before_id, after_id, error = _parse_message_page_args()
+    if error:
+        return error
+    
+    if not _get_owned_session(current_user, session_id):
+        return jsonify({
+            'status': 'error',
+            'message': '会话不存在或无权限访问',
+            'error_code': 'SESSION_NOT_FOUND'
+        }), 404
+    
+    page = _get_message_page(session_id, limit, before_id, after_id)
+    return jsonify({
+        'status': 'success',
+        'message': '获取会话消息成功',
+        'data': {
+            'session_id': session_id,
+            'messages': page['messages'],
+            'pagination': page['pagination']
         }
     })
 
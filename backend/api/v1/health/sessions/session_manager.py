@@ -4,9 +4,13 @@
 提供对话会话的创建、查询、消息存储等数据库操作功能
 """
 
+import os
+import json
+import uuid
 import logging
 import datetime
-from typing import Dict, List, Optional, Any
+from contextlib import nullcontext
+from typing import Callable, Dict, List, Optional, Any, Sequence, Tuple
 
 # 导入数据库连接器
 try:
@@ -21,16 +25,53 @@ except ImportError:
         def execute_update(self, query, params=None):
             print(f"模拟执行更新: {query}")
             return 1
+        
+        def execute_transaction(self, queries_and_params):
+            for query, _ in queries_and_params:
+                print(f"模拟执行事务: {query}")
+            return 1
+        
+        def connection_scope(self):
+            return nullcontext(self)
     
     db_connector = MockDBConnector()
 
+from config.db_config import DatabaseConfig
+from utils.cache_manager import (
+    cache_manager, cache_result, generate_session_cache_key, generate_user_sessions_cache_key
+)
+from utils.write_behind import WriteBehindQueue, background_jobs
+
 logger = logging.getLogger(__name__)
 
+# 会话类型（用于清除用户会话列表的各个过滤条件缓存）
+SESSION_TYPES = ('physical', 'mental', 'general')
+
+# 会话列表中最后一条消息预览的长度（字符）
+SESSION_PREVIEW_LENGTH = 100
+
+# MySQL错误码：字段不存在（未执行会话摘要字段迁移）
+ER_BAD_FIELD_ERROR = 1054
+
+# 会话缓存：只有一个工作进程或配置了共享缓存后端时，关闭会话等清除才对所有进程生效，
+# 此时缓存60秒并允许60秒的过期读；否则各进程的缓存互不可见，只缓存几秒并且不返回过期值
+_SESSION_CACHE_COHERENT = int(os.getenv('GUNICORN_WORKERS', '2')) <= 1 or cache_manager.shared
+SESSION_CACHE_TTL = 60 if _SESSION_CACHE_COHERENT else 5
+SESSION_CACHE_STALE_TTL = 60 if _SESSION_CACHE_COHERENT else 0
+SESSION_CACHE_NEGATIVE_TTL = 10 if _SESSION_CACHE_COHERENT else 2
+
+# 对话消息的后台写入队列（MESSAGE_WRITE_BEHIND开启时使用）
+message_write_queue = WriteBehindQueue('chat_messages', maxsize=DatabaseConfig.MESSAGE_WRITE_QUEUE_SIZE)
+
 class SessionManager:
     """会话管理器类"""
     
     def __init__(self):
         self.db = db_connector
+        # 会话摘要字段（最后消息预览、消息数、最后消息时间）不存在时关闭，回退为只更新会话时间
+        self.summary_enabled = True
+        # 消息ID字段（message_uid，迁移007）不存在时关闭，消息写入不再可重试
+        self.message_uid_enabled = True
     
     def create_session(self, user_uuid: str, session_type: str = 'physical', title: str = None) -> Dict[str, Any]:
         """
@@ -46,7 +87,6 @@ class SessionManager:
         """
         try:
             # 生成会话ID和conversation_id
-            import uuid
             session_id = str(uuid.uuid4())
             conversation_id = str(uuid.uuid4())
             
@@ -65,6 +105,7 @@ class SessionManager:
                 result = self.db.execute_update(query, params)
                 
                 if result > 0:
+                    self._invalidate_user_sessions_cache(user_uuid)
                     logger.info(f"创建会话成功（新方案）: user_uuid={user_uuid}, session_id={session_id}, conversation_id={conversation_id}")
                     return {
                         'session_id': session_id,
@@ -92,6 +133,7 @@ class SessionManager:
                 fallback_result = self.db.execute_update(fallback_query, fallback_params)
                 
                 if fallback_result > 0:
+                    self._invalidate_user_sessions_cache(user_uuid)
                     logger.info(f"创建会话成功（旧方案）: user_uuid={user_uuid}, session_id={session_id}")
                     return {
                         'session_id': session_id,
@@ -114,6 +156,9 @@ class SessionManager:
             logger.error(f"创建会话异常: {e}")
             return None
     
+    @cache_result(ttl=SESSION_CACHE_TTL, stale_ttl=SESSION_CACHE_STALE_TTL,
+                  negative_ttl=SESSION_CACHE_NEGATIVE_TTL, fallback=None,
+                  key_func=lambda self, session_id: generate_session_cache_key(session_id))
     def get_session(self, session_id: str) -> Optional[Dict[str, Any]]:
         """
         获取会话信息
@@ -123,49 +168,79 @@ class SessionManager:
             
         Returns:
             dict: 会话信息或None
-        """
-        try:
-            query = """
-                SELECT session_id, user_uuid, session_type, title, conversation_id, created_at, updated_at, is_active
-                FROM chat_sessions 
-                WHERE session_id = %s AND is_active = TRUE
-            """
             
-            result = self.db.execute_query(query, (session_id,))
+        结果缓存SESSION_CACHE_TTL秒（多个工作进程且没有共享缓存后端时只缓存几秒），
+        会话关闭或conversation_id变化时清除；查询异常时返回None且不缓存
+        """
+        query = """
+            SELECT session_id, user_uuid, session_type, title, conversation_id, created_at, updated_at, is_active
+            FROM chat_sessions 
+            WHERE session_id = %s AND is_active = TRUE
+        """
+        
+        result = self.db.execute_query(query, (session_id,))
+        
+        if result:
+            session = result[0]
+            # 检查返回格式：如果是字典格式，直接返回；如果是元组格式，需要转换
+            if isinstance(session, dict):
+                # 已经是字典格式，直接返回
+                return {
+                    'session_id': session['session_id'],
+                    'user_uuid': session['user_uuid'],
+                    'session_type': session['session_type'],
+                    'title': session['title'],
+                    'conversation_id': session['conversation_id'],
+                    'created_at': session['created_at'].isoformat() if session['created_at'] else None,
+                    'updated_at': session['updated_at'].isoformat() if session['updated_at'] else None,
+                    'is_active': bool(session['is_active'])
+                }
+            else:
+                # 元组格式，按索引访问
+                return {
+                    'session_id': session[0],
+                    'user_uuid': session[1],
+                    'session_type': session[2],
+                    'title': session[3],
+                    'conversation_id': session[4],
+                    'created_at': session[5].isoformat() if session[5] else None,
+                    'updated_at': session[6].isoformat() if session[6] else None,
+                    'is_active': bool(session[7])
+                }
+        return None
+    
+    def resolve_session(self, session_id: str, user_uuid: str) -> Optional[Dict[str, Any]]:
+        """
+        校验会话归属并获取会话类型和conversation_id
+        
+        复用get_session的按会话缓存：缓存命中时不查询数据库，未命中时只有一次查询；
+        会话关闭或conversation_id变化时缓存被清除。只有旧数据缺少conversation_id时
+        才回退到get_or_create_conversation_id。
+        
+        Args:
+            session_id: 会话ID
+            user_uuid: 当前用户UUID
             
-            if result:
-                session = result[0]
-                # 检查返回格式：如果是字典格式，直接返回；如果是元组格式，需要转换
-                if isinstance(session, dict):
-                    # 已经是字典格式，直接返回
-                    return {
-                        'session_id': session['session_id'],
-                        'user_uuid': session['user_uuid'],
-                        'session_type': session['session_type'],
-                        'title': session['title'],
-                        'conversation_id': session['conversation_id'],
-                        'created_at': session['created_at'].isoformat() if session['created_at'] else None,
-                        'updated_at': session['updated_at'].isoformat() if session['updated_at'] else None,
-                        'is_active': bool(session['is_active'])
-                    }
-                else:
-                    # 元组格式，按索引访问
-                    return {
-                        'session_id': session[0],
-                        'user_uuid': session[1],
-                        'session_type': session[2],
-                        'title': session[3],
-                        'conversation_id': session[4],
-                        'created_at': session[5].isoformat() if session[5] else None,
-                        'updated_at': session[6].isoformat() if session[6] else None,
-                        'is_active': bool(session[7])
-                    }
-            return None
-                
-        except Exception as e:
-            logger.error(f"获取会话异常: {e}")
+        Returns:
+            dict: 包含session_id、session_type、conversation_id；会话不存在、已关闭或不属于该用户时返回None
+        """
+        session = self.get_session(session_id)
+        if not session or session['user_uuid'] != user_uuid:
             return None
+        
+        conversation_id = session['conversation_id']
+        if not conversation_id:
+            conversation_id = self.get_or_create_conversation_id(session_id)
+        
+        return {
+            'session_id': session_id,
+            'session_type': session['session_type'],
+            'conversation_id': conversation_id
+        }
     
+    @cache_result(ttl=30, stale_ttl=30, fallback=list,
+                  key_func=lambda self, user_uuid, session_type=None:
+                      generate_user_sessions_cache_key(user_uuid, session_type))
     def get_user_sessions(self, user_uuid: str, session_type: str = None) -> List[Dict[str, Any]]:
         """
         获取用户的所有会话
@@ -176,58 +251,55 @@ class SessionManager:
             
         Returns:
             list: 会话列表
+            
+        结果缓存30秒，创建、关闭会话或会话有新消息时清除；查询异常时返回空列表且不缓存
         """
-        try:
-            if session_type:
-                query = """
-                    SELECT session_id, user_uuid, session_type, title, conversation_id, created_at, updated_at, is_active
-                    FROM chat_sessions 
-                    WHERE user_uuid = %s AND session_type = %s AND is_active = TRUE
-                    ORDER BY updated_at DESC
-                """
-                params = (user_uuid, session_type)
+        if session_type:
+            query = """
+                SELECT session_id, user_uuid, session_type, title, conversation_id, created_at, updated_at, is_active
+                FROM chat_sessions 
+                WHERE user_uuid = %s AND session_type = %s AND is_active = TRUE
+                ORDER BY updated_at DESC
+            """
+            params = (user_uuid, session_type)
+        else:
+            query = """
+                SELECT session_id, user_uuid, session_type, title, conversation_id, created_at, updated_at, is_active
+                FROM chat_sessions 
+                WHERE user_uuid = %s AND is_active = TRUE
+                ORDER BY updated_at DESC
+            """
+            params = (user_uuid,)
+        
+        results = self.db.execute_query(query, params)
+        
+        sessions = []
+        for row in results:
+            # 检查返回格式：如果是字典格式，直接访问；如果是元组格式，按索引访问
+            if isinstance(row, dict):
+                sessions.append({
+                    'session_id': row['session_id'],
+                    'user_uuid': row['user_uuid'],
+                    'session_type': row['session_type'],
+                    'title': row['title'],
+                    'conversation_id': row['conversation_id'],
+                    'created_at': row['created_at'].isoformat() if row['created_at'] else None,
+                    'updated_at': row['updated_at'].isoformat() if row['updated_at'] else None,
+                    'is_active': bool(row['is_active'])
+                })
             else:
-                query = """
-                    SELECT session_id, user_uuid, session_type, title, conversation_id, created_at, updated_at, is_active
-                    FROM chat_sessions 
-                    WHERE user_uuid = %s AND is_active = TRUE
-                    ORDER BY updated_at DESC
-                """
-                params = (user_uuid,)
-            
-            results = self.db.execute_query(query, params)
-            
-            sessions = []
-            for row in results:
-                # 检查返回格式：如果是字典格式，直接访问；如果是元组格式，按索引访问
-                if isinstance(row, dict):
-                    sessions.append({
-                        'session_id': row['session_id'],
-                        'user_uuid': row['user_uuid'],
-                        'session_type': row['session_type'],
-                        'title': row['title'],
-                        'conversation_id': row['conversation_id'],
-                        'created_at': row['created_at'].isoformat() if row['created_at'] else None,
-                        'updated_at': row['updated_at'].isoformat() if row['updated_at'] else None,
-                        'is_active': bool(row['is_active'])
-                    })
-                else:
-                    sessions.append({
-                        'session_id': row[0],
-                        'user_uuid': row[1],
-                        'session_type': row[2],
-                        'title': row[3],
-                        'conversation_id': row[4],
-                        'created_at': row[5].isoformat() if row[5] else None,
-                        'updated_at': row[6].isoformat() if row[6] else None,
-                        'is_active': bool(row[7])
-                    })
-            
-            return sessions
-                
-        except Exception as e:
-            logger.error(f"获取用户会话异常: {e}")
-            return []
+                sessions.append({
+                    'session_id': row[0],
+                    'user_uuid': row[1],
+                    'session_type': row[2],
+                    'title': row[3],
+                    'conversation_id': row[4],
+                    'created_at': row[5].isoformat() if row[5] else None,
+                    'updated_at': row[6].isoformat() if row[6] else None,
+                    'is_active': bool(row[7])
+                })
+        
+        return sessions
     
     def add_message(self, session_id: str, message_type: str, content: str, metadata: Dict = None) -> bool:
         """
@@ -242,34 +314,148 @@ class SessionManager:
         Returns:
             bool: 是否成功
         """
-        try:
-            # 序列化元数据
-            metadata_json = None
-            if metadata:
-                import json
-                metadata_json = json.dumps(metadata)
-            
-            # 插入消息记录
-            query = """
-                INSERT INTO chat_messages (session_id, message_type, content, timestamp, metadata)
-                VALUES (%s, %s, %s, NOW(), %s)
-            """
+        return self.add_messages_bulk(session_id, [(message_type, content, metadata)], write_behind=False)
+    
+    def add_turn(self, session_id: str, user_input: Optional[str], ai_response: Optional[str],
+                 metadata: Dict = None, ai_metadata: Dict = None, write_behind: bool = None,
+                 on_stored: Callable[[bool], None] = None) -> bool:
+        """
+        写入一轮对话（用户消息和AI回复），内容为空的一方不写入
+        
+        Args:
+            session_id: 会话ID
+            user_input: 用户消息
+            ai_response: AI回复（AI调用失败时为None，只写入用户消息）
+            metadata: 用户消息元数据
+            ai_metadata: AI回复元数据，默认与用户消息相同
+            write_behind: 是否使用后台写入，默认取MESSAGE_WRITE_BEHIND配置
+            on_stored: 消息提交（True）或最终写入失败（False）后调用一次，见add_messages_bulk
             
-            params = (session_id, message_type, content, metadata_json)
-            result = self.db.execute_update(query, params)
+        Returns:
+            bool: 是否成功（后台写入时表示已入队）
+        """
+        return self.add_messages_bulk(session_id, [
+            ('user', user_input, metadata),
+            ('assistant', ai_response, ai_metadata if ai_metadata is not None else metadata)
+        ], write_behind=write_behind, on_stored=on_stored)
+    
+    def add_messages_bulk(self, session_id: str, messages: Sequence[Tuple[str, Optional[str], Optional[Dict]]],
+                          write_behind: bool = None, on_stored: Callable[[bool], None] = None) -> bool:
+        """
+        批量添加消息到会话
+        
+        所有消息用一条多行INSERT写入，会话摘要（消息数、最后消息时间和预览）和会话更新时间在同一事务中增量更新；
+        会话列表缓存在后台清除（同一会话合并窗口内只清除一次）。
+        每条消息在入队前生成message_uid，写入使用 INSERT IGNORE：后台写入失败重试时，
+        已经提交的消息被唯一索引忽略，不会重复保存。
+        
+        Args:
+            session_id: 会话ID
+            messages: [(消息类型, 内容, 元数据), ...]，内容为空的消息会被跳过
+            write_behind: 是否放入后台写入队列后立即返回，默认取MESSAGE_WRITE_BEHIND配置；
+                          队列已满时同步写入
+            on_stored: 消息提交后以True调用、最终写入失败时以False调用，只调用一次；
+                       后台写入时在后台线程中调用（用于只能在提交之后更新的缓存）
             
-            if result > 0:
-                # 更新会话的更新时间
-                self.update_session_timestamp(session_id)
-                logger.info(f"添加消息成功: session_id={session_id}, type={message_type}")
-                return True
-            else:
-                logger.error(f"添加消息失败: session_id={session_id}")
-                return False
-                
+        Returns:
+            bool: 是否成功（后台写入时表示已入队）
+        """
+        rows = [
+            (str(uuid.uuid4()), session_id, message_type, content, json.dumps(metadata) if metadata else None)
+            for message_type, content, metadata in messages if content
+        ]
+        if not rows:
+            if on_stored is not None:
+                on_stored(True)
+            return True
+        
+        if write_behind is None:
+            write_behind = DatabaseConfig.MESSAGE_WRITE_BEHIND
+        if write_behind and message_write_queue.submit(self._write_messages, session_id, rows,
+                                                       idempotent=self.message_uid_enabled,
+                                                       on_done=on_stored):
+            return True
+        
+        try:
+            self._write_messages(session_id, rows)
+            stored = True
         except Exception as e:
-            logger.error(f"添加消息异常: {e}")
-            return False
+            logger.error(f"添加消息异常: session_id={session_id}, {e}")
+            stored = False
+        if on_stored is not None:
+            on_stored(stored)
+        return stored
+    
+    def _write_messages(self, session_id: str, rows: List[tuple]) -> None:
+        """
+        在一个事务中插入消息并增量更新会话摘要和会话时间（失败时抛出异常，供后台写入队列重试）
+        
+        rows为 (message_uid, session_id, 消息类型, 内容, 元数据)；message_uid字段不存在时
+        不带该字段写入（此时不可重试）。
+        """
+        if self.message_uid_enabled:
+            insert_query = """
+                INSERT IGNORE INTO chat_messages (message_uid, session_id, message_type, content, timestamp, metadata)
+                VALUES (%s, %s, %s, %s, NOW(), %s)
+            """
+            try:
+                self._insert_messages(session_id, insert_query, rows)
+                return
+            except Exception as e:
+                if getattr(e, 'errno', None) != ER_BAD_FIELD_ERROR or 'message_uid' not in str(e):
+                    raise
+                # 语句因字段不存在被拒绝，事务已回滚，没有写入任何消息，可以改用旧格式写入
+                self.message_uid_enabled = False
+                logger.error(f"消息ID字段不存在，消息写入失败后将不再重试（请执行 deploy_mysql/migrations/007）: {e}")
+        
+        insert_query = """
+            INSERT INTO chat_messages (session_id, message_type, content, timestamp, metadata)
+            VALUES (%s, %s, %s, NOW(), %s)
+        """
+        self._insert_messages(session_id, insert_query, [row[1:] for row in rows])
+    
+    def _insert_messages(self, session_id: str, insert_query: str, params_seq: List[tuple]) -> None:
+        """
+        用一条多行INSERT写入消息，同一事务中按本次写入的消息累加会话摘要
+        
+        INSERT IGNORE 忽略了消息（重试时上一次其实已经提交，摘要也已累加）时回滚，不重复累加。
+        摘要字段不存在时关闭摘要功能，只更新会话时间。
+        """
+        def write():
+            return self.db.execute_batch(insert_query, params_seq, [self._session_update(session_id, params_seq)],
+                                         expected_rowcount=len(params_seq))
+        
+        try:
+            rowcount = write()
+        except Exception as e:
+            if (not self.summary_enabled or getattr(e, 'errno', None) != ER_BAD_FIELD_ERROR
+                    or 'message_uid' in str(e)):
+                raise
+            self.summary_enabled = False
+            logger.error(f"会话摘要字段不存在，已关闭会话摘要（请执行 deploy_mysql/migrations/006）: {e}")
+            rowcount = write()
+        
+        if rowcount == len(params_seq):
+            self.touch_session(session_id)
+            logger.info(f"添加消息成功: session_id={session_id}, 条数={len(params_seq)}")
+        else:
+            logger.info(f"消息已写入过，忽略重复提交: session_id={session_id}, 条数={len(params_seq)}")
+    
+    def _session_update(self, session_id: str, params_seq: List[tuple]) -> Tuple[str, tuple]:
+        """本次写入的消息对应的会话更新语句：消息数累加、最后消息时间和预览取本次最后一条"""
+        if not self.summary_enabled:
+            return "UPDATE chat_sessions SET updated_at = NOW() WHERE session_id = %s", (session_id,)
+        # 消息行中内容在倒数第二列（元数据之前）
+        last_content = params_seq[-1][-2]
+        query = f"""
+            UPDATE chat_sessions
+            SET message_count = message_count + %s,
+                last_message_at = NOW(),
+                last_message_preview = LEFT(%s, {SESSION_PREVIEW_LENGTH}),
+                updated_at = NOW()
+            WHERE session_id = %s
+        """
+        return query, (len(params_seq), last_content, session_id)
     
     def get_or_create_conversation_id(self, session_id: str) -> str:
         """
@@ -300,7 +486,6 @@ class SessionManager:
                         return conversation_id
                 
                 # 如果没有找到有效的conversation_id，生成新的并尝试更新到数据库
-                import uuid
                 new_conversation_id = str(uuid.uuid4())
                 
                 # 尝试更新chat_sessions表中的conversation_id字段
@@ -314,6 +499,7 @@ class SessionManager:
                     update_result = self.db.execute_update(update_query, (new_conversation_id, session_id))
                     
                     if update_result > 0:
+                        self.get_session.invalidate(self, session_id)
                         logger.info(f"创建新conversation_id并更新到数据库: {new_conversation_id}")
                     else:
                         logger.warning(f"更新conversation_id到数据库失败，但仍返回新ID: {new_conversation_id}")
@@ -344,7 +530,6 @@ class SessionManager:
                 metadata_json = row[0] if isinstance(row, tuple) else row['metadata']
                 
                 if metadata_json:
-                    import json
                     try:
                         metadata = json.loads(metadata_json)
                         conversation_id = metadata.get('conversation_id')
@@ -355,37 +540,66 @@ class SessionManager:
                         pass
             
             # 如果旧方案也失败，生成新的conversation_id
-            import uuid
             new_conversation_id = str(uuid.uuid4())
             logger.info(f"生成新conversation_id: {new_conversation_id}")
             return new_conversation_id
                 
         except Exception as e:
             logger.error(f"获取conversation_id异常: {e}")
-            import uuid
             return str(uuid.uuid4())
     
-    def get_session_messages(self, session_id: str, limit: int = 50) -> List[Dict[str, Any]]:
+    def get_session_messages(self, session_id: str, limit: int = 50,
+                             before_id: int = None, after_id: int = None) -> List[Dict[str, Any]]:
         """
-        获取会话的消息列表
+        获取会话的消息列表（按(timestamp, id)键集分页，使用(session_id, timestamp, id)复合索引）
         
         Args:
             session_id: 会话ID
             limit: 消息数量限制
+            before_id: 只返回该消息之前的消息（向前翻页）
+            after_id: 只返回该消息之后的消息（向后翻页）
             
         Returns:
-            list: 消息列表
+            list: 消息列表，按时间升序；不传游标时为最新的limit条消息
         """
         try:
-            query = """
-                SELECT id, session_id, message_type, content, timestamp, metadata
-                FROM chat_messages 
-                WHERE session_id = %s
-                ORDER BY timestamp ASC
-                LIMIT %s
-            """
+            columns = "m.id, m.session_id, m.message_type, m.content, m.timestamp, m.metadata"
+            if after_id is not None:
+                query = f"""
+                    SELECT {columns}
+                    FROM chat_messages m
+                    JOIN (SELECT timestamp, id FROM chat_messages WHERE id = %s AND session_id = %s) c
+                    WHERE m.session_id = %s
+                      AND (m.timestamp > c.timestamp OR (m.timestamp = c.timestamp AND m.id > c.id))
+                    ORDER BY m.timestamp ASC, m.id ASC
+                    LIMIT %s
+                """
+                params = (after_id, session_id, session_id, limit)
+            elif before_id is not None:
+                query = f"""
+                    SELECT {columns}
+                    FROM chat_messages m
+                    JOIN (SELECT timestamp, id FROM chat_messages WHERE id = %s AND session_id = %s) c
+                    WHERE m.session_id = %s
+                      AND (m.timestamp < c.timestamp OR (m.timestamp = c.timestamp AND m.id < c.id))
+                    ORDER BY m.timestamp DESC, m.id DESC
+                    LIMIT %s
+                """
+                params = (before_id, session_id, session_id, limit)
+            else:
+                query = f"""
+                    SELECT {columns}
+                    FROM chat_messages m
+                    WHERE m.session_id = %s
+                    ORDER BY m.timestamp DESC, m.id DESC
+                    LIMIT %s
+                """
+                params = (session_id, limit)
             
-            results = self.db.execute_query(query, (session_id, limit))
+            results = self.db.execute_query(query, params)
+            if after_id is None:
+                # 倒序取出的最新消息翻转为时间升序
+                results = list(reversed(results))
             
             messages = []
             for row in results:
@@ -394,7 +608,6 @@ class SessionManager:
                     # 解析元数据
                     metadata = None
                     if row['metadata']:
-                        import json
                         try:
                             metadata = json.loads(row['metadata'])
                         except:
@@ -412,7 +625,6 @@ class SessionManager:
                     # 解析元数据
                     metadata = None
                     if row[5]:
-                        import json
                         try:
                             metadata = json.loads(row[5])
                         except:
@@ -451,12 +663,92 @@ class SessionManager:
             """
             
             result = self.db.execute_update(query, (session_id,))
+            if result > 0:
+                self._invalidate_owner_sessions_cache(session_id)
             return result > 0
                 
         except Exception as e:
             logger.error(f"更新会话时间戳异常: {e}")
             return False
     
+    def touch_session(self, session_id: str) -> None:
+        """
+        会话更新时间已随消息写入更新，在后台清除所属用户的会话列表缓存
+        
+        合并窗口（BACKGROUND_JOB_COALESCE_SECONDS）内同一会话的多次调用只清除一次；
+        后台队列未启用或已满时同步执行。
+        """
+        if not background_jobs.submit(self._invalidate_owner_sessions_cache, session_id,
+                                      coalesce_key=('session_list_cache', session_id)):
+            self._invalidate_owner_sessions_cache(session_id)
+    
+    def list_user_sessions(self, user_uuid: str, limit: int, session_type: str = None,
+                           before: Tuple[datetime.datetime, int] = None) -> List[Dict[str, Any]]:
+        """
+        按更新时间倒序分页获取用户的会话列表（含最后消息预览和消息数）
+        
+        按 (updated_at, id) 键集分页，使用 (user_uuid, is_active, updated_at) 复合索引，
+        一次查询返回一页会话，不再逐个会话查询消息。
+        
+        Args:
+            user_uuid: 用户UUID
+            limit: 返回数量
+            session_type: 过滤会话类型
+            before: 游标 (updated_at, id)，只返回排在该会话之后（更早更新）的会话
+            
+        Returns:
+            list: 会话列表；摘要字段不存在时预览为None、消息数为0；查询异常时返回空列表
+        """
+        summary_columns = ("last_message_preview, message_count, last_message_at" if self.summary_enabled
+                           else "NULL AS last_message_preview, 0 AS message_count, NULL AS last_message_at")
+        conditions = ["user_uuid = %s", "is_active = TRUE"]
+        params: List[Any] = [user_uuid]
+        if session_type:
+            conditions.append("session_type = %s")
+            params.append(session_type)
+        if before is not None:
+            # 拆成 updated_at <= 游标 的范围条件，才能走索引范围扫描
+            conditions.append("updated_at <= %s AND (updated_at < %s OR id < %s)")
+            params.extend([before[0], before[0], before[1]])
+        params.append(limit)
+        
+        query = f"""
+            SELECT id, session_id, session_type, title, {summary_columns}, created_at, updated_at
+            FROM chat_sessions
+            WHERE {' AND '.join(conditions)}
+            ORDER BY updated_at DESC, id DESC
+            LIMIT %s
+        """
+        try:
+            results = self.db.execute_query(query, tuple(params))
+        except Exception as e:
+            if getattr(e, 'errno', None) == ER_BAD_FIELD_ERROR and self.summary_enabled:
+                self.summary_enabled = False
+                logger.error(f"会话摘要字段不存在，已关闭会话摘要（请执行 deploy_mysql/migrations/006）: {e}")
+                return self.list_user_sessions(user_uuid, limit, session_type, before)
+            logger.error(f"获取会话列表异常: {e}")
+            return []
+        
+        columns = ('id', 'session_id', 'session_type', 'title', 'last_message_preview',
+                   'message_count', 'last_message_at', 'created_at', 'updated_at')
+        sessions = []
+        for row in results:
+            # 检查返回格式：字典格式直接使用，元组格式按列顺序转换
+            if not isinstance(row, dict):
+                row = dict(zip(columns, row))
+            sessions.append({
+                'id': row['id'],
+                'session_id': row['session_id'],
+                'session_type': row['session_type'],
+                'title': row['title'],
+                'last_message_preview': row['last_message_preview'],
+                'message_count': int(row['message_count'] or 0),
+                'last_message_at': row['last_message_at'],
+                'created_at': row['created_at'],
+                'updated_at': row['updated_at']
+            })
+        return sessions
+    
     def close_session(self, session_id: str) -> bool:
         """
         关闭会话
@@ -468,6 +760,8 @@ class SessionManager:
             bool: 是否成功
         """
         try:
+            session = self.get_session(session_id)
+            
             query = """
                 UPDATE chat_sessions 
                 SET is_active = FALSE, updated_at = NOW() 
@@ -477,6 +771,10 @@ class SessionManager:
             result = self.db.execute_update(query, (session_id,))
             
             if result > 0:
+                # 通过get_session.invalidate清除：关闭前已开始的加载或后台刷新不会把活跃状态写回缓存
+                self.get_session.invalidate(self, session_id)
+                if session:
+                    self._invalidate_user_sessions_cache(session['user_uuid'])
                 logger.info(f"关闭会话成功: session_id={session_id}")
                 return True
             else:
@@ -486,6 +784,17 @@ class SessionManager:
         except Exception as e:
             logger.error(f"关闭会话异常: {e}")
             return False
+    
+    def _invalidate_user_sessions_cache(self, user_uuid: str) -> None:
+        """清除用户会话列表的缓存（包括按类型过滤的列表）"""
+        for session_type in (None,) + SESSION_TYPES:
+            self.get_user_sessions.invalidate(self, user_uuid, session_type)
+    
+    def _invalidate_owner_sessions_cache(self, session_id: str) -> None:
+        """会话更新时间变化后清除所属用户的会话列表缓存（列表按更新时间排序）"""
+        session = self.get_session(session_id)
+        if session:
+            self._invalidate_user_sessions_cache(session['user_uuid'])
 
 # 创建全局会话管理器实例
 session_manager = SessionManager()
\ No newline at end of file
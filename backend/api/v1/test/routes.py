@@ -31,4 +31,39 @@ def health_check():
             'health': 'ok',
             'timestamp': '2024-01-01T10:00:00Z'
         }
-    })
\ No newline at end of file
+    })
+# 数据库连接池指标接口
+@test_bp.route('/db-pool', methods=['GET'])
+def db_pool_stats():
+    """数据库连接池运行指标（当前工作进程）"""
+    from utils.db_connector import db_connector
+    
+    return jsonify({
+        'status': 'success',
+        'message': '获取连接池指标成功',
+        'data': db_connector.get_pool_stats()
+    })
+
+# 接口延迟指标接口
+@test_bp.route('/latency', methods=['GET'])
+def latency_stats():
+    """接口延迟指标，如对话首字延迟（当前工作进程）"""
+    from utils.latency_stats import snapshot_all
+    
+    return jsonify({
+        'status': 'success',
+        'message': '获取延迟指标成功',
+        'data': snapshot_all()
+    })
+
+# 上游服务调用指标接口
+@test_bp.route('/upstreams', methods=['GET'])
+def upstream_stats():
+    """上游服务（Coze、Mental Agent）的请求数、重试数、错误数和延迟直方图（当前工作进程）"""
+    from utils.http_client import get_upstream_stats
+    
+    return jsonify({
+        'status': 'success',
+        'message': '获取上游服务指标成功',
+        'data': get_upstream_stats()
+    })
@@ -11,7 +11,8 @@ import logging
 from typing import Dict, Optional, List, Any
 
 from utils.db_connector import db_connector
-from utils.cache_manager import cache_manager, generate_user_cache_key, generate_user_uuid_cache_key
+from utils.cache_manager import cache_manager, cache_result, generate_user_cache_key, generate_user_uuid_cache_key
+from utils.write_behind import background_jobs
 
 logger = logging.getLogger(__name__)
 
@@ -48,19 +49,21 @@ class UserDBManager:
         )
         
         try:
-            # 执行插入操作
-            rows_affected = db_connector.execute_update(insert_query, params)
+            # 插入和回查复用同一个连接
+            with db_connector.connection_scope():
+                # 执行插入操作
+                rows_affected = db_connector.execute_update(insert_query, params)
             
-            if rows_affected > 0:
-                # 获取新创建的用户ID
-                user = self.get_user_by_username(username)
-                if user:
-                    logger.info(f"用户创建成功: {username} (ID: {user['id']})")
-                    return user
+                if rows_affected > 0:
+                    # 获取新创建的用户ID
+                    user = self.get_user_by_username(username)
+                    if user:
+                        logger.info(f"用户创建成功: {username} (ID: {user['id']})")
+                        return user
+                    else:
+                        raise Exception("用户创建成功但无法查询到新用户")
                 else:
-                    raise Exception("用户创建成功但无法查询到新用户")
-            else:
-                raise Exception("用户创建失败，影响行数为0")
+                    raise Exception("用户创建失败，影响行数为0")
                 
         except Exception as e:
             logger.error(f"创建用户失败: {e}")
@@ -98,15 +101,10 @@ class UserDBManager:
             logger.error(f"查询用户失败: {e}")
             return None
     
+    @cache_result(ttl=600, stale_ttl=60, negative_ttl=30, fallback=None,
+                  key_func=lambda self, user_uuid: generate_user_uuid_cache_key(user_uuid))
     def get_user_by_uuid(self, user_uuid: str) -> Optional[Dict[str, Any]]:
-        """根据UUID获取用户信息（带缓存）"""
-        # 首先尝试从缓存获取
-        cache_key = generate_user_uuid_cache_key(user_uuid)
-        cached_user = cache_manager.get(cache_key)
-        if cached_user is not None:
-            logger.debug(f"用户UUID缓存命中: {user_uuid}")
-            return cached_user
-        
+        """根据UUID获取用户信息（带缓存，不存在的UUID短时间负缓存，查询异常时返回None）"""
         query = f"""
         SELECT id, uuid, username, password, full_name, gender, birth_date, age, 
                settings, created_at, updated_at, last_login, is_active
@@ -114,49 +112,42 @@ class UserDBManager:
         WHERE uuid = %s AND is_active = TRUE
         """
         
-        try:
-            result = db_connector.execute_query(query, (user_uuid,))
-            if result:
-                user = result[0]
-                user['settings'] = self._deserialize_settings(user['settings'])
-                
-                # 缓存用户信息（TTL：10分钟）
-                cache_manager.set(cache_key, user, ttl=600)
-                logger.debug(f"用户UUID信息已缓存: {user_uuid}")
-                
-                return user
-            return None
-        except Exception as e:
-            logger.error(f"查询用户失败: {e}")
-            return None
-    
-
+        result = db_connector.execute_query(query, (user_uuid,))
+        if result:
+            user = result[0]
+            user['settings'] = self._deserialize_settings(user['settings'])
+            return user
+        return None
     
     def authenticate_user(self, username: str, password: str) -> Optional[Dict[str, Any]]:
         """用户认证"""
         logger.debug(f"开始用户认证: username={username}")
         
-        user = self.get_user_by_username(username)
+        # 查询用户、更新登录时间、清理缓存复用同一个连接
+        with db_connector.connection_scope():
+            user = self.get_user_by_username(username)
         
-        if not user:
-            logger.debug(f"用户不存在: {username}")
-            return None
+            if not user:
+                logger.debug(f"用户不存在: {username}")
+                return None
         
-        logger.debug(f"找到用户: UUID={user['uuid']}, 数据库密码长度={len(user['password'])}, 输入密码长度={len(password)}")
-        logger.debug(f"数据库密码: {user['password']}")
-        logger.debug(f"输入密码: {password}")
+            logger.debug(f"找到用户: UUID={user['uuid']}, 数据库密码长度={len(user['password'])}, 输入密码长度={len(password)}")
+            logger.debug(f"数据库密码: {user['password']}")
+            logger.debug(f"输入密码: {password}")
         
-        # 检查密码（当前为明文比较，实际应用中应使用哈希）
-        if user['password'] != password:
-            logger.debug(f"密码不匹配: 数据库密码='{user['password']}' != 输入密码='{password}'")
-            return None
+            # 检查密码（当前为明文比较，实际应用中应使用哈希）
+            if user['password'] != password:
+                logger.debug(f"密码不匹配: 数据库密码='{user['password']}' != 输入密码='{password}'")
+                return None
         
-        logger.debug(f"密码匹配成功: {username}")
+            logger.debug(f"密码匹配成功: {username}")
         
-        # 更新最后登录时间
-        self.update_last_login_by_uuid(user['uuid'])
+            # 最后登录时间在响应后由后台任务更新（同一用户合并窗口内只更新一次）
+            if not background_jobs.submit(self.update_last_login_by_uuid, user['uuid'],
+                                          coalesce_key=('last_login', user['uuid'])):
+                self.update_last_login_by_uuid(user['uuid'])
         
-        return user
+            return user
     
 
     
@@ -302,16 +293,13 @@ class UserDBManager:
             # 获取用户信息以清除所有相关缓存
             user = self.get_user_by_uuid(user_uuid)
             if user:
-                # 清除所有类型的用户缓存
-                cache_keys = [
-                    generate_user_cache_key(user['username']),
-                    generate_user_uuid_cache_key(user_uuid)
-                ]
-                
-                for cache_key in cache_keys:
-                    cache_manager.delete(cache_key)
+                # 按UUID的缓存通过get_user_by_uuid.invalidate清除，进行中的加载不会把旧值写回
+                cache_manager.delete(generate_user_cache_key(user['username']))
+                self.get_user_by_uuid.invalidate(self, user_uuid)
                 
                 logger.debug(f"用户缓存已清除: {user['username']} (UUID: {user_uuid})")
+            else:
+                self.get_user_by_uuid.invalidate(self, user_uuid)
         except Exception as e:
             logger.warning(f"清除用户缓存失败: {e}")
 
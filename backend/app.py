@@ -1,6 +1,6 @@
 import os
 import logging
-from flask import Flask
+from flask import Flask, Response, request
 from api import register_blueprints
 from dotenv import load_dotenv
 
@@ -33,6 +33,18 @@ mysql_logger.setLevel(logging.WARNING)
 # 注册所有蓝图
 register_blueprints(app)
 
+# 请求耗时统计（Server-Timing响应头和/metrics指标）
+from utils.request_timing import init_request_timing
+init_request_timing(app)
+
+# Prometheus指标接口（汇总所有工作进程，仅允许本机或携带METRICS_TOKEN访问）
+@app.route('/metrics')
+def metrics():
+    from utils.prometheus import render_metrics, metrics_access_allowed, CONTENT_TYPE
+    if not metrics_access_allowed(request.remote_addr, request.headers):
+        return Response('forbidden\n', status=403, content_type='text/plain; charset=utf-8')
+    return Response(render_metrics(), content_type=CONTENT_TYPE)
+
 # 添加根路径路由
 @app.route('/')
 def root():
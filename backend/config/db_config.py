@@ -1,6 +1,8 @@
 import os
 from dotenv import load_dotenv
 
+from utils.concurrency import get_worker_class, COOPERATIVE_WORKER_CLASSES
+
 # 加载环境变量 - 适配本地调试和生产环境
 env_file_path = os.path.join(os.path.dirname(__file__), '..', '.env')
 env_local_path = os.path.join(os.path.dirname(__file__), '..', '.env.local')
@@ -27,6 +29,29 @@ class DatabaseConfig:
     DB_POOL_NAME = os.getenv('DB_POOL_NAME', 'wellmate_pool')
     DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
     
+    # 连接空闲超过该秒数后，取出时才做一次存活检测（ping）
+    DB_PING_IDLE_SECONDS = float(os.getenv('DB_PING_IDLE_SECONDS', 30))
+    
+    # 连接池排队配置：取连接最长等待秒数、最多允许排队的请求数
+    DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 5))
+    DB_POOL_MAX_WAITERS = int(os.getenv('DB_POOL_MAX_WAITERS', 32))
+    
+    # 单机所有工作进程合计可使用的MySQL连接数上限（0表示不限制）
+    DB_MAX_CONNECTIONS = int(os.getenv('DB_MAX_CONNECTIONS', 0))
+    
+    # mysql.connector连接池允许的最大连接数
+    POOL_SIZE_LIMIT = 32
+    
+    # 对话消息后台写入：开启后一轮对话的消息放入队列即返回响应，由后台线程提交
+    MESSAGE_WRITE_BEHIND = os.getenv('MESSAGE_WRITE_BEHIND', 'False').lower() == 'true'
+    MESSAGE_WRITE_QUEUE_SIZE = int(os.getenv('MESSAGE_WRITE_QUEUE_SIZE', 1000))
+    
+    # 响应之后执行的附带操作（会话更新时间、最后登录时间等）的后台任务线程，每个线程执行任务时占用一个连接
+    BACKGROUND_JOBS_ENABLED = os.getenv('BACKGROUND_JOBS_ENABLED', 'True').lower() == 'true'
+    BACKGROUND_JOB_WORKERS = max(int(os.getenv('BACKGROUND_JOB_WORKERS', 2)), 1)
+    BACKGROUND_JOB_QUEUE_SIZE = int(os.getenv('BACKGROUND_JOB_QUEUE_SIZE', 1000))
+    BACKGROUND_JOB_COALESCE_SECONDS = float(os.getenv('BACKGROUND_JOB_COALESCE_SECONDS', 1.0))
+    
     @classmethod
     def get_connection_params(cls):
         """获取数据库连接参数"""
@@ -40,4 +65,38 @@ class DatabaseConfig:
             'autocommit': True,
             'pool_name': cls.DB_POOL_NAME,
             'pool_size': cls.DB_POOL_SIZE
-        }
\ No newline at end of file
+        }
+    
+    @classmethod
+    def get_background_threads(cls):
+        """每个工作进程中会占用数据库连接的后台线程数（后台写入线程和后台任务线程）"""
+        threads = 1 if cls.MESSAGE_WRITE_BEHIND else 0
+        if cls.BACKGROUND_JOBS_ENABLED:
+            threads += cls.BACKGROUND_JOB_WORKERS
+        return threads
+    
+    @classmethod
+    def get_pool_size(cls):
+        """
+        计算每个gunicorn工作进程的连接池大小
+        
+        与gunicorn.conf.py读取相同的环境变量：同步/线程模式下每个请求线程同一时刻最多占用一个连接，
+        因此按线程数分配，并以DB_POOL_SIZE为请求线程部分的上限；后台写入线程和后台任务线程各自再加一个连接，
+        避免请求排在后台操作之后等待超时。配置了DB_MAX_CONNECTIONS时，按工作进程数平分的
+        总连接预算作用于请求线程和后台线程的合计，避免workers×pool_size超过MySQL的max_connections。
+        """
+        workers = max(int(os.getenv('GUNICORN_WORKERS', '2')), 1)
+        threads = max(int(os.getenv('GUNICORN_THREADS', '1')), 1)
+        worker_class = get_worker_class()
+        
+        if worker_class in COOPERATIVE_WORKER_CLASSES:
+            # 协程模式下并发数远大于线程数，直接使用配置的连接池大小
+            size = cls.DB_POOL_SIZE
+        else:
+            size = min(threads, cls.DB_POOL_SIZE)
+        size += cls.get_background_threads()
+        
+        if cls.DB_MAX_CONNECTIONS > 0:
+            size = min(size, cls.DB_MAX_CONNECTIONS // workers)
+        
+        return max(1, min(size, cls.POOL_SIZE_LIMIT))
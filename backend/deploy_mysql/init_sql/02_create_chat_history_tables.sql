@@ -8,6 +8,9 @@ CREATE TABLE IF NOT EXISTS chat_sessions (
     session_type ENUM('physical', 'text', 'general') DEFAULT 'general',
     title VARCHAR(200) DEFAULT NULL,
     conversation_id VARCHAR(36) DEFAULT NULL,
+    last_message_preview VARCHAR(255) DEFAULT NULL,
+    message_count INT NOT NULL DEFAULT 0,
+    last_message_at DATETIME DEFAULT NULL,
     created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
     updated_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
     is_active BOOLEAN DEFAULT TRUE,
@@ -16,12 +19,14 @@ CREATE TABLE IF NOT EXISTS chat_sessions (
     INDEX idx_user_uuid (user_uuid),
     INDEX idx_session_type (session_type),
     INDEX idx_created_at (created_at),
-    INDEX idx_conversation_id (conversation_id)
+    INDEX idx_conversation_id (conversation_id),
+    INDEX idx_user_active_updated (user_uuid, is_active, updated_at)
 );
 
 -- 2. 创建对话消息表
 CREATE TABLE IF NOT EXISTS chat_messages (
     id INT AUTO_INCREMENT PRIMARY KEY,
+    message_uid CHAR(36) DEFAULT NULL,
     session_id VARCHAR(36) NOT NULL,
     message_type ENUM('user', 'assistant') NOT NULL,
     content TEXT NOT NULL,
@@ -31,7 +36,9 @@ CREATE TABLE IF NOT EXISTS chat_messages (
     -- 索引
     INDEX idx_session_id (session_id),
     INDEX idx_message_type (message_type),
-    INDEX idx_timestamp (timestamp)
+    INDEX idx_timestamp (timestamp),
+    INDEX idx_session_timestamp_id (session_id, timestamp, id),
+    UNIQUE INDEX uk_message_uid (message_uid)
 );
 
 -- 3. 创建语音合成记录表
@@ -0,0 +1,29 @@
+-- 迁移脚本：为chat_messages表添加(session_id, timestamp, id)复合索引
+-- 描述：会话消息按(timestamp, id)键集分页，最新N条和before_id/after_id翻页都只扫描索引上的一段范围，
+--       不再随会话变长而变慢
+
+-- 1. 检查索引是否已存在
+SET @index_exists = (SELECT COUNT(*) FROM information_schema.statistics
+                     WHERE table_schema = DATABASE() AND table_name = 'chat_messages'
+                     AND index_name = 'idx_session_timestamp_id');
+
+-- 2. 不存在时创建索引（ALGORITHM=INPLACE, LOCK=NONE：创建期间不阻塞消息写入）
+SET @ddl = IF(@index_exists = 0,
+    'ALTER TABLE chat_messages ADD INDEX idx_session_timestamp_id (session_id, timestamp, id), ALGORITHM=INPLACE, LOCK=NONE',
+    'SELECT ''idx_session_timestamp_id already exists, skipping'' AS result');
+PREPARE stmt FROM @ddl;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
+
+-- 3. 验证索引
+SELECT 
+    INDEX_NAME,
+    COLUMN_NAME,
+    SEQ_IN_INDEX
+FROM information_schema.STATISTICS 
+WHERE TABLE_NAME = 'chat_messages' 
+AND INDEX_NAME = 'idx_session_timestamp_id'
+ORDER BY SEQ_IN_INDEX;
+
+-- 4. 原有的idx_session_id是新索引的前缀，确认查询计划使用新索引后可以删除（可选）
+-- ALTER TABLE chat_messages DROP INDEX idx_session_id;
@@ -0,0 +1,42 @@
+-- 迁移脚本：创建健康数据小时/天汇总表
+-- 描述：add_health_data 写入原始数据时在同一事务中增量更新汇总，健康统计接口只读取汇总行
+--       （day约24个小时桶，week/month最多31个天桶），不再扫描统计周期内的全部原始数据。
+--       创建后执行一次回填：cd backend && python -m api.v1.health.data.backfill_rollups
+
+-- 1. 小时汇总表
+CREATE TABLE IF NOT EXISTS health_data_rollup_hourly (
+    user_uuid VARCHAR(36) NOT NULL,
+    data_type VARCHAR(50) NOT NULL,
+    bucket_start DATETIME NOT NULL,
+    sample_count INT NOT NULL DEFAULT 0,
+    value_sum DECIMAL(20, 4) NOT NULL DEFAULT 0,
+    value_min DECIMAL(20, 4) DEFAULT NULL,
+    value_max DECIMAL(20, 4) DEFAULT NULL,
+    last_value DECIMAL(20, 4) DEFAULT NULL,
+    last_timestamp DATETIME DEFAULT NULL,
+    updated_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+
+    PRIMARY KEY (user_uuid, data_type, bucket_start)
+);
+
+-- 2. 天汇总表
+CREATE TABLE IF NOT EXISTS health_data_rollup_daily (
+    user_uuid VARCHAR(36) NOT NULL,
+    data_type VARCHAR(50) NOT NULL,
+    bucket_start DATETIME NOT NULL,
+    sample_count INT NOT NULL DEFAULT 0,
+    value_sum DECIMAL(20, 4) NOT NULL DEFAULT 0,
+    value_min DECIMAL(20, 4) DEFAULT NULL,
+    value_max DECIMAL(20, 4) DEFAULT NULL,
+    last_value DECIMAL(20, 4) DEFAULT NULL,
+    last_timestamp DATETIME DEFAULT NULL,
+    updated_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+
+    PRIMARY KEY (user_uuid, data_type, bucket_start)
+);
+
+-- 3. 验证表结构
+SELECT TABLE_NAME, TABLE_ROWS
+FROM information_schema.TABLES
+WHERE TABLE_SCHEMA = DATABASE()
+AND TABLE_NAME IN ('health_data_rollup_hourly', 'health_data_rollup_daily');
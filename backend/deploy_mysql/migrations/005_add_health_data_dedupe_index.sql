@@ -0,0 +1,28 @@
+-- 迁移脚本：为health_data表添加(user_uuid, data_type, timestamp)复合索引
+-- 描述：批量写入接口按 (user_uuid, data_type, timestamp) 去重，每块记录用一次范围查询取出已入库的键；
+--       该索引让这次查询只扫描索引上的一段范围
+
+-- 1. 检查表和索引是否存在
+SET @table_exists = (SELECT COUNT(*) FROM information_schema.tables
+                     WHERE table_schema = DATABASE() AND table_name = 'health_data');
+SET @index_exists = (SELECT COUNT(*) FROM information_schema.statistics
+                     WHERE table_schema = DATABASE() AND table_name = 'health_data'
+                     AND index_name = 'idx_user_type_timestamp');
+
+-- 2. 表存在且索引不存在时创建索引（ALGORITHM=INPLACE, LOCK=NONE：创建期间不阻塞写入）
+SET @ddl = IF(@table_exists = 1 AND @index_exists = 0,
+    'ALTER TABLE health_data ADD INDEX idx_user_type_timestamp (user_uuid, data_type, timestamp), ALGORITHM=INPLACE, LOCK=NONE',
+    'SELECT ''health_data missing or idx_user_type_timestamp already exists, skipping'' AS result');
+PREPARE stmt FROM @ddl;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
+
+-- 3. 验证索引
+SELECT 
+    INDEX_NAME,
+    COLUMN_NAME,
+    SEQ_IN_INDEX
+FROM information_schema.STATISTICS 
+WHERE TABLE_NAME = 'health_data' 
+AND INDEX_NAME = 'idx_user_type_timestamp'
+ORDER BY SEQ_IN_INDEX;
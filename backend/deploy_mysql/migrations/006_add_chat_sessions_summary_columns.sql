@@ -0,0 +1,59 @@
+-- 迁移脚本：为chat_sessions表添加会话列表摘要字段和(user_uuid, is_active, updated_at)复合索引
+-- 描述：会话列表（侧边栏）需要最后一条消息预览、消息数和最后消息时间，原来只能逐个会话查询消息（N+1）；
+--       这些字段在写入消息的同一事务中增量更新（下方第4步按消息表全量回填已有会话），列表接口按 (user_uuid, is_active, updated_at) 索引一次查询一页
+
+-- 1. 检查字段和索引是否存在
+SET @column_exists = (SELECT COUNT(*) FROM information_schema.columns
+                      WHERE table_schema = DATABASE() AND table_name = 'chat_sessions'
+                      AND column_name = 'message_count');
+SET @index_exists = (SELECT COUNT(*) FROM information_schema.statistics
+                     WHERE table_schema = DATABASE() AND table_name = 'chat_sessions'
+                     AND index_name = 'idx_user_active_updated');
+
+-- 2. 添加摘要字段
+SET @ddl = IF(@column_exists = 0,
+    'ALTER TABLE chat_sessions
+        ADD COLUMN last_message_preview VARCHAR(255) DEFAULT NULL AFTER conversation_id,
+        ADD COLUMN message_count INT NOT NULL DEFAULT 0 AFTER last_message_preview,
+        ADD COLUMN last_message_at DATETIME DEFAULT NULL AFTER message_count,
+        ALGORITHM=INPLACE, LOCK=NONE',
+    'SELECT ''chat_sessions summary columns already exist, skipping'' AS result');
+PREPARE stmt FROM @ddl;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
+
+-- 3. 添加列表索引（ALGORITHM=INPLACE, LOCK=NONE：创建期间不阻塞写入）
+SET @ddl = IF(@index_exists = 0,
+    'ALTER TABLE chat_sessions ADD INDEX idx_user_active_updated (user_uuid, is_active, updated_at), ALGORITHM=INPLACE, LOCK=NONE',
+    'SELECT ''idx_user_active_updated already exists, skipping'' AS result');
+PREPARE stmt FROM @ddl;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
+
+-- 4. 回填已有会话（保留原updated_at，避免列表顺序被回填打乱）
+UPDATE chat_sessions cs
+SET cs.message_count = (SELECT COUNT(*) FROM chat_messages cm WHERE cm.session_id = cs.session_id),
+    cs.last_message_at = (SELECT MAX(cm.timestamp) FROM chat_messages cm WHERE cm.session_id = cs.session_id),
+    cs.last_message_preview = (
+        SELECT LEFT(cm.content, 100)
+        FROM chat_messages cm
+        WHERE cm.session_id = cs.session_id
+        ORDER BY cm.timestamp DESC, cm.id DESC
+        LIMIT 1
+    ),
+    cs.updated_at = cs.updated_at;
+
+-- 5. 验证
+SELECT
+    INDEX_NAME,
+    COLUMN_NAME,
+    SEQ_IN_INDEX
+FROM information_schema.STATISTICS
+WHERE TABLE_NAME = 'chat_sessions'
+AND INDEX_NAME = 'idx_user_active_updated'
+ORDER BY SEQ_IN_INDEX;
+
+SELECT COUNT(*) AS sessions, SUM(message_count) AS messages FROM chat_sessions;
+
+-- 6. 原有的idx_user_uuid是新索引的前缀，确认查询计划使用新索引后可以删除（可选）
+-- ALTER TABLE chat_sessions DROP INDEX idx_user_uuid;
@@ -0,0 +1,37 @@
+-- 迁移脚本：为chat_messages表添加客户端生成的消息ID（message_uid）和唯一索引
+-- 描述：后台写入队列在提交后连接中断、等待响应超时等情况下会重试同一批消息；
+--       消息ID在入队前生成，写入使用 INSERT IGNORE，重试时已提交的消息被唯一索引忽略，不会重复保存。
+--       已有消息的message_uid为NULL，唯一索引允许多个NULL
+
+-- 1. 检查字段和索引是否存在
+SET @column_exists = (SELECT COUNT(*) FROM information_schema.columns
+                      WHERE table_schema = DATABASE() AND table_name = 'chat_messages'
+                      AND column_name = 'message_uid');
+SET @index_exists = (SELECT COUNT(*) FROM information_schema.statistics
+                     WHERE table_schema = DATABASE() AND table_name = 'chat_messages'
+                     AND index_name = 'uk_message_uid');
+
+-- 2. 添加字段
+SET @ddl = IF(@column_exists = 0,
+    'ALTER TABLE chat_messages ADD COLUMN message_uid CHAR(36) DEFAULT NULL AFTER id, ALGORITHM=INPLACE, LOCK=NONE',
+    'SELECT ''message_uid already exists, skipping'' AS result');
+PREPARE stmt FROM @ddl;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
+
+-- 3. 添加唯一索引（ALGORITHM=INPLACE, LOCK=NONE：创建期间不阻塞消息写入）
+SET @ddl = IF(@index_exists = 0,
+    'ALTER TABLE chat_messages ADD UNIQUE INDEX uk_message_uid (message_uid), ALGORITHM=INPLACE, LOCK=NONE',
+    'SELECT ''uk_message_uid already exists, skipping'' AS result');
+PREPARE stmt FROM @ddl;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
+
+-- 4. 验证
+SELECT
+    INDEX_NAME,
+    COLUMN_NAME,
+    NON_UNIQUE
+FROM information_schema.STATISTICS
+WHERE TABLE_NAME = 'chat_messages'
+AND INDEX_NAME = 'uk_message_uid';
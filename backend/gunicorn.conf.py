@@ -7,6 +7,10 @@ import os
 env_file_path = os.path.join(os.path.dirname(__file__), '.env')
 load_dotenv(env_file_path)
 
+import sys
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from utils.concurrency import get_worker_class, COOPERATIVE_WORKER_CLASSES
+
 # 从环境变量获取配置，如果没有则使用默认值
 host = os.getenv('HOST', '0.0.0.0')
 port = os.getenv('PORT', '5000')
@@ -17,13 +21,18 @@ bind = f'{host}:{port}'
 # 工作进程数，调整为更保守的设置
 workers = int(os.getenv('GUNICORN_WORKERS', '2'))
 
-# 每个工作进程的线程数
+# 每个工作进程的线程数（数据库连接池按线程数分配，见config/db_config.py的get_pool_size）
 threads = int(os.getenv('GUNICORN_THREADS', '1'))
 
-# 工作进程类型
-worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'sync')
+# 工作进程类型：默认同步模式，GUNICORN_WORKER_CLASS=gevent时使用协程模式（见utils/concurrency.py）
+# 同步模式下每个流式对话（10~60秒）独占一个线程；协程模式下等待AI回复时不占用工作进程
+worker_class = get_worker_class()
+
+# 协程模式下单个工作进程最多同时处理的连接数（同步/线程模式不使用）
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', '1000'))
 
-# 请求超时时间（秒）
+# 请求超时时间（秒）：同步模式下为单个请求的最长处理时间；
+# 协程模式下只是工作进程的心跳超时，不限制流式响应的时长
 timeout = int(os.getenv('GUNICORN_TIMEOUT', '60'))
 
 # 访问日志格式
@@ -49,4 +58,61 @@ raw_env = [
     f'FLASK_ENV={os.getenv("FLASK_ENV", "production")}',
     f'DEBUG={os.getenv("DEBUG", "False")}',
     # SECRET_KEY当前项目不需要，已移除
-]
\ No newline at end of file
+]
+
+# 本机共享缓存进程（CACHE_BACKEND=socket时由on_starting启动）
+cache_server_process = None
+
+
+def on_starting(server):
+    """
+    master进程启动时：准备/metrics的多进程快照目录；CACHE_BACKEND=socket时在独立进程中运行本机共享缓存服务，
+    工作进程通过Unix socket共享缓存
+    """
+    global cache_server_process
+    from utils.prometheus import init_multiprocess_dir
+    init_multiprocess_dir()
+    if os.getenv('CACHE_BACKEND', 'memory').lower() != 'socket':
+        return
+    from utils.cache_backends import start_local_cache_server
+    cache_server_process = start_local_cache_server()
+
+
+def on_exit(server):
+    """master退出时停止本机共享缓存进程"""
+    if cache_server_process is not None and cache_server_process.is_alive():
+        cache_server_process.terminate()
+        cache_server_process.join(5)
+
+
+def post_worker_init(worker):
+    """
+    定期写入本进程的指标快照供/metrics汇总；
+    协程模式下确认gevent补丁已生效，否则阻塞式的数据库和HTTP调用会卡住整个工作进程
+    """
+    from utils.prometheus import start_snapshot_writer
+    start_snapshot_writer()
+    if worker_class not in COOPERATIVE_WORKER_CLASSES:
+        return
+    from utils.concurrency import is_cooperative
+    if worker_class == 'gevent' and not is_cooperative():
+        worker.log.error("gevent补丁未生效，阻塞调用会卡住整个工作进程")
+    else:
+        worker.log.info(f"协程模式工作进程已启动: {worker_class}, worker_connections={worker_connections}")
+
+
+def worker_exit(server, worker):
+    """工作进程退出前把后台写入队列中的消息和后台任务全部执行完，再写入最后一次指标快照"""
+    from utils.write_behind import flush_all
+    from utils.prometheus import flush_snapshot
+    flush_all()
+    flush_snapshot()
+
+
+def child_exit(server, worker):
+    """工作进程退出后（master中调用，被强制杀掉的进程也会调用）：计数并入已退出进程的汇总，删除其快照"""
+    from utils.prometheus import mark_process_dead
+    try:
+        mark_process_dead(worker.pid)
+    except Exception as e:
+        server.log.warning(f"合并已退出工作进程的指标失败: {e}")
@@ -0,0 +1,60 @@
+"""
+认证开销基准：对比每个请求都做jwt.decode（原来的做法）与已验证token缓存命中时，
+token_required 带来的单请求耗时，并折算为1000 RPS时占用的CPU比例。
+
+只测认证本身：在请求上下文中直接调用被 token_required 装饰的空函数，不经过路由和网络。
+运行方式（在backend目录下）：python testCase/benchmark_auth.py
+"""
+
+import os
+import sys
+import time
+import logging
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+logging.disable(logging.CRITICAL)
+
+from flask import Flask
+
+from utils import jwt_utils
+from utils.jwt_utils import generate_access_token, token_required
+from utils.token_cache import verified_token_cache
+
+REQUESTS = int(os.getenv('BENCH_REQUESTS', 20000))
+TARGET_RPS = 1000
+
+app = Flask(__name__)
+
+
+@token_required
+def view(current_user):
+    return current_user
+
+
+def measure(name, headers):
+    with app.test_request_context('/', headers=headers):
+        view()  # 预热（缓存模式下写入缓存）
+        start = time.perf_counter()
+        for _ in range(REQUESTS):
+            view()
+        elapsed = time.perf_counter() - start
+    per_request_us = elapsed / REQUESTS * 1e6
+    cpu_share = per_request_us * TARGET_RPS / 1e6 * 100
+    print(f"{name:<14} 单请求 {per_request_us:7.2f} µs | {TARGET_RPS} RPS 时占用单核 {cpu_share:5.2f}%")
+    return per_request_us
+
+
+if __name__ == "__main__":
+    token = generate_access_token('bench_uuid', 'bench_user', '基准用户')
+    headers = {'Authorization': f'Bearer {token}'}
+
+    original_get = verified_token_cache.get
+    verified_token_cache.get = lambda digest: None  # 关闭缓存：每次都jwt.decode
+    decode = measure("每次jwt.decode", headers)
+    verified_token_cache.get = original_get
+    cached = measure("验证缓存命中", headers)
+
+    jwt_utils.verify_token(token)
+    print(f"缓存命中节省 {decode - cached:.2f} µs/请求（{decode / cached:.1f}x）；"
+          f"缓存统计: {verified_token_cache.get_stats()}")
@@ -0,0 +1,66 @@
+"""
+对话消息写入的请求路径耗时与后台合并效果
+
+用模拟数据库（每条SQL固定耗时 BENCH_SQL_MS，默认2ms）代替MySQL，对比：
+- 同步：插入消息后在请求线程中更新会话时间并清理会话列表缓存（BACKGROUND_JOBS_ENABLED=False 时的行为）
+- 后台：请求线程只插入消息，会话时间由后台任务更新，合并窗口内同一会话只执行一条UPDATE
+统计每轮对话写入的请求路径耗时，以及 TURNS 轮对话（分布在 SESSIONS 个会话中）实际执行的UPDATE条数。
+运行方式（在backend目录下）：python testCase/benchmark_background_jobs.py
+"""
+
+import os
+import sys
+import time
+import logging
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+logging.disable(logging.CRITICAL)
+
+from utils import write_behind
+from api.v1.health.sessions.session_manager import session_manager
+
+SQL_SECONDS = float(os.getenv('BENCH_SQL_MS', 2)) / 1000
+TURNS = int(os.getenv('BENCH_TURNS', 200))
+SESSIONS = 10
+
+
+class FakeDB:
+    """每条SQL固定耗时，并按语句类型计数"""
+
+    def __init__(self):
+        self.counts = {}
+
+    def _run(self, query):
+        kind = query.split()[0].upper()
+        self.counts[kind] = self.counts.get(kind, 0) + 1
+        time.sleep(SQL_SECONDS)
+
+    def execute_query(self, query, params=None):
+        self._run(query)
+        return [{'session_id': params[0], 'user_uuid': 'bench_user', 'session_type': 'mental',
+                 'title': None, 'conversation_id': None, 'created_at': None, 'updated_at': None,
+                 'is_active': True}]
+
+    def execute_update(self, query, params=None):
+        self._run(query)
+        return 1
+
+
+def run(name, enabled):
+    db = FakeDB()
+    session_manager.db = db
+    write_behind.background_jobs.enabled = enabled
+    start = time.perf_counter()
+    for i in range(TURNS):
+        session_manager.add_turn(f"bench_session_{i % SESSIONS}", "用户消息", "AI回复", write_behind=False)
+    request_ms = (time.perf_counter() - start) / TURNS * 1000
+    write_behind.flush_all()
+    print(f"{name:<4} 请求路径 {request_ms:6.2f} ms/轮 | INSERT {db.counts.get('INSERT', 0):4d} "
+          f"UPDATE {db.counts.get('UPDATE', 0):4d} SELECT {db.counts.get('SELECT', 0):4d}")
+
+
+if __name__ == "__main__":
+    print(f"{TURNS} 轮对话，{SESSIONS} 个会话，每条SQL {SQL_SECONDS * 1000:.0f} ms")
+    run("同步", False)
+    run("后台", True)
@@ -0,0 +1,88 @@
+"""
+缓存吞吐基准：对比旧版单锁字典缓存与分片LRU缓存在多线程下的读写吞吐，
+并输出分片LRU缓存的命中/淘汰统计。
+
+运行方式（在backend目录下）：python testCase/benchmark_cache.py
+"""
+
+import os
+import sys
+import time
+import random
+import logging
+import threading
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.cache_manager import CacheManager
+
+logger = logging.getLogger(__name__)
+
+KEY_SPACE = 20000
+OPS_PER_THREAD = 50000
+READ_RATIO = 0.9
+
+
+class LegacyCacheManager:
+    """旧版实现：单把全局锁 + 无上限字典，只在读取时删除过期条目（保留原有的调试日志格式化）"""
+
+    def __init__(self, default_ttl=300):
+        self._cache = {}
+        self._lock = threading.Lock()
+        self.default_ttl = default_ttl
+
+    def get(self, key):
+        with self._lock:
+            if key in self._cache:
+                item = self._cache[key]
+                if time.time() < item['expires_at']:
+                    logger.debug(f"缓存命中: {key}")
+                    return item['value']
+                del self._cache[key]
+                logger.debug(f"缓存过期: {key}")
+            return None
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._cache[key] = {
+                'value': value,
+                'expires_at': time.time() + (ttl or self.default_ttl),
+                'created_at': time.time()
+            }
+            logger.debug(f"缓存设置: {key}, TTL: {ttl or self.default_ttl}秒")
+
+
+def worker(cache, seed):
+    rnd = random.Random(seed)
+    value = {'uuid': 'x' * 36, 'username': 'bench', 'settings': {}}
+    for _ in range(OPS_PER_THREAD):
+        key = f"user_uuid:{rnd.randrange(KEY_SPACE)}"
+        if rnd.random() < READ_RATIO:
+            if cache.get(key) is None:
+                cache.set(key, value)
+        else:
+            cache.set(key, value)
+
+
+def run(cache, threads):
+    pool = [threading.Thread(target=worker, args=(cache, i)) for i in range(threads)]
+    start = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - start
+    return threads * OPS_PER_THREAD / elapsed
+
+
+if __name__ == "__main__":
+    for threads in (1, 4, 8, 16):
+        legacy_ops = run(LegacyCacheManager(), threads)
+        sharded_ops = run(CacheManager(max_entries=KEY_SPACE), threads)
+        # 容量只有键空间一半时的表现（旧版无上限，无法对比）
+        bounded = CacheManager(max_entries=KEY_SPACE // 2)
+        bounded_ops = run(bounded, threads)
+        stats = bounded.get_stats()
+        print(f"{threads:>2} 线程: 旧版 {legacy_ops:>10,.0f} ops/s | 分片LRU {sharded_ops:>10,.0f} ops/s | "
+              f"容量减半 {bounded_ops:>10,.0f} ops/s（条目 {stats['total_items']}, 命中率 {stats['hit_rate']:.2%}, "
+              f"淘汰 {stats['evictions']}, 内存 {stats['memory_usage'] / 1024 / 1024:.1f}MB）")
@@ -0,0 +1,163 @@
+"""
+数据库往返次数微基准：统计一次身体健康对话（已有会话）在数据库侧产生的
+连接取出次数与网络往返次数，对比优化前后的行为。
+
+- 优化前：每条SQL单独从连接池取连接，且每次取出都做 is_connected + SELECT 1 存活检测
+- 优化后：请求级连接作用域复用同一个连接，仅空闲超过阈值的连接才做一次 ping
+- 会话缓存：会话归属和conversation_id一次查询取得并按会话缓存，命中后对话前不再查询
+
+不需要真实MySQL：使用计数用的假连接池替换 DatabaseConnector 的连接池。
+运行方式（在backend目录下）：python testCase/benchmark_db_roundtrips.py
+"""
+
+import os
+import sys
+import time
+import logging
+import datetime
+from contextlib import nullcontext
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+logging.disable(logging.CRITICAL)
+
+from utils.db_connector import db_connector
+from utils.cache_manager import cache_manager
+from api.v1.health.physical import routes as physical_routes
+
+USER_UUID = "bench-user"
+SESSION_ID = "bench-session"
+
+
+class RoundTripCounter:
+    def __init__(self):
+        self.checkouts = 0
+        self.round_trips = 0
+
+
+class FakeCursor:
+    def __init__(self, counter, dictionary):
+        self._counter = counter
+        self._dictionary = dictionary
+        self._rows = []
+        self.rowcount = 0
+
+    def execute(self, query, params=None):
+        self._counter.round_trips += 1
+        q = " ".join(query.split())
+        now = datetime.datetime.now()
+        if q.startswith("SELECT session_id, user_uuid"):
+            row = {'session_id': SESSION_ID, 'user_uuid': USER_UUID, 'session_type': 'physical',
+                   'title': 'bench', 'conversation_id': 'bench-conv', 'created_at': now,
+                   'updated_at': now, 'is_active': 1}
+            self._rows = [row]
+        elif q.startswith("SELECT conversation_id"):
+            self._rows = [{'conversation_id': 'bench-conv'}]
+        elif q.startswith("SELECT"):
+            self._rows = []
+        else:
+            self.rowcount = 1
+
+    def fetchall(self):
+        return self._rows
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, counter):
+        self._counter = counter
+
+    def cursor(self, dictionary=False):
+        return FakeCursor(self._counter, dictionary)
+
+    def ping(self, reconnect=False, attempts=1, delay=0):
+        self._counter.round_trips += 1
+
+    def commit(self):
+        self._counter.round_trips += 1
+
+    def rollback(self):
+        self._counter.round_trips += 1
+
+    def start_transaction(self):
+        self._counter.round_trips += 1
+
+
+class FakePooledConnection:
+    """模拟 PooledMySQLConnection：close() 归还连接池并重置会话（一次往返）"""
+
+    def __init__(self, pool, cnx):
+        self._pool = pool
+        self._cnx = cnx
+
+    def __getattr__(self, name):
+        return getattr(self._cnx, name)
+
+    def close(self):
+        self._pool.counter.round_trips += 1  # pool_reset_session
+        self._pool.idle.append(self._cnx)
+
+
+class FakePool:
+    def __init__(self, counter):
+        self.counter = counter
+        self.idle = [FakeConnection(counter) for _ in range(3)]
+
+    def get_connection(self):
+        self.counter.checkouts += 1
+        return FakePooledConnection(self, self.idle.pop())
+
+
+def legacy_ensure_alive(connection):
+    """优化前的存活检测：is_connected()（ping）+ SELECT 1"""
+    connection.ping()
+    cursor = connection.cursor()
+    cursor.execute("SELECT 1")
+    cursor.close()
+
+
+def run_chat_turn():
+    """一次身体健康对话在数据库侧的全部操作（不含AI调用本身）"""
+    with db_connector.connection_scope():
+        actual_session_id, conversation_id, _ = physical_routes.handle_session_and_storage(
+            USER_UUID, SESSION_ID, None, None
+        )
+        physical_routes.get_chat_history_from_db(actual_session_id)
+    physical_routes.session_manager.add_turn(actual_session_id, "我最近经常感到疲劳", "多休息", {
+        'conversation_id': conversation_id,
+    }, write_behind=False)
+
+
+def measure(label, legacy, warm_cache=False, turns=200):
+    counter = RoundTripCounter()
+    db_connector._connection_pool = FakePool(counter)
+    db_connector._last_used.clear()
+
+    original_ensure_alive = db_connector._ensure_alive
+    original_scope = db_connector.connection_scope
+    if legacy:
+        db_connector._ensure_alive = legacy_ensure_alive
+        db_connector.connection_scope = lambda: nullcontext(db_connector)
+
+    try:
+        start = time.perf_counter()
+        for _ in range(turns):
+            if not warm_cache:
+                cache_manager.clear()
+            run_chat_turn()
+        elapsed = time.perf_counter() - start
+    finally:
+        db_connector._ensure_alive = original_ensure_alive
+        db_connector.connection_scope = original_scope
+
+    print(f"{label}: 每轮对话取连接 {counter.checkouts / turns:.1f} 次, "
+          f"数据库往返 {counter.round_trips / turns:.1f} 次, "
+          f"Python侧耗时 {elapsed / turns * 1e6:.0f} µs/轮")
+
+
+if __name__ == "__main__":
+    measure("优化前（逐条取连接 + 每次存活检测）", legacy=True)
+    measure("优化后（请求级固定连接 + 空闲才ping）", legacy=False)
+    measure("优化后 + 会话缓存命中", legacy=False, warm_cache=True)
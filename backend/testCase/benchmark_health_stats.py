@@ -0,0 +1,157 @@
+"""
+健康数据统计基准：对比旧版 1+2N 次查询（分组统计 + 每个数据类型各查一次最新值和最近5个值）、
+扫描原始数据的单条窗口函数查询，以及读取天汇总表的查询在不同数据类型数量、数据量下的耗时。
+
+不需要真实MySQL：使用内存SQLite（支持窗口函数）执行相同结构的SQL，并为每次查询
+加上固定的模拟网络往返延迟（默认0.5ms，可通过 BENCH_RTT_MS 调整）。
+运行方式（在backend目录下）：python testCase/benchmark_health_stats.py
+"""
+
+import os
+import sys
+import time
+import random
+import sqlite3
+import logging
+import datetime
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+logging.disable(logging.CRITICAL)
+
+from api.v1.health.data import health_data_manager as manager_module
+from api.v1.health.data.health_data_manager import health_data_manager
+
+USER_UUID = "bench-user"
+RTT_SECONDS = float(os.getenv('BENCH_RTT_MS', 0.5)) / 1000
+REPEAT = 20
+
+
+class SQLiteConnector:
+    """用SQLite模拟 db_connector.execute_query（字典游标），每次查询计一次往返"""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.queries = 0
+
+    def execute_query(self, query, params=None):
+        self.queries += 1
+        time.sleep(RTT_SECONDS)
+        cursor = self.conn.execute(query.replace('%s', '?'), params or ())
+        columns = [c[0] for c in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def build_database(data_types, rows_per_type):
+    conn = sqlite3.connect(':memory:', detect_types=sqlite3.PARSE_DECLTYPES)
+    conn.execute("""
+        CREATE TABLE health_data (
+            id INTEGER PRIMARY KEY,
+            user_uuid TEXT, data_type TEXT, value TEXT,
+            timestamp TIMESTAMP, metadata TEXT, created_at TIMESTAMP
+        )
+    """)
+    conn.execute("CREATE INDEX idx_user_type_ts ON health_data(user_uuid, data_type, timestamp)")
+    conn.execute("CREATE INDEX idx_user_ts ON health_data(user_uuid, timestamp)")
+    now = datetime.datetime.now()
+    rows = []
+    for t in range(data_types):
+        for i in range(rows_per_type):
+            ts = now - datetime.timedelta(minutes=10 * i)
+            rows.append((USER_UUID, f"type_{t}", str(round(random.uniform(50, 150), 2)), ts, None, now))
+    conn.executemany(
+        "INSERT INTO health_data (user_uuid, data_type, value, timestamp, metadata, created_at) "
+        "VALUES (?, ?, ?, ?, ?, ?)", rows
+    )
+    # 天汇总表：与MySQL中rebuild_rollups的结果相同
+    conn.execute("""
+        CREATE TABLE health_data_rollup_daily (
+            user_uuid TEXT, data_type TEXT, bucket_start TIMESTAMP,
+            sample_count INTEGER, value_sum REAL, value_min REAL, value_max REAL,
+            last_value REAL, last_timestamp TIMESTAMP,
+            PRIMARY KEY (user_uuid, data_type, bucket_start)
+        )
+    """)
+    conn.execute("""
+        INSERT INTO health_data_rollup_daily
+        SELECT user_uuid, data_type, bucket_start, COUNT(*), SUM(v), MIN(v), MAX(v),
+               MAX(CASE WHEN rn = 1 THEN v END), MAX(timestamp)
+        FROM (
+            SELECT user_uuid, data_type, timestamp, CAST(value AS REAL) AS v,
+                   DATE(timestamp) || ' 00:00:00' AS bucket_start,
+                   ROW_NUMBER() OVER (PARTITION BY user_uuid, data_type, DATE(timestamp)
+                                      ORDER BY timestamp DESC) AS rn
+            FROM health_data
+        )
+        GROUP BY user_uuid, data_type, bucket_start
+    """)
+    return conn
+
+
+def legacy_get_health_stats(db, user_uuid, period='week'):
+    """旧版实现：分组统计后，每个数据类型再查询最新值和最近5个值"""
+    start_date = datetime.datetime.now() - datetime.timedelta(weeks=1)
+    results = db.execute_query("""
+        SELECT data_type, COUNT(*) as count,
+               AVG(CAST(value AS DECIMAL)) as avg_value,
+               MIN(CAST(value AS DECIMAL)) as min_value,
+               MAX(CAST(value AS DECIMAL)) as max_value
+        FROM health_data WHERE user_uuid = %s AND timestamp >= %s
+        GROUP BY data_type
+    """, (user_uuid, start_date))
+    stats = {}
+    for row in results:
+        latest = db.execute_query("""
+            SELECT value FROM health_data WHERE user_uuid = %s AND data_type = %s
+            ORDER BY timestamp DESC LIMIT 1
+        """, (user_uuid, row['data_type']))
+        trend = db.execute_query("""
+            SELECT value FROM health_data WHERE user_uuid = %s AND data_type = %s
+            ORDER BY timestamp DESC LIMIT 5
+        """, (user_uuid, row['data_type']))
+        values = [float(r['value']) for r in trend]
+        n = len(values)
+        x = list(range(n))
+        sum_x, sum_y = sum(x), sum(values)
+        sum_xy = sum(x[i] * values[i] for i in range(n))
+        sum_xx = sum(v * v for v in x)
+        slope = (n * sum_xy - sum_x * sum_y) / (n * sum_xx - sum_x * sum_x) if n >= 2 else 0
+        stats[row['data_type']] = {'count': row['count'], 'latest': float(latest[0]['value']), 'slope': slope}
+    return stats
+
+
+def measure(data_types, rows_per_type):
+    db = SQLiteConnector(build_database(data_types, rows_per_type))
+    manager_module.db_connector = db
+
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        legacy_get_health_stats(db, USER_UUID)
+    legacy_ms = (time.perf_counter() - start) / REPEAT * 1000
+    legacy_queries = db.queries / REPEAT
+
+    raw_queries, raw_ms = time_stats(db, rollups=False)
+    rollup_queries, rollup_ms = time_stats(db, rollups=True)
+
+    print(f"{data_types:>4} 种类型 × {rows_per_type:>5} 条: "
+          f"旧版 {legacy_queries:>4.0f} 次查询 {legacy_ms:8.2f} ms | "
+          f"单查询 {raw_queries:.0f} 次 {raw_ms:8.2f} ms | "
+          f"汇总表 {rollup_queries:.0f} 次 {rollup_ms:8.2f} ms")
+
+
+def time_stats(db, rollups):
+    health_data_manager.rollups_enabled = rollups
+    db.queries = 0
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        stats = health_data_manager.get_health_stats(USER_UUID, 'week')
+    elapsed_ms = (time.perf_counter() - start) / REPEAT * 1000
+    assert stats and all(s['stats']['count'] > 0 for s in stats.values()), stats
+    return db.queries / REPEAT, elapsed_ms
+
+
+if __name__ == "__main__":
+    print(f"模拟往返延迟 {RTT_SECONDS * 1000:.1f} ms/次查询")
+    for data_types in (1, 6, 20):
+        for rows_per_type in (100, 1000):
+            measure(data_types, rows_per_type)
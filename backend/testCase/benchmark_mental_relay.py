@@ -0,0 +1,125 @@
+"""
+心理健康流式对话转发基准：对比逐帧解析再封装（默认方式）与原样转发（relay）的转发耗时，
+并验证客户端中途断开时上游请求被取消。
+
+不需要启动Mental Agent：本地启动一个模拟的 /chat/stream 接口，按 BENCH_TOKEN_MS（默认0，
+只测转发开销）的间隔输出 BENCH_TOKENS（默认2000）个chunk事件和一个complete事件。
+后端使用开发服务器在本进程中启动，使用 anonymous_user 的token，不读写数据库。
+运行方式（在backend目录下）：python testCase/benchmark_mental_relay.py
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from werkzeug.serving import make_server
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+logging.disable(logging.CRITICAL)
+
+from app import app
+from utils.jwt_utils import generate_access_token
+from api.v1.health.mental import routes as mental_routes
+
+TOKEN_SECONDS = float(os.getenv('BENCH_TOKEN_MS', 0)) / 1000
+TOKENS = int(os.getenv('BENCH_TOKENS', 2000))
+REPEAT = 3
+STREAM_PATH = '/api/v1/health/mental/chat/stream'
+
+# 模拟上游检测到的客户端断开次数
+cancelled = threading.Event()
+
+
+class FakeMentalAgentHandler(BaseHTTPRequestHandler):
+    """模拟Mental Agent /chat/stream：chunked编码逐个输出SSE事件"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_POST(self):
+        self.close_connection = True
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        token_seconds = 0.05 if payload['message'] == 'slow' else TOKEN_SECONDS
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        full_content = ""
+        try:
+            for i in range(TOKENS):
+                if token_seconds:
+                    time.sleep(token_seconds)
+                content = f"第{i}段回复。"
+                full_content += content
+                event = {'type': 'chunk', 'data': {'content': content, 'session_id': payload['session_id'],
+                                                   'message_id': 'msg_bench', 'chunk_index': i + 1,
+                                                   'conversation_id': 'conv_bench',
+                                                   'timestamp': '2025-01-01T00:00:00'}}
+                self.write_chunk(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode())
+            event = {'type': 'complete', 'data': {'session_id': payload['session_id'], 'message_id': 'msg_bench',
+                                                  'total_chunks': TOKENS, 'full_content': full_content,
+                                                  'conversation_id': 'conv_bench',
+                                                  'timestamp': '2025-01-01T00:00:00'}}
+            self.write_chunk(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode())
+            self.write_chunk(b'')
+        except (BrokenPipeError, ConnectionResetError):
+            cancelled.set()
+
+    def log_message(self, *args):
+        pass
+
+
+def measure(name, url, token, relay):
+    totals, sizes = [], []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        with requests.post(url, json={'text': '最近压力很大', 'relay': relay}, stream=True,
+                           headers={'Authorization': f'Bearer {token}'}) as response:
+            size = sum(len(chunk) for chunk in response.iter_content(chunk_size=None))
+        totals.append(time.perf_counter() - start)
+        sizes.append(size)
+    print(f"{name:<10} 总耗时 {sum(totals) / REPEAT * 1000:8.1f} ms | 输出 {sizes[0]} 字节")
+
+
+def check_cancel(url, token):
+    """读取几块后断开，等待模拟上游发现连接被关闭"""
+    cancelled.clear()
+    start = time.perf_counter()
+    with requests.post(url, json={'text': 'slow', 'relay': True}, stream=True,
+                       headers={'Authorization': f'Bearer {token}'}) as response:
+        for i, _ in enumerate(response.iter_content(chunk_size=None)):
+            if i == 3:
+                break
+    closed_at = time.perf_counter()
+    if cancelled.wait(timeout=5):
+        print(f"客户端断开后上游请求已取消（断开前已流式 {(closed_at - start) * 1000:.0f} ms）")
+    else:
+        print("客户端断开后5秒内上游请求仍未取消")
+
+
+if __name__ == "__main__":
+    upstream = ThreadingHTTPServer(('127.0.0.1', 0), FakeMentalAgentHandler)
+    upstream.daemon_threads = True
+    threading.Thread(target=upstream.serve_forever, daemon=True).start()
+    mental_routes.MENTAL_AGENT_BASE_URL = f"http://127.0.0.1:{upstream.server_address[1]}"
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}{STREAM_PATH}"
+    token = generate_access_token('anonymous_user', 'benchmark')
+
+    print(f"模拟上游：{TOKENS} 个chunk事件，每个间隔 {TOKEN_SECONDS * 1000:.0f} ms")
+    measure("解析封装", url, token, False)
+    measure("原样转发", url, token, True)
+    check_cancel(url, token)
+    server.shutdown()
+    upstream.shutdown()
@@ -0,0 +1,104 @@
+"""
+身体健康对话首字延迟（TTFT）基准：对比原来的做法（非流式调用Coze，拿到完整回复后再切块输出）
+与真实流式转发上游增量的首字延迟和总耗时。
+
+不需要访问Coze：本地启动一个模拟的Coze v2 chat接口，按 BENCH_TOKEN_MS（默认40ms）的间隔
+逐段生成 BENCH_TOKENS（默认60）段回复；非流式请求等全部生成完再一次返回。
+运行方式（在backend目录下）：python testCase/benchmark_physical_ttft.py
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+logging.disable(logging.CRITICAL)
+
+from api.v1.health.physical import routes as physical_routes
+
+TOKEN_SECONDS = float(os.getenv('BENCH_TOKEN_MS', 40)) / 1000
+TOKENS = int(os.getenv('BENCH_TOKENS', 60))
+REPEAT = 5
+
+
+class FakeCozeHandler(BaseHTTPRequestHandler):
+    """模拟Coze v2 chat接口：stream=true时逐段返回SSE（chunked编码），否则生成完毕后返回完整JSON"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_POST(self):
+        # 每个连接只处理一个请求，客户端关闭连接时不产生多余的错误输出
+        self.close_connection = True
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        deltas = [f"第{i}段回复。" for i in range(TOKENS)]
+
+        if not payload.get('stream'):
+            time.sleep(TOKEN_SECONDS * TOKENS)
+            body = json.dumps({'messages': [{'type': 'answer', 'content': ''.join(deltas)}]}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for delta in deltas:
+            time.sleep(TOKEN_SECONDS)
+            event = {'event': 'message', 'message': {'type': 'answer', 'content': delta}, 'is_finish': False}
+            self.write_chunk(f"data:{json.dumps(event)}\n\n".encode())
+        self.write_chunk(b'data:{"event":"done"}\n\n')
+        self.write_chunk(b'')
+
+    def log_message(self, *args):
+        pass
+
+
+def legacy_stream():
+    """原来的流式接口：等待完整回复后按50字切块"""
+    result = physical_routes.call_health_agent("最近总是头疼怎么办")
+    text = result['data']['response']
+    for i in range(0, len(text), 50):
+        yield text[i:i + 50]
+
+
+def streaming():
+    for event in physical_routes.stream_health_agent("最近总是头疼怎么办"):
+        if '"chunk"' in event:
+            yield event
+
+
+def measure(name, make_stream):
+    ttfts, totals = [], []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        first = None
+        for _ in make_stream():
+            if first is None:
+                first = time.perf_counter() - start
+        ttfts.append(first)
+        totals.append(time.perf_counter() - start)
+    print(f"{name:<12} 首字延迟 {sum(ttfts) / REPEAT * 1000:8.1f} ms | 总耗时 {sum(totals) / REPEAT * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeCozeHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    physical_routes.BASE_URL = f"http://127.0.0.1:{server.server_address[1]}/open_api/v2/chat"
+
+    print(f"模拟上游：{TOKENS} 段，每段间隔 {TOKEN_SECONDS * 1000:.0f} ms")
+    measure("原切块输出", legacy_stream)
+    measure("真实流式", streaming)
+    server.shutdown()
@@ -0,0 +1,73 @@
+"""
+请求耗时统计开销基准
+
+测试客户端的单请求耗时波动（约±10%）远大于计时中间件本身的开销，直接对比开关中间件的请求耗时
+看不出差别。因此分别测量：
+- 中间件钩子（before/after/teardown）加上3条SQL和1次JWT验证的计时点，在未抽样和被抽样时的耗时
+- 一个空接口经过Flask测试客户端的单请求耗时（不经过网络，真实接口只会更慢）
+按抽样率加权得到平均每请求的额外耗时及其占比。
+运行方式（在backend目录下）：python testCase/benchmark_request_timing.py
+"""
+
+import os
+import sys
+import time
+import logging
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+logging.disable(logging.CRITICAL)
+
+from flask import Flask
+
+from utils import request_timing
+from utils.request_timing import record_stage, span
+
+ITERATIONS = int(os.getenv('BENCH_ITERATIONS', 50000))
+ROUNDS = 5
+
+app = Flask(__name__)
+
+
+@app.route('/ping')
+def ping():
+    return {'status': 'success'}
+
+
+def instrumented_request():
+    """一个请求中计时相关的全部操作"""
+    request_timing._before_request()
+    with span('auth'):
+        pass
+    for _ in range(3):
+        record_stage('db', 0.0002)
+    request_timing._after_request(response)
+    request_timing._teardown_request()
+
+
+def best_of(func, iterations):
+    best = float('inf')
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        best = min(best, (time.perf_counter() - start) / iterations * 1e6)
+    return best
+
+
+if __name__ == "__main__":
+    client = app.test_client()
+    request_us = best_of(lambda: client.get('/ping'), ITERATIONS // 10)
+
+    with app.test_request_context('/ping'):
+        response = app.make_response({'status': 'success'})
+        request_timing.REQUEST_TIMING_SAMPLE_RATE = 0.0
+        unsampled_us = best_of(instrumented_request, ITERATIONS)
+        request_timing.REQUEST_TIMING_SAMPLE_RATE = 1.0
+        sampled_us = best_of(instrumented_request, ITERATIONS)
+
+    print(f"空接口单请求（测试客户端）: {request_us:8.2f} µs")
+    print(f"计时开销 未抽样: {unsampled_us:6.2f} µs | 被抽样（含Server-Timing）: {sampled_us:6.2f} µs")
+    for rate in (0.01, 0.05, 0.2):
+        overhead = unsampled_us * (1 - rate) + sampled_us * rate
+        print(f"抽样率 {rate:>4.0%}: 平均每请求 {overhead:5.2f} µs，占空接口耗时 {overhead / request_us * 100:5.2f}%")
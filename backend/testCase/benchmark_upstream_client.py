@@ -0,0 +1,98 @@
+"""
+上游HTTP客户端基准：对比每次调用都新建连接（模块级 requests.post）与连接池化的
+UpstreamClient（keep-alive复用连接）在本地HTTPS桩服务上的单次调用耗时。
+
+桩服务使用临时生成的自签名证书（需要openssl命令，不可用时退化为HTTP）；
+BENCH_HANDSHAKE_RTT_MS 可为每个新连接额外加上模拟的握手往返延迟（默认0，即本机真实握手开销）。
+运行方式（在backend目录下）：python testCase/benchmark_upstream_client.py
+"""
+
+import os
+import ssl
+import sys
+import json
+import time
+import shutil
+import logging
+import tempfile
+import threading
+import subprocess
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+logging.disable(logging.CRITICAL)
+
+from utils.http_client import UpstreamClient
+
+HANDSHAKE_SECONDS = float(os.getenv('BENCH_HANDSHAKE_RTT_MS', 0)) / 1000
+REQUESTS = int(os.getenv('BENCH_REQUESTS', 200))
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """keep-alive的桩接口，返回一段固定的JSON"""
+
+    protocol_version = 'HTTP/1.1'
+    # 响应头和响应体一次写出，避免Nagle算法与延迟ACK叠加出的40ms等待
+    wbufsize = -1
+    disable_nagle_algorithm = True
+    body = json.dumps({'messages': [{'type': 'answer', 'content': 'ok'}]}).encode()
+
+    def setup(self):
+        # 新连接的握手往返（TCP + TLS）
+        time.sleep(HANDSHAKE_SECONDS)
+        super().setup()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_stub(cert_dir):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.daemon_threads = True
+    scheme, verify = 'http', True
+    if shutil.which('openssl'):
+        cert, key = os.path.join(cert_dir, 'cert.pem'), os.path.join(cert_dir, 'key.pem')
+        subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+                        '-subj', '/CN=127.0.0.1', '-addext', 'subjectAltName=IP:127.0.0.1',
+                        '-keyout', key, '-out', cert], check=True, capture_output=True)
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert, key)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+        scheme, verify = 'https', cert
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"{scheme}://127.0.0.1:{server.server_address[1]}/chat", verify
+
+
+def measure(name, post):
+    start = time.perf_counter()
+    for _ in range(REQUESTS):
+        response = post()
+        response.json()
+    elapsed = (time.perf_counter() - start) / REQUESTS * 1000
+    print(f"{name:<24} {elapsed:8.2f} ms/次")
+    return elapsed
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as cert_dir:
+        server, url, verify = start_stub(cert_dir)
+        payload = {'query': 'hello'}
+        print(f"桩服务: {url}，{REQUESTS} 次调用，模拟握手延迟 {HANDSHAKE_SECONDS * 1000:.0f} ms")
+
+        fresh = measure("每次新建连接", lambda: requests.post(url, json=payload, verify=verify, timeout=10))
+        client = UpstreamClient('bench')
+        pooled = measure("UpstreamClient连接池", lambda: client.post(url, json=payload, verify=verify))
+        print(f"节省 {fresh - pooled:.2f} ms/次（{(1 - pooled / fresh) * 100:.0f}%）")
+        print(f"UpstreamClient延迟直方图(ms): {client.get_stats()['latency']['ms_histogram']}")
+        server.shutdown()
@@ -0,0 +1,139 @@
+"""
+流式对话并发压测：逐级增加同时进行的流式对话数，统计每级的成功数、首字延迟和总耗时，
+得到单个工作进程（单核）能同时承载的流式对话数。
+
+默认自动启动：本地模拟Coze接口（见benchmark_physical_ttft.py，回复约2.4秒）和一个单工作进程的
+gunicorn（--worker-class 选择 sync 或 gevent），压测对象为 /api/v1/health/physical/chat/stream。
+使用 anonymous_user 的token，不读写数据库。
+也可以用 --url 压测已经启动的服务，启动服务时把COZE_CHAT_URL设为
+http://127.0.0.1:5056/open_api/v2/chat（模拟接口的端口由 --upstream-port 指定）。
+
+运行方式（在backend目录下）：
+    python testCase/loadtest_streams.py --worker-class sync
+    python testCase/loadtest_streams.py --worker-class gevent --levels 1,10,50,100,200
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer
+
+import requests
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BACKEND_DIR)
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utils.jwt_utils import generate_access_token
+from benchmark_physical_ttft import FakeCozeHandler
+
+STREAM_PATH = '/api/v1/health/physical/chat/stream'
+
+
+def run_stream(url, token, timeout):
+    """发起一次流式对话，返回 (是否完整结束, 首字延迟, 总耗时)"""
+    start = time.perf_counter()
+    first = None
+    try:
+        with requests.post(url, json={'text': '最近总是头疼怎么办'}, stream=True, timeout=timeout,
+                           headers={'Authorization': f'Bearer {token}'}) as response:
+            if response.status_code != 200:
+                return False, None, time.perf_counter() - start
+            for line in response.iter_lines(chunk_size=None):
+                if not line.startswith(b'data: '):
+                    continue
+                event = json.loads(line[6:])
+                if event.get('type') == 'chunk' and first is None:
+                    first = time.perf_counter() - start
+                elif event.get('type') == 'complete':
+                    return True, first, time.perf_counter() - start
+                elif event.get('type') == 'error':
+                    break
+    except requests.exceptions.RequestException:
+        pass
+    return False, first, time.perf_counter() - start
+
+
+def percentile(values, p):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))] * 1000
+
+
+def run_level(url, token, concurrency, timeout):
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda _: run_stream(url, token, timeout), range(concurrency)))
+    ok = [r for r in results if r[0]]
+    ttfts = [r[1] for r in ok]
+    totals = [r[2] for r in ok]
+    print(f"并发 {concurrency:>4}: 完成 {len(ok):>4}/{concurrency:<4} | "
+          f"首字延迟 p50 {percentile(ttfts, 0.5):8.0f} ms  p95 {percentile(ttfts, 0.95):8.0f} ms | "
+          f"总耗时 p50 {percentile(totals, 0.5):8.0f} ms  p95 {percentile(totals, 0.95):8.0f} ms")
+    return len(ok)
+
+
+def start_server(worker_class, port, upstream_url):
+    """启动单工作进程的gunicorn，等待端口可用"""
+    env = dict(os.environ, GUNICORN_WORKERS='1', GUNICORN_THREADS='1', GUNICORN_WORKER_CLASS=worker_class,
+               PORT=str(port), HOST='127.0.0.1', COZE_CHAT_URL=upstream_url, LOG_LEVEL='warning')
+    os.makedirs(os.path.join(BACKEND_DIR, 'logs'), exist_ok=True)
+    process = subprocess.Popen(['gunicorn', '-c', 'gunicorn.conf.py', 'app:app'], cwd=BACKEND_DIR, env=env)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            requests.get(f'http://127.0.0.1:{port}/api/v1/test/health', timeout=1)
+            return process
+        except requests.exceptions.RequestException:
+            time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError("gunicorn启动超时")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Concurrent SSE stream load test')
+    parser.add_argument('--url', type=str, default=None,
+                        help='Base URL of a running server (default: spawn gunicorn with one worker)')
+    parser.add_argument('--worker-class', type=str, default='gevent', help='sync or gevent (spawn mode)')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--upstream-port', type=int, default=5056, help='Port of the fake Coze API')
+    parser.add_argument('--levels', type=str, default='1,3,10,50,100')
+    parser.add_argument('--timeout', type=float, default=60)
+    args = parser.parse_args()
+
+    upstream = ThreadingHTTPServer(('127.0.0.1', args.upstream_port), FakeCozeHandler)
+    upstream.daemon_threads = True
+    threading.Thread(target=upstream.serve_forever, daemon=True).start()
+    upstream_url = f"http://127.0.0.1:{upstream.server_address[1]}/open_api/v2/chat"
+
+    process = None
+    base_url = args.url
+    if base_url is None:
+        process = start_server(args.worker_class, args.port, upstream_url)
+        base_url = f'http://127.0.0.1:{args.port}'
+        print(f"gunicorn: 1 个工作进程, worker_class={args.worker_class}")
+    else:
+        print(f"压测已有服务: {base_url}（模拟Coze接口: {upstream_url}）")
+
+    token = generate_access_token('anonymous_user', 'loadtest')
+    try:
+        best = 0
+        for level in (int(x) for x in args.levels.split(',')):
+            completed = run_level(base_url + STREAM_PATH, token, level, args.timeout)
+            if completed == level:
+                best = level
+        print(f"单个工作进程全部完成的最大并发流式对话数: {best}")
+    finally:
+        if process:
+            process.terminate()
+            process.wait()
+        upstream.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""
+共享缓存后端检查：模拟两个工作进程（两个CacheManager实例）通过同一个共享后端读写，验证
+- 值的JSON编码：datetime、Decimal、tuple、非字符串键的dict和 cache_result 保存的 _CachedResult 原样还原
+- LocalSocketCacheBackend：在临时的0700目录中启动 LocalCacheServer，两个客户端共享数据
+- RedisCacheBackend：注入内存中的Redis替身（FakeRedis），不需要Redis服务
+- 一个实例写入/删除/递增后，另一个实例的一级缓存收到失效消息，下次读取拿到新值
+- 未配置或使用默认 CACHE_SOCKET_AUTHKEY 时拒绝启用本机缓存服务
+
+运行方式（在backend目录下）：python testCase/test_cache_backends.py（也可用pytest运行）
+"""
+
+import os
+import sys
+import time
+import decimal
+import datetime
+import tempfile
+import threading
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.cache_backends import (LocalCacheServer, LocalSocketCacheBackend, RedisCacheBackend,
+                                  dumps_value, loads_value, _socket_settings)
+from utils.cache_manager import CacheManager, _CachedResult
+
+AUTHKEY = b'test-cache-authkey-0123456789'
+SAMPLE = {
+    'created_at': datetime.datetime(2024, 1, 1, 10, 30, 15, 123456),
+    'day': datetime.date(2024, 1, 1),
+    'amount': decimal.Decimal('72.50'),
+    'pair': ('heart_rate', 72),
+    'by_id': {1: 'a', 2: 'b'},
+    'items': [None, True, 1.5, 'text']
+}
+
+
+class FakeRedis:
+    """Redis替身：多个客户端共享同一个 store 和频道，publish时同步调用订阅者的handler"""
+
+    def __init__(self, store=None, channels=None):
+        self.store = {} if store is None else store
+        self.channels = {} if channels is None else channels
+        self.lock = threading.Lock()
+
+    def client(self):
+        """同一个Redis上的另一个客户端连接（另一个工作进程）"""
+        return FakeRedis(self.store, self.channels)
+
+    def get(self, key):
+        item = self.store.get(key)
+        if item is None or item[1] <= time.time():
+            return None
+        return item[0]
+
+    def set(self, key, value, ex=None):
+        self.store[key] = (value.encode('utf-8'), time.time() + (ex or 3600))
+        return True
+
+    def delete(self, key):
+        return 1 if self.store.pop(key, None) is not None else 0
+
+    def incr(self, key):
+        with self.lock:
+            value = int(self.get(key) or 0) + 1
+            expires_at = self.store[key][1] if key in self.store else time.time() + 3600
+            self.store[key] = (str(value).encode('utf-8'), expires_at)
+            return value
+
+    def expire(self, key, seconds):
+        if key in self.store:
+            self.store[key] = (self.store[key][0], time.time() + seconds)
+        return True
+
+    def publish(self, channel, data):
+        handlers = list(self.channels.get(channel, ()))
+        for handler in handlers:
+            handler({'type': 'message', 'channel': channel, 'data': data.encode('utf-8')})
+        return len(handlers)
+
+    def pubsub(self, ignore_subscribe_messages=False):
+        return _FakePubSub(self)
+
+
+class _FakePubSub:
+    def __init__(self, redis_client):
+        self._redis = redis_client
+
+    def subscribe(self, **handlers):
+        for channel, handler in handlers.items():
+            self._redis.channels.setdefault(channel, []).append(handler)
+
+    def run_in_thread(self, sleep_time=None, daemon=False):
+        return None
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return condition()
+
+
+def check_shared_caches(first: CacheManager, second: CacheManager) -> None:
+    """两个工作进程共享同一个后端：读写、失效广播和原子递增"""
+    invalidated = []
+    second.add_invalidation_listener(invalidated.append)
+
+    first.set('user:1', SAMPLE, 60)
+    assert second.get('user:1') == SAMPLE, "另一个实例应从共享后端读到相同的值"
+
+    entry = _CachedResult({'session_id': 's1', 'updated_at': SAMPLE['created_at']}, time.time() + 30)
+    first.set('session:s1', entry, 60)
+    loaded = second.get('session:s1')
+    assert isinstance(loaded, _CachedResult), "_CachedResult 应按注册的类型还原"
+    assert loaded.value == entry.value and loaded.fresh_until == entry.fresh_until
+
+    # second 的一级缓存里已有旧值，first 改写后应收到失效消息
+    first.set('user:1', {'name': 'new'}, 60)
+    assert wait_until(lambda: 'user:1' in invalidated), "另一个实例应收到写入的失效消息"
+    assert second.get('user:1') == {'name': 'new'}
+
+    first.delete('user:1')
+    assert wait_until(lambda: second.get('user:1') is None), "删除后另一个实例不应再读到旧值"
+
+    assert first.incr('version:s1', 60) == 1
+    assert second.incr('version:s1', 60) == 2
+    assert wait_until(lambda: first.get('version:s1') == 2), "递增后两个实例读到同一个版本号"
+
+
+def test_value_codec():
+    assert loads_value(dumps_value(SAMPLE)) == SAMPLE
+    entry = loads_value(dumps_value(_CachedResult(None, 123.5)))
+    assert isinstance(entry, _CachedResult) and entry.value is None and entry.fresh_until == 123.5
+    try:
+        dumps_value(object())
+    except TypeError:
+        pass
+    else:
+        raise AssertionError("未注册的类型不应写入共享后端")
+
+
+def test_local_socket_backend():
+    directory = tempfile.mkdtemp(prefix='wellmate_cache_test-')
+    server = LocalCacheServer(os.path.join(directory, 'cache.sock'), AUTHKEY)
+    server.start()
+    assert os.stat(directory).st_mode & 0o777 == 0o700
+    check_shared_caches(CacheManager(backend=LocalSocketCacheBackend(server.address, AUTHKEY)),
+                        CacheManager(backend=LocalSocketCacheBackend(server.address, AUTHKEY)))
+
+
+def test_redis_backend():
+    redis_client = FakeRedis()
+    check_shared_caches(CacheManager(backend=RedisCacheBackend(client=redis_client)),
+                        CacheManager(backend=RedisCacheBackend(client=redis_client.client())))
+
+
+def test_socket_settings_reject_default_authkey():
+    original = os.environ.get('CACHE_SOCKET_AUTHKEY')
+    try:
+        for authkey in ('', 'change_me', 'wellmate_cache', 'short'):
+            os.environ['CACHE_SOCKET_AUTHKEY'] = authkey
+            try:
+                _socket_settings()
+            except RuntimeError:
+                continue
+            raise AssertionError(f"authkey={authkey!r} 不应被接受")
+        os.environ['CACHE_SOCKET_AUTHKEY'] = AUTHKEY.decode('utf-8')
+        assert _socket_settings()[1] == AUTHKEY
+    finally:
+        if original is None:
+            os.environ.pop('CACHE_SOCKET_AUTHKEY', None)
+        else:
+            os.environ['CACHE_SOCKET_AUTHKEY'] = original
+
+
+if __name__ == "__main__":
+    for check in (test_value_codec, test_local_socket_backend, test_redis_backend,
+                  test_socket_settings_reject_default_authkey):
+        check()
+        print(f"✅ {check.__name__}")
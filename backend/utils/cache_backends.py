@@ -0,0 +1,420 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+跨进程共享缓存后端
+
+CacheManager 的本地分片缓存只在单个gunicorn工作进程内有效。配置共享后端后，
+本地缓存作为一级缓存，共享后端作为二级缓存，写入和删除时通过后端广播失效消息，
+让同一主机（或同一Redis）上的其他工作进程清掉各自一级缓存中的旧值。
+
+提供两种实现：
+- LocalSocketCacheBackend：连接由gunicorn master启动的独立缓存进程（LocalCacheServer，Unix socket），
+  不依赖任何外部服务，同一主机上的所有工作进程共享一份缓存
+- RedisCacheBackend：基于Redis协议（GET/SET/DEL/INCR/PUBLISH/SUBSCRIBE），可传入任意兼容的客户端，
+  例如本地的 fakeredis 替身
+
+跨进程传递的值一律编码为JSON（dumps_value / loads_value），不使用pickle：能连上socket或Redis的人
+最多只能读写缓存数据，无法让工作进程执行代码。JSON不能直接表示的类型（datetime、Decimal等）
+通过 register_value_type 注册编码方式，未注册的类型写入共享后端时报错，只保留在进程内缓存。
+本机缓存服务要求配置非默认的 CACHE_SOCKET_AUTHKEY，socket放在只有当前用户可访问（0700）的目录中。
+"""
+
+import os
+import json
+import stat
+import time
+import base64
+import decimal
+import logging
+import datetime
+import threading
+import multiprocessing
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from multiprocessing.connection import Listener, Client
+
+from utils.concurrency import wait_readable
+
+logger = logging.getLogger(__name__)
+
+# Redis为可选依赖，仅在使用RedisCacheBackend时需要
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# 失效消息回调：callback(key, origin)
+InvalidationCallback = Callable[[str, str], None]
+
+
+# ==================== 值的JSON编码 ====================
+
+_TYPE_TAG = '__cache_type__'
+
+# 类型标签 -> (类型, 转为可JSON编码的值, 从该值还原)
+_VALUE_TYPES: Dict[str, Tuple[type, Callable[[Any], Any], Callable[[Any], Any]]] = {}
+_VALUE_TAGS: Dict[type, str] = {}
+
+
+def register_value_type(tag: str, cls: type, to_plain: Callable[[Any], Any],
+                        from_plain: Callable[[Any], Any]) -> None:
+    """注册可写入共享后端的类型（按精确类型匹配，to_plain的结果会继续递归编码）"""
+    _VALUE_TYPES[tag] = (cls, to_plain, from_plain)
+    _VALUE_TAGS[cls] = tag
+
+
+register_value_type('tuple', tuple, list, tuple)
+register_value_type('datetime', datetime.datetime, datetime.datetime.isoformat, datetime.datetime.fromisoformat)
+register_value_type('date', datetime.date, datetime.date.isoformat, datetime.date.fromisoformat)
+register_value_type('time', datetime.time, datetime.time.isoformat, datetime.time.fromisoformat)
+register_value_type('timedelta', datetime.timedelta, datetime.timedelta.total_seconds,
+                    lambda seconds: datetime.timedelta(seconds=seconds))
+register_value_type('decimal', decimal.Decimal, str, decimal.Decimal)
+register_value_type('bytes', bytes, lambda value: base64.b64encode(value).decode('ascii'), base64.b64decode)
+
+
+def _to_json(value: Any) -> Any:
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if type(value) is list:
+        return [_to_json(item) for item in value]
+    if type(value) is dict:
+        if _TYPE_TAG not in value and all(type(key) is str for key in value):
+            return {key: _to_json(item) for key, item in value.items()}
+        # 非字符串键（或与类型标签冲突的键）按键值对列表编码
+        return {_TYPE_TAG: 'dict', 'v': [[_to_json(key), _to_json(item)] for key, item in value.items()]}
+    tag = _VALUE_TAGS.get(type(value))
+    if tag is None:
+        raise TypeError(f"不支持写入共享缓存的类型: {type(value).__name__}")
+    return {_TYPE_TAG: tag, 'v': _to_json(_VALUE_TYPES[tag][1](value))}
+
+
+def _from_json(obj: Dict[str, Any]) -> Any:
+    tag = obj.get(_TYPE_TAG)
+    if tag is None:
+        return obj
+    if tag == 'dict':
+        return {key: item for key, item in obj['v']}
+    if tag not in _VALUE_TYPES:
+        raise ValueError(f"未知的缓存值类型: {tag}")
+    return _VALUE_TYPES[tag][2](obj['v'])
+
+
+def dumps_value(value: Any) -> str:
+    """把缓存值编码为JSON字符串"""
+    return json.dumps(_to_json(value), ensure_ascii=False, separators=(',', ':'))
+
+
+def loads_value(raw) -> Any:
+    """从JSON字符串（或bytes）还原缓存值"""
+    return json.loads(raw, object_hook=_from_json)
+
+
+class CacheBackend:
+    """共享缓存后端接口"""
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        """返回 (是否命中, 值)，值本身可以是None"""
+        raise NotImplementedError
+
+    def set(self, key: str, value: Any, ttl: int) -> None:
+        raise NotImplementedError
+
+    def delete(self, key: str) -> bool:
+        raise NotImplementedError
+
+    def incr(self, key: str, ttl: int) -> int:
+        """原子地把整数值加1并返回新值（键不存在或不是整数时从0开始），同时设置过期时间"""
+        raise NotImplementedError
+
+    def publish_invalidation(self, key: str, origin: str) -> None:
+        """向所有订阅者广播key已失效"""
+        raise NotImplementedError
+
+    def subscribe_invalidations(self, callback: InvalidationCallback) -> None:
+        """在后台线程中接收失效消息并调用callback"""
+        raise NotImplementedError
+
+
+# ==================== 本机共享缓存（Unix socket） ====================
+
+def _send(conn, message) -> None:
+    conn.send_bytes(json.dumps(message, ensure_ascii=False).encode('utf-8'))
+
+
+def _recv(conn) -> Any:
+    return json.loads(conn.recv_bytes())
+
+
+class LocalCacheServer:
+    """
+    本机共享缓存服务
+
+    运行在gunicorn master启动的独立进程中（见 start_local_cache_server），监听Unix socket；
+    每个客户端连接由一个线程处理。请求和响应都是JSON数组 [op, *args]，缓存值以客户端编码好的
+    JSON字符串原样保存，服务端不解析；订阅连接只用于推送失效消息。
+    """
+
+    def __init__(self, address: str, authkey: bytes, max_entries: int = 50000,
+                 max_bytes: int = 256 * 1024 * 1024):
+        # 延迟导入，避免与cache_manager循环导入
+        from utils.cache_manager import CacheManager
+        self.address = address
+        self.authkey = authkey
+        self._store = CacheManager(max_entries=max_entries, max_bytes=max_bytes)
+        self._subscribers = []
+        self._subscribers_lock = threading.Lock()
+        # 每个连接一个线程，incr的读取和写入需要互斥
+        self._incr_lock = threading.Lock()
+        self._listener = None
+
+    def start(self) -> None:
+        _ensure_private_dir(os.path.dirname(self.address))
+        if os.path.exists(self.address):
+            os.unlink(self.address)
+        self._listener = Listener(self.address, family='AF_UNIX', authkey=self.authkey)
+        os.chmod(self.address, 0o600)
+        threading.Thread(target=self._accept_loop, name='cache-server', daemon=True).start()
+        logger.info(f"本机共享缓存服务已启动: {self.address}")
+
+    def _accept_loop(self) -> None:
+        while True:
+            try:
+                conn = self._listener.accept()
+            except Exception as e:
+                logger.warning(f"共享缓存服务接受连接失败: {e}")
+                continue
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn) -> None:
+        try:
+            while True:
+                op, *args = _recv(conn)
+                if op == 'get':
+                    raw = self._store.get(args[0])
+                    _send(conn, [raw is not None, raw])
+                elif op == 'set':
+                    self._store.set(args[0], str(args[1]), args[2])
+                    _send(conn, True)
+                elif op == 'delete':
+                    _send(conn, self._store.delete(args[0]))
+                elif op == 'incr':
+                    _send(conn, self._incr(args[0], args[1]))
+                elif op == 'publish':
+                    _send(conn, self._broadcast(args[0], args[1]))
+                elif op == 'subscribe':
+                    with self._subscribers_lock:
+                        self._subscribers.append(conn)
+                    _send(conn, True)
+                    return  # 订阅连接此后只用于推送
+                else:
+                    _send(conn, None)
+        except (EOFError, OSError, ValueError, TypeError, IndexError):
+            # 连接断开或请求格式不对：关闭连接
+            conn.close()
+
+    def _incr(self, key: str, ttl: int) -> int:
+        with self._incr_lock:
+            raw = self._store.get(key)
+            try:
+                current = loads_value(raw) if raw is not None else 0
+            except ValueError:
+                current = 0
+            value = current + 1 if type(current) is int else 1
+            self._store.set(key, dumps_value(value), ttl)
+        return value
+
+    def _broadcast(self, key: str, origin: str) -> int:
+        delivered = 0
+        with self._subscribers_lock:
+            alive = []
+            for conn in self._subscribers:
+                try:
+                    _send(conn, ['invalidate', key, origin])
+                    alive.append(conn)
+                    delivered += 1
+                except (EOFError, OSError):
+                    conn.close()
+            self._subscribers = alive
+        return delivered
+
+
+class LocalSocketCacheBackend(CacheBackend):
+    """本机共享缓存客户端：每个工作进程一条请求连接（加锁复用）和一条订阅连接"""
+
+    def __init__(self, address: str, authkey: bytes):
+        self.address = address
+        self.authkey = authkey
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _call(self, *request):
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._conn is None:
+                        self._conn = Client(self.address, family='AF_UNIX', authkey=self.authkey)
+                    _send(self._conn, request)
+                    wait_readable(self._conn)
+                    return _recv(self._conn)
+                except (EOFError, OSError):
+                    # 连接断开（如缓存进程重启），重连一次
+                    self._conn = None
+                    if attempt:
+                        raise
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        hit, raw = self._call('get', key)
+        return (True, loads_value(raw)) if hit else (False, None)
+
+    def set(self, key: str, value: Any, ttl: int) -> None:
+        self._call('set', key, dumps_value(value), ttl)
+
+    def delete(self, key: str) -> bool:
+        return self._call('delete', key)
+
+    def incr(self, key: str, ttl: int) -> int:
+        return self._call('incr', key, ttl)
+
+    def publish_invalidation(self, key: str, origin: str) -> None:
+        self._call('publish', key, origin)
+
+    def subscribe_invalidations(self, callback: InvalidationCallback) -> None:
+        conn = Client(self.address, family='AF_UNIX', authkey=self.authkey)
+        _send(conn, ['subscribe'])
+        _recv(conn)
+
+        def listen():
+            try:
+                while True:
+                    wait_readable(conn)
+                    _, key, origin = _recv(conn)
+                    callback(key, origin)
+            except (EOFError, OSError, ValueError):
+                logger.warning("共享缓存失效订阅已断开")
+
+        threading.Thread(target=listen, name='cache-invalidation', daemon=True).start()
+
+
+# ==================== Redis协议后端 ====================
+
+class RedisCacheBackend(CacheBackend):
+    """基于Redis协议的共享缓存，值编码为JSON，失效消息通过PUBLISH广播"""
+
+    def __init__(self, url: Optional[str] = None, client: Any = None,
+                 prefix: str = 'wellmate:cache:', channel: str = 'wellmate:cache:invalidate'):
+        if client is None:
+            if redis is None:
+                raise RuntimeError("未安装redis库，无法使用RedisCacheBackend")
+            client = redis.Redis.from_url(url or 'redis://localhost:6379/0')
+        self._client = client
+        self.prefix = prefix
+        self.channel = channel
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        raw = self._client.get(self.prefix + key)
+        if raw is None:
+            return False, None
+        return True, loads_value(raw)
+
+    def set(self, key: str, value: Any, ttl: int) -> None:
+        self._client.set(self.prefix + key, dumps_value(value), ex=max(1, int(ttl)))
+
+    def delete(self, key: str) -> bool:
+        return self._client.delete(self.prefix + key) > 0
+
+    def incr(self, key: str, ttl: int) -> int:
+        # INCR的结果按JSON数字保存，get读取时与其他值一样解码；值不是整数时Redis报错，由调用方处理
+        value = self._client.incr(self.prefix + key)
+        self._client.expire(self.prefix + key, max(1, int(ttl)))
+        return int(value)
+
+    def publish_invalidation(self, key: str, origin: str) -> None:
+        self._client.publish(self.channel, json.dumps({'key': key, 'origin': origin}))
+
+    def subscribe_invalidations(self, callback: InvalidationCallback) -> None:
+        def handler(message):
+            try:
+                payload = json.loads(message['data'])
+                callback(payload['key'], payload['origin'])
+            except Exception as e:
+                logger.warning(f"解析缓存失效消息失败: {e}")
+
+        pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**{self.channel: handler})
+        pubsub.run_in_thread(sleep_time=1.0, daemon=True)
+
+
+# ==================== 工厂函数 ====================
+
+# 示例配置和旧版本中的默认authkey，不允许用于本机缓存服务
+_DEFAULT_AUTHKEYS = {'', 'wellmate_cache', 'change_me'}
+_MIN_AUTHKEY_LENGTH = 16
+
+
+def _ensure_private_dir(path: str) -> None:
+    """创建（或检查）只有当前用户可访问的目录；已存在但属主或权限不对时拒绝使用"""
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise RuntimeError(f"共享缓存socket目录 {path} 必须是当前用户所有、权限为0700的目录")
+
+
+def _socket_settings() -> Tuple[str, bytes]:
+    """本机缓存服务的socket路径和authkey；authkey未配置或为默认值时拒绝启用"""
+    authkey = os.getenv('CACHE_SOCKET_AUTHKEY', '')
+    if authkey in _DEFAULT_AUTHKEYS or len(authkey) < _MIN_AUTHKEY_LENGTH:
+        raise RuntimeError(f"CACHE_BACKEND=socket 需要配置至少{_MIN_AUTHKEY_LENGTH}个字符的随机 CACHE_SOCKET_AUTHKEY")
+    directory = os.getenv('CACHE_SOCKET_DIR') or f"/tmp/wellmate_cache-{os.getuid()}"
+    return os.path.join(directory, 'cache.sock'), authkey.encode('utf-8')
+
+
+def create_cache_backend_from_env() -> Optional[CacheBackend]:
+    """根据CACHE_BACKEND环境变量创建共享后端（memory表示仅使用进程内缓存）"""
+    backend_type = os.getenv('CACHE_BACKEND', 'memory').lower()
+    try:
+        if backend_type == 'socket':
+            return LocalSocketCacheBackend(*_socket_settings())
+        if backend_type == 'redis':
+            return RedisCacheBackend(url=os.getenv('CACHE_REDIS_URL'))
+    except Exception as e:
+        logger.error(f"创建共享缓存后端失败，仅使用进程内缓存: {e}")
+    return None
+
+
+def _run_local_cache_server(address: str, authkey: bytes, parent_pid: int) -> None:
+    """缓存进程入口：启动服务后等待，master退出时随之退出"""
+    LocalCacheServer(address, authkey).start()
+    while os.getppid() == parent_pid:
+        time.sleep(1)
+
+
+def start_local_cache_server(timeout: float = 5.0) -> Optional[multiprocessing.Process]:
+    """
+    在独立进程中启动本机共享缓存服务（由gunicorn.conf.py的on_starting钩子在master进程中调用）
+
+    缓存服务不在master进程内运行：master中不启动任何线程，fork出的工作进程也不会继承缓存服务的状态。
+    配置不安全（authkey为默认值、socket目录权限不对）时不启动，返回None，工作进程随之只使用进程内缓存。
+    """
+    try:
+        address, authkey = _socket_settings()
+        _ensure_private_dir(os.path.dirname(address))
+    except RuntimeError as e:
+        logger.error(f"本机共享缓存服务未启动: {e}")
+        return None
+    if os.path.exists(address):
+        os.unlink(address)
+
+    # on_starting在master创建监听socket和启动任何线程之前调用，此时fork是安全的
+    process = multiprocessing.get_context('fork').Process(
+        target=_run_local_cache_server, args=(address, authkey, os.getpid()),
+        name='wellmate-cache-server', daemon=True
+    )
+    process.start()
+    # 等待socket就绪，工作进程启动后即可连接
+    deadline = time.monotonic() + timeout
+    while not os.path.exists(address) and process.is_alive() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    if not os.path.exists(address):
+        logger.error(f"本机共享缓存服务未能在{timeout}秒内就绪: {address}")
+    return process
@@ -3,86 +3,324 @@
 """
 缓存管理器
 提供内存缓存功能，减少数据库查询次数
+
+缓存按键哈希分成多个分片，每个分片有独立的锁和LRU链表（OrderedDict），
+不同分片上的读写互不阻塞；总条目数和总字节数有上限，超出时按LRU淘汰；
+过期条目除了读取时惰性删除外，写入时还会按固定间隔对所在分片做一次清理。
+
+配置了共享后端（见 utils/cache_backends.py）时，本地分片缓存作为一级缓存，
+未命中时再查共享后端；写入和删除会广播失效消息，其他工作进程据此清理本地旧值。
 """
 
+import os
+import sys
 import time
+import inspect
 import logging
-from typing import Any, Optional, Dict
+import functools
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Optional, Dict, List
 from threading import Lock
 
+from utils.cache_backends import CacheBackend, create_cache_backend_from_env, register_value_type
+
 logger = logging.getLogger(__name__)
 
+class _CacheShard:
+    """缓存分片：独立的锁、LRU顺序和统计计数"""
+
+    __slots__ = ('lock', 'items', 'bytes', 'next_sweep',
+                 'hits', 'misses', 'evictions', 'expirations')
+
+    def __init__(self):
+        self.lock = Lock()
+        # key -> (value, expires_at, size)，按最近使用顺序排列（末尾为最新）
+        self.items: 'OrderedDict[str, tuple]' = OrderedDict()
+        self.bytes = 0
+        self.next_sweep = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+
+def _estimate_size(value: Any) -> int:
+    """估算对象占用的字节数（仅在写入时计算一次，只展开一层容器）"""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for k, v in value.items():
+            size += sys.getsizeof(k) + sys.getsizeof(v)
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        for item in value:
+            size += sys.getsizeof(item)
+    return size
+
+
 class CacheManager:
     """缓存管理器"""
-    
-    def __init__(self, default_ttl: int = 300):  # 默认5分钟
-        self._cache: Dict[str, Dict[str, Any]] = {}
-        self._lock = Lock()
+
+    def __init__(self, default_ttl: int = 300,  # 默认5分钟
+                 max_entries: int = 10000,
+                 max_bytes: int = 64 * 1024 * 1024,
+                 shards: int = 16,
+                 sweep_interval: int = 60,
+                 backend: Optional[CacheBackend] = None,
+                 local_ttl: int = 30):
         self.default_ttl = default_ttl
-    
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        self._shards: List[_CacheShard] = [_CacheShard() for _ in range(max(1, shards))]
+        # 容量上限平均分配到各分片
+        self._shard_max_entries = max(1, max_entries // len(self._shards))
+        self._shard_max_bytes = max(1, max_bytes // len(self._shards))
+        
+        # 共享后端：本地缓存只保留local_ttl秒，防止失效消息丢失时长期读到旧值
+        self._backend = backend
+        self.local_ttl = local_ttl
+        self._subscribed_pid = None
+        self._invalidation_listeners: List[Callable[[str], None]] = []
+        self._backend_lock = Lock()
+        self._incr_lock = Lock()
+        self._backend_hits = 0
+        self._backend_errors = 0
+
+    @property
+    def shared(self) -> bool:
+        """是否配置了跨工作进程的共享后端"""
+        return self._backend is not None
+
+    def _shard_for(self, key: str) -> _CacheShard:
+        return self._shards[hash(key) % len(self._shards)]
+
     def get(self, key: str) -> Optional[Any]:
-        """获取缓存值"""
-        with self._lock:
-            if key in self._cache:
-                cache_item = self._cache[key]
+        """获取缓存值（本地未命中时查询共享后端）"""
+        value = self._get_local(key)
+        if value is not None or self._backend is None:
+            return value
+        
+        try:
+            self._ensure_subscribed()
+            hit, value = self._backend.get(key)
+        except Exception as e:
+            self._on_backend_error('get', e)
+            return None
+        if hit:
+            with self._backend_lock:
+                self._backend_hits += 1
+            self._set_local(key, value, self.local_ttl)
+            return value
+        return None
+
+    def set(self, key: str, value: Any, ttl: Optional[int] = None) -> bool:
+        """设置缓存值（同时写入共享后端并通知其他工作进程），返回共享后端是否写入成功"""
+        ttl = ttl or self.default_ttl
+        if self._backend is None:
+            self._set_local(key, value, ttl)
+            return True
+        
+        self._set_local(key, value, min(ttl, self.local_ttl))
+        try:
+            self._ensure_subscribed()
+            self._backend.set(key, value, ttl)
+            self._backend.publish_invalidation(key, self._origin())
+        except Exception as e:
+            self._on_backend_error('set', e)
+            return False
+        return True
+
+    def delete(self, key: str) -> bool:
+        """删除缓存项（同时删除共享后端中的值并广播失效）"""
+        deleted = self._delete_local(key)
+        if self._backend is None:
+            return deleted
+        
+        try:
+            self._ensure_subscribed()
+            deleted = self._backend.delete(key) or deleted
+            self._backend.publish_invalidation(key, self._origin())
+        except Exception as e:
+            self._on_backend_error('delete', e)
+        return deleted
+
+    def incr(self, key: str, ttl: Optional[int] = None) -> Optional[int]:
+        """
+        原子地把整数值加1并返回新值（键不存在时从0开始），用于跨工作进程的版本号
+
+        配置了共享后端时在后端上递增并广播失效，后端不可用时返回None；未配置时在进程内递增。
+        """
+        ttl = ttl or self.default_ttl
+        if self._backend is None:
+            with self._incr_lock:
+                current = self._get_local(key)
+                value = current + 1 if type(current) is int else 1
+                self._set_local(key, value, ttl)
+            return value
+        
+        try:
+            self._ensure_subscribed()
+            value = self._backend.incr(key, ttl)
+            self._backend.publish_invalidation(key, self._origin())
+        except Exception as e:
+            self._on_backend_error('incr', e)
+            return None
+        finally:
+            # 不把新值写入本地：并发递增时本地可能留下比共享后端旧的值，下次读取直接查询共享后端
+            self._delete_local(key)
+        return value
+
+    def _get_local(self, key: str) -> Optional[Any]:
+        """从本地分片获取缓存值"""
+        shard = self._shard_for(key)
+        with shard.lock:
+            item = shard.items.get(key)
+            if item is not None:
                 # 检查是否过期
-                if time.time() < cache_item['expires_at']:
-                    logger.debug(f"缓存命中: {key}")
-                    return cache_item['value']
+                if time.time() < item[1]:
+                    shard.items.move_to_end(key)
+                    shard.hits += 1
+                    logger.debug("缓存命中: %s", key)
+                    return item[0]
                 else:
                     # 过期，删除缓存项
-                    del self._cache[key]
-                    logger.debug(f"缓存过期: {key}")
+                    self._remove(shard, key)
+                    shard.expirations += 1
+                    logger.debug("缓存过期: %s", key)
+            shard.misses += 1
             return None
-    
-    def set(self, key: str, value: Any, ttl: Optional[int] = None) -> None:
-        """设置缓存值"""
-        with self._lock:
-            expires_at = time.time() + (ttl or self.default_ttl)
-            self._cache[key] = {
-                'value': value,
-                'expires_at': expires_at,
-                'created_at': time.time()
-            }
-            logger.debug(f"缓存设置: {key}, TTL: {ttl or self.default_ttl}秒")
-    
-    def delete(self, key: str) -> bool:
-        """删除缓存项"""
-        with self._lock:
-            if key in self._cache:
-                del self._cache[key]
-                logger.debug(f"缓存删除: {key}")
+
+    def _set_local(self, key: str, value: Any, ttl: int) -> None:
+        """写入本地分片"""
+        size = sys.getsizeof(key) + _estimate_size(value)
+        now = time.time()
+        shard = self._shard_for(key)
+        with shard.lock:
+            if key in shard.items:
+                self._remove(shard, key)
+            shard.items[key] = (value, now + ttl, size)
+            shard.bytes += size
+
+            # 定期清理本分片的过期条目（摊销到写操作中）
+            if now >= shard.next_sweep:
+                self._sweep(shard, now)
+                shard.next_sweep = now + self.sweep_interval
+
+            # 超出容量时按LRU淘汰最久未使用的条目
+            while shard.items and (len(shard.items) > self._shard_max_entries
+                                   or shard.bytes > self._shard_max_bytes):
+                oldest_key = next(iter(shard.items))
+                self._remove(shard, oldest_key)
+                shard.evictions += 1
+        logger.debug("缓存设置: %s, TTL: %s秒", key, ttl)
+
+    def _delete_local(self, key: str) -> bool:
+        """从本地分片删除缓存项"""
+        shard = self._shard_for(key)
+        with shard.lock:
+            if key in shard.items:
+                self._remove(shard, key)
+                logger.debug("缓存删除: %s", key)
                 return True
             return False
-    
+
+    def _origin(self) -> str:
+        """当前工作进程中本实例的唯一标识，用于忽略自己发出的失效消息"""
+        return f"{os.getpid()}:{id(self)}"
+
+    def _ensure_subscribed(self) -> None:
+        """在当前进程中订阅失效消息（gunicorn fork后每个工作进程各订阅一次）"""
+        pid = os.getpid()
+        if self._subscribed_pid == pid:
+            return
+        with self._backend_lock:
+            if self._subscribed_pid == pid:
+                return
+            self._backend.subscribe_invalidations(self._on_invalidation)
+            self._subscribed_pid = pid
+
+    def add_invalidation_listener(self, callback: Callable[[str], None]) -> None:
+        """注册回调：其他工作进程写入或删除某个键时（在订阅线程中）以该键调用"""
+        self._invalidation_listeners.append(callback)
+
+    def _on_invalidation(self, key: str, origin: str) -> None:
+        if origin == self._origin():
+            return
+        self._delete_local(key)
+        for callback in self._invalidation_listeners:
+            try:
+                callback(key)
+            except Exception as e:
+                logger.error(f"缓存失效回调执行失败: {key}, {e}")
+
+    def _on_backend_error(self, operation: str, error: Exception) -> None:
+        with self._backend_lock:
+            self._backend_errors += 1
+        logger.warning(f"共享缓存后端{operation}失败，仅使用进程内缓存: {error}")
+
     def clear(self) -> None:
         """清空所有缓存"""
-        with self._lock:
-            self._cache.clear()
-            logger.debug("缓存已清空")
-    
+        for shard in self._shards:
+            with shard.lock:
+                shard.items.clear()
+                shard.bytes = 0
+        logger.debug("缓存已清空")
+
+    def purge_expired(self) -> int:
+        """清理所有分片中的过期条目，返回清理数量"""
+        removed = 0
+        now = time.time()
+        for shard in self._shards:
+            with shard.lock:
+                removed += self._sweep(shard, now)
+        return removed
+
     def get_stats(self) -> Dict[str, Any]:
-        """获取缓存统计信息"""
-        with self._lock:
-            current_time = time.time()
-            active_items = {}
-            expired_items = {}
-            
-            for key, item in self._cache.items():
-                if current_time < item['expires_at']:
-                    active_items[key] = item
-                else:
-                    expired_items[key] = item
-            
-            return {
-                'total_items': len(self._cache),
-                'active_items': len(active_items),
-                'expired_items': len(expired_items),
-                'memory_usage': sum(len(str(item)) for item in self._cache.values())
-            }
+        """获取缓存统计信息（逐个分片加锁，只读取计数器，不遍历条目）"""
+        totals = {'total_items': 0, 'memory_usage': 0, 'hits': 0, 'misses': 0,
+                  'evictions': 0, 'expirations': 0}
+        for shard in self._shards:
+            with shard.lock:
+                totals['total_items'] += len(shard.items)
+                totals['memory_usage'] += shard.bytes
+                totals['hits'] += shard.hits
+                totals['misses'] += shard.misses
+                totals['evictions'] += shard.evictions
+                totals['expirations'] += shard.expirations
+
+        lookups = totals['hits'] + totals['misses']
+        totals.update({
+            'hit_rate': round(totals['hits'] / lookups, 4) if lookups else 0.0,
+            'max_entries': self.max_entries,
+            'max_bytes': self.max_bytes,
+            'shards': len(self._shards),
+            'backend': type(self._backend).__name__ if self._backend else None,
+            'backend_hits': self._backend_hits,
+            'backend_errors': self._backend_errors
+        })
+        return totals
 
-# 全局缓存实例
-cache_manager = CacheManager()
+    @staticmethod
+    def _remove(shard: _CacheShard, key: str) -> None:
+        """从分片中移除条目并更新字节计数（调用方需持有分片锁）"""
+        item = shard.items.pop(key)
+        shard.bytes -= item[2]
+
+    def _sweep(self, shard: _CacheShard, now: float) -> int:
+        """清理分片中的过期条目（调用方需持有分片锁）"""
+        expired = [key for key, item in shard.items.items() if item[1] <= now]
+        for key in expired:
+            self._remove(shard, key)
+        shard.expirations += len(expired)
+        return len(expired)
+
+# 全局缓存实例（CACHE_BACKEND=socket/redis时启用跨工作进程共享）
+cache_manager = CacheManager(
+    max_entries=int(os.getenv('CACHE_MAX_ENTRIES', 10000)),
+    max_bytes=int(os.getenv('CACHE_MAX_BYTES', 64 * 1024 * 1024)),
+    backend=create_cache_backend_from_env(),
+    local_ttl=int(os.getenv('CACHE_LOCAL_TTL', 30))
+)
 
 # 缓存键生成器
 def generate_user_cache_key(username: str) -> str:
@@ -93,28 +331,171 @@ def generate_user_uuid_cache_key(user_uuid: str) -> str:
     """生成用户UUID缓存键"""
     return f"user_uuid:{user_uuid}"
 
-# 缓存装饰器
-def cache_result(ttl: int = 300, key_func: Optional[callable] = None):
-    """缓存方法结果的装饰器"""
+def generate_session_cache_key(session_id: str) -> str:
+    """生成会话信息缓存键"""
+    return f"session:{session_id}"
+
+def generate_user_sessions_cache_key(user_uuid: str, session_type: Optional[str] = None) -> str:
+    """生成用户会话列表缓存键"""
+    return f"user_sessions:{user_uuid}:{session_type or 'all'}"
+
+# ==================== 结果缓存装饰器 ====================
+
+class _CachedResult:
+    """缓存中保存的函数结果：value为None表示负缓存，fresh_until之后进入stale窗口"""
+
+    __slots__ = ('value', 'fresh_until')
+
+    def __init__(self, value: Any, fresh_until: float):
+        self.value = value
+        self.fresh_until = fresh_until
+
+
+# 共享后端中按JSON保存：[结果, 新鲜截止时间]
+register_value_type('cached_result', _CachedResult,
+                    lambda entry: [entry.value, entry.fresh_until],
+                    lambda plain: _CachedResult(*plain))
+
+
+class _Flight:
+    """正在进行中的一次加载，并发的相同请求等待它的结果；加载期间键被清除时invalidated为True，结果不写入缓存"""
+
+    __slots__ = ('event', 'result', 'error', 'invalidated')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.invalidated = False
+
+
+_RAISE = object()
+
+
+def _default_key_func(func: Callable) -> Callable[..., str]:
+    """按函数签名绑定参数生成键（跳过self/cls，参数值带类型名，避免1和'1'冲突）"""
+    signature = inspect.signature(func)
+    params = list(signature.parameters)
+    skip = 1 if params and params[0] in ('self', 'cls') else 0
+
+    def key_func(*args, **kwargs) -> str:
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        parts = [f"{name}={type(value).__name__}:{value!r}"
+                 for name, value in list(bound.arguments.items())[skip:]]
+        return f"{func.__module__}.{func.__qualname__}:" + ",".join(parts)
+    return key_func
+
+
+def cache_result(ttl: int = 300, key_func: Optional[Callable[..., str]] = None,
+                 negative_ttl: int = 0, stale_ttl: int = 0,
+                 fallback: Any = _RAISE, cache: Optional[CacheManager] = None,
+                 wait_timeout: float = 10.0):
+    """
+    缓存函数结果的装饰器
+    
+    Args:
+        ttl: 结果的新鲜时间（秒）
+        key_func: 缓存键函数，参数与被装饰函数相同（方法包括self）；默认按签名生成
+        negative_ttl: 结果为None时的缓存时间（秒），0表示不缓存None
+        stale_ttl: 过期后仍可返回旧值的时间（秒），期间由后台线程刷新
+        fallback: 被装饰函数抛出异常时的返回值（可调用对象则调用它生成），
+                  默认继续抛出；异常结果不会被缓存
+        cache: 使用的缓存实例，默认全局cache_manager
+        wait_timeout: 等待其他调用加载同一个键的最长秒数，超时按异常处理（返回fallback）
+    
+    同一进程内同一个键的并发未命中只执行一次被装饰函数，其余调用等待并共享结果；
+    stale窗口内的后台刷新同样登记为该键的加载，同一时刻最多一个刷新线程。
+    包装函数提供 cache_key(*args) 和 invalidate(*args) 用于生成键和清除缓存；
+    清除时正在进行的加载结果不再写入缓存，避免把清除前读到的旧值写回。
+    """
     def decorator(func):
-        def wrapper(*args, **kwargs):
-            # 生成缓存键
-            if key_func:
-                cache_key = key_func(*args, **kwargs)
-            else:
-                # 默认使用函数名和参数生成键
-                cache_key = f"{func.__name__}:{str(args)}:{str(kwargs)}"
-            
-            # 尝试从缓存获取
-            cached_result = cache_manager.get(cache_key)
-            if cached_result is not None:
-                return cached_result
-            
-            # 执行函数并缓存结果
-            result = func(*args, **kwargs)
+        make_key = key_func or _default_key_func(func)
+        store = cache if cache is not None else cache_manager
+        flights: Dict[str, _Flight] = {}
+        flights_lock = Lock()
+
+        def save(cache_key: str, result: Any) -> None:
+            now = time.time()
             if result is not None:
-                cache_manager.set(cache_key, result, ttl)
+                store.set(cache_key, _CachedResult(result, now + ttl), ttl + stale_ttl)
+            elif negative_ttl > 0:
+                store.set(cache_key, _CachedResult(None, now + negative_ttl), negative_ttl)
+
+        def run(cache_key: str, flight: _Flight, args, kwargs) -> Any:
+            """执行已登记的加载，完成后唤醒等待者"""
+            try:
+                flight.result = func(*args, **kwargs)
+                with flights_lock:
+                    invalidated = flight.invalidated
+                if not invalidated:
+                    save(cache_key, flight.result)
+                return flight.result
+            except Exception as e:
+                flight.error = e
+                raise
+            finally:
+                with flights_lock:
+                    flights.pop(cache_key, None)
+                flight.event.set()
+
+        def load(cache_key: str, args, kwargs) -> Any:
+            with flights_lock:
+                flight = flights.get(cache_key)
+                leader = flight is None
+                if leader:
+                    flight = flights[cache_key] = _Flight()
+            
+            if leader:
+                return run(cache_key, flight, args, kwargs)
+            if not flight.event.wait(wait_timeout):
+                raise TimeoutError(f"等待缓存加载超时({wait_timeout}秒): {cache_key}")
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        def refresh(cache_key: str, flight: _Flight, args, kwargs) -> None:
+            try:
+                run(cache_key, flight, args, kwargs)
+            except Exception as e:
+                logger.warning(f"后台刷新缓存失败 {cache_key}: {e}")
+
+        def start_refresh(cache_key: str, args, kwargs) -> None:
+            """该键没有正在进行的加载时登记一次加载并在后台线程中刷新"""
+            with flights_lock:
+                if cache_key in flights:
+                    return
+                flight = flights[cache_key] = _Flight()
+            threading.Thread(target=refresh, args=(cache_key, flight, args, kwargs),
+                             daemon=True).start()
+
+        def invalidate(*args, **kwargs) -> bool:
+            cache_key = make_key(*args, **kwargs)
+            with flights_lock:
+                flight = flights.get(cache_key)
+                if flight is not None:
+                    flight.invalidated = True
+            return store.delete(cache_key)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            cache_key = make_key(*args, **kwargs)
+            entry = store.get(cache_key)
+            if isinstance(entry, _CachedResult):
+                if time.time() >= entry.fresh_until:
+                    # 已过期但仍在stale窗口内：先返回旧值，后台刷新
+                    start_refresh(cache_key, args, kwargs)
+                return entry.value
             
-            return result
+            try:
+                return load(cache_key, args, kwargs)
+            except Exception as e:
+                if fallback is _RAISE:
+                    raise
+                logger.error(f"{func.__qualname__} 执行异常: {e}")
+                return fallback() if callable(fallback) else fallback
+
+        wrapper.cache_key = make_key
+        wrapper.invalidate = invalidate
         return wrapper
-    return decorator
\ No newline at end of file
+    return decorator
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+工作进程并发模式
+
+gunicorn的gevent工作进程在加载应用前对标准库打补丁（monkey patch），socket、threading、
+queue、time.sleep 等都会变成协作式的，因此 requests、纯Python实现的mysql-connector（use_pure）
+和本项目的连接池、后台写入线程无需修改即可在协程中使用。
+
+少数直接读写文件描述符的调用（如 multiprocessing.connection 的 recv）不会被补丁覆盖，
+会阻塞整个工作进程，读之前需调用 wait_readable 让出执行权。
+"""
+
+import os
+
+# gevent为可选依赖，仅协程模式需要
+try:
+    from gevent import monkey as gevent_monkey
+    from gevent.socket import wait_read as gevent_wait_read
+except ImportError:
+    gevent_monkey = None
+    gevent_wait_read = None
+
+# 协程类型的gunicorn工作进程
+COOPERATIVE_WORKER_CLASSES = ('gevent', 'eventlet')
+
+
+def get_worker_class() -> str:
+    """gunicorn工作进程类型（gunicorn.conf.py和连接池大小计算共用）"""
+    # 默认同步模式，协程模式需显式配置GUNICORN_WORKER_CLASS=gevent，不因环境中装了gevent而切换
+    return os.getenv('GUNICORN_WORKER_CLASS') or 'sync'
+
+
+def is_cooperative() -> bool:
+    """当前进程是否已被gevent打过补丁（运行在协程工作进程中）"""
+    return gevent_monkey is not None and gevent_monkey.is_module_patched('socket')
+
+
+def wait_readable(conn) -> None:
+    """协程模式下等待连接可读再读取，避免阻塞式读取卡住整个工作进程；其他模式直接返回"""
+    if is_cooperative():
+        gevent_wait_read(conn.fileno())
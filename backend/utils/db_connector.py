@@ -1,8 +1,84 @@
 import mysql.connector
+from mysql.connector.errors import PoolError
 from config.db_config import DatabaseConfig
 import logging
 import threading
-from typing import Optional
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+from utils.request_timing import record_stage
+
+class PoolMetrics:
+    """连接池运行指标（线程安全）：占用数、排队数、等待耗时分布、取连接失败次数"""
+    
+    # 等待耗时直方图的桶上限（毫秒），最后一个桶为 +Inf
+    WAIT_BUCKETS_MS = (1, 5, 10, 50, 100, 500, 1000, 5000)
+    
+    def __init__(self, pool_size: int):
+        self._lock = threading.Lock()
+        self.pool_size = pool_size
+        self.in_use = 0
+        self.waiters = 0
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self._wait_buckets = [0] * (len(self.WAIT_BUCKETS_MS) + 1)
+        self._wait_sum_ms = 0.0
+        self._wait_max_ms = 0.0
+    
+    def enter_wait(self, max_waiters: int) -> bool:
+        """进入等待队列，队列已满时返回False"""
+        with self._lock:
+            if self.waiters >= max_waiters:
+                return False
+            self.waiters += 1
+            return True
+    
+    def leave_wait(self) -> None:
+        with self._lock:
+            self.waiters -= 1
+    
+    def on_acquired(self, wait_seconds: float) -> None:
+        wait_ms = wait_seconds * 1000
+        index = len(self.WAIT_BUCKETS_MS)
+        for i, bound in enumerate(self.WAIT_BUCKETS_MS):
+            if wait_ms <= bound:
+                index = i
+                break
+        with self._lock:
+            self.in_use += 1
+            self.checkouts += 1
+            self._wait_buckets[index] += 1
+            self._wait_sum_ms += wait_ms
+            self._wait_max_ms = max(self._wait_max_ms, wait_ms)
+    
+    def on_released(self) -> None:
+        with self._lock:
+            self.in_use -= 1
+    
+    def on_failure(self) -> None:
+        with self._lock:
+            self.checkout_failures += 1
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """返回当前指标快照（直方图为累计计数，与Prometheus的le语义一致）"""
+        with self._lock:
+            cumulative = 0
+            histogram = {}
+            for bound, count in zip(list(self.WAIT_BUCKETS_MS) + ['+Inf'], self._wait_buckets):
+                cumulative += count
+                histogram[str(bound)] = cumulative
+            return {
+                'pool_size': self.pool_size,
+                'in_use': self.in_use,
+                'idle': self.pool_size - self.in_use,
+                'waiters': self.waiters,
+                'checkouts': self.checkouts,
+                'checkout_failures': self.checkout_failures,
+                'wait_ms_histogram': histogram,
+                'wait_ms_sum': round(self._wait_sum_ms, 3),
+                'wait_ms_max': round(self._wait_max_ms, 3)
+            }
 
 class DatabaseConnector:
     """高性能数据库连接器 - 使用连接池和连接复用"""
@@ -12,6 +88,17 @@ class DatabaseConnector:
         self._connection_pool = None
         self._connection_params = None
         self._lock = threading.Lock()
+        self._local = threading.local()  # 请求级连接作用域（线程/协程隔离）
+        self._last_used: Dict[int, float] = {}  # 连接最后使用时间，用于空闲检测
+        self._ping_idle_seconds = DatabaseConfig.DB_PING_IDLE_SECONDS
+        
+        # 连接池大小由gunicorn的workers/threads和DB_POOL_SIZE共同决定
+        self._pool_size = DatabaseConfig.get_pool_size()
+        self._pool_timeout = DatabaseConfig.DB_POOL_TIMEOUT
+        self._max_waiters = DatabaseConfig.DB_POOL_MAX_WAITERS
+        self._pool_slots = threading.BoundedSemaphore(self._pool_size)
+        self._metrics = PoolMetrics(self._pool_size)
+        
         self._init_connection_pool()
         logging.info("高性能数据库连接器初始化完成")
     
@@ -36,8 +123,8 @@ class DatabaseConnector:
                         
                         # 连接池配置（使用mysql.connector支持的参数）
                         pool_params = {
-                            'pool_name': 'wellmate_pool',
-                            'pool_size': 3,                 # 减少连接池大小，避免超过MySQL最大连接数
+                            'pool_name': DatabaseConfig.DB_POOL_NAME,
+                            'pool_size': self._pool_size,
                             'pool_reset_session': True
                         }
                         
@@ -52,121 +139,203 @@ class DatabaseConnector:
                         
                     except Exception as e:
                         logging.error(f"连接池初始化失败: {e}")
-                        # 降级为直接连接
+                        # 下次取连接时重新尝试初始化
                         self._connection_pool = None
     
     def get_connection(self, max_retries=2, retry_delay=1.0):
-        """获取数据库连接（使用连接池）"""
-        if self._connection_pool:
-            # 使用连接池
-            retry_count = 0
-            while retry_count <= max_retries:
-                try:
-                    connection = self._connection_pool.get_connection()
-                    if connection.is_connected():
-                        # 验证连接是否有效
-                        try:
-                            cursor = connection.cursor()
-                            cursor.execute("SELECT 1")
-                            cursor.close()
-                            return connection
-                        except mysql.connector.Error:
-                            # 连接无效，关闭并重试
-                            connection.close()
-                            raise mysql.connector.Error("Connection is not valid")
-                except mysql.connector.Error as e:
-                    retry_count += 1
-                    if retry_count <= max_retries:
-                        error_msg = str(e)
-                        if "Too many connections" in error_msg:
-                            logging.warning(f"连接数过多，等待后重试 (第{retry_count}次): {e}")
-                            import time
-                            time.sleep(retry_delay * 2)  # 连接数过多时等待更长时间
-                        else:
-                            logging.warning(f"从连接池获取连接失败，第{retry_count}次重试: {e}")
-                            import time
-                            time.sleep(retry_delay)
-                    else:
-                        logging.error(f"从连接池获取连接失败，已达到最大重试次数: {e}")
-                        # 连接池失败时降级到直接连接
-                        break
+        """获取数据库连接（使用连接池）
         
-        # 连接池不可用或失败，使用直接连接（降级方案）
-        return self._get_direct_connection(max_retries, retry_delay)
-    
-    def _get_direct_connection(self, max_retries=1, retry_delay=0.5):
-        """获取直接连接（降级方案）"""
+        连接池耗尽时在有界队列中等待空闲连接，最多等待 DB_POOL_TIMEOUT 秒；排队请求数
+        超过 DB_POOL_MAX_WAITERS 或等待超时时抛出 PoolError，不再绕过连接池直接建连。
+        连接只有在空闲超过 DB_PING_IDLE_SECONDS 后才会做一次 ping 存活检测，
+        最近刚用过的连接直接返回，不再额外产生往返。
+        """
+        if self._connection_pool is None:
+            self._init_connection_pool()
+            if self._connection_pool is None:
+                self._metrics.on_failure()
+                raise PoolError("数据库连接池不可用")
+        
+        self._acquire_slot()
         retry_count = 0
-        while retry_count <= max_retries:
+        while True:
+            connection = None
             try:
-                # 使用优化后的连接参数
-                params = self._connection_params.copy() if self._connection_params else DatabaseConfig.get_connection_params()
-                params.update({
-                    'connect_timeout': 15,
-                    'connection_timeout': 30,
-                    'buffered': True,
-                    'auth_plugin': 'mysql_native_password',
-                    'use_pure': True
-                })
-                
-                connection = mysql.connector.connect(**params)
-                if connection.is_connected():
-                    logging.info("直接数据库连接成功")
-                    return connection
+                connection = self._connection_pool.get_connection()
+                self._ensure_alive(connection)
+                return connection
             except mysql.connector.Error as e:
+                if connection is not None:
+                    # 连接无效，归还连接池（名额继续保留用于重试）
+                    try:
+                        connection.close()
+                    except Exception:
+                        pass
                 retry_count += 1
-                if retry_count <= max_retries:
-                    logging.warning(f"直接连接失败，第{retry_count}次重试: {e}")
-                    import time
-                    time.sleep(retry_delay)
-                else:
-                    logging.error(f"直接连接失败，已达到最大重试次数: {e}")
+                if retry_count > max_retries:
+                    logging.error(f"从连接池获取连接失败，已达到最大重试次数: {e}")
+                    self._release_slot()
+                    self._metrics.on_failure()
                     raise
-            except Exception as e:
-                logging.error(f"创建直接连接失败: {e}")
-                raise
+                if "Too many connections" in str(e):
+                    logging.warning(f"连接数过多，等待后重试 (第{retry_count}次): {e}")
+                    time.sleep(retry_delay * 2)  # 连接数过多时等待更长时间
+                else:
+                    logging.warning(f"从连接池获取连接失败，第{retry_count}次重试: {e}")
+                    time.sleep(retry_delay)
+    
+    def _acquire_slot(self):
+        """占用一个连接池名额：池满时有界排队等待，排队已满或等待超时则抛出PoolError"""
+        if self._pool_slots.acquire(blocking=False):
+            self._metrics.on_acquired(0.0)
+            return
+        
+        if not self._metrics.enter_wait(self._max_waiters):
+            self._metrics.on_failure()
+            raise PoolError(f"数据库连接池排队请求已达上限({self._max_waiters})")
+        
+        start = time.monotonic()
+        try:
+            acquired = self._pool_slots.acquire(timeout=self._pool_timeout)
+        finally:
+            self._metrics.leave_wait()
+        
+        if not acquired:
+            self._metrics.on_failure()
+            raise PoolError(f"等待数据库连接超时({self._pool_timeout}秒)")
+        self._metrics.on_acquired(time.monotonic() - start)
+    
+    def _release_slot(self):
+        """释放一个连接池名额"""
+        self._metrics.on_released()
+        self._pool_slots.release()
+    
+    def get_pool_stats(self) -> Dict[str, Any]:
+        """获取连接池运行指标"""
+        stats = self._metrics.snapshot()
+        stats.update({
+            'pool_name': DatabaseConfig.DB_POOL_NAME,
+            'pool_available': self._connection_pool is not None,
+            'checkout_timeout_seconds': self._pool_timeout,
+            'max_waiters': self._max_waiters
+        })
+        return stats
+    
+    def _ensure_alive(self, connection):
+        """仅当连接空闲超过阈值（或首次取出）时才ping，失败时原地重连一次"""
+        key = id(getattr(connection, '_cnx', connection))
+        last_used = self._last_used.get(key)
+        now = time.monotonic()
+        if last_used is None or now - last_used > self._ping_idle_seconds:
+            connection.ping(reconnect=True, attempts=1, delay=0)
+        self._last_used[key] = now
+    
+    def _release_connection(self, connection):
+        """归还连接到连接池，记录最后使用时间并释放名额"""
+        try:
+            key = id(getattr(connection, '_cnx', connection))
+            self._last_used[key] = time.monotonic()
+            connection.close()
+        except Exception as e:
+            logging.warning(f"归还数据库连接失败: {e}")
+        finally:
+            self._release_slot()
+    
+    @contextmanager
+    def connection_scope(self):
+        """请求级连接作用域
+        
+        作用域内的 execute_query / execute_update / execute_transaction 复用同一个连接：
+        第一次执行SQL时才从连接池取出，作用域结束时统一归还。支持嵌套，
+        只有最外层作用域负责归还连接。
+        """
+        depth = getattr(self._local, 'depth', 0)
+        self._local.depth = depth + 1
+        try:
+            yield self
+        finally:
+            self._local.depth = depth
+            if depth == 0:
+                connection = getattr(self._local, 'connection', None)
+                self._local.connection = None
+                if connection is not None:
+                    self._release_connection(connection)
+    
+    def _acquire(self):
+        """获取本次操作使用的连接：作用域内复用固定连接，否则从连接池取出"""
+        if getattr(self._local, 'depth', 0) > 0:
+            connection = getattr(self._local, 'connection', None)
+            if connection is None:
+                connection = self.get_connection()
+                self._local.connection = connection
+            return connection
+        return self.get_connection()
+    
+    def _release(self, connection, failed=False):
+        """释放本次操作使用的连接：固定连接在作用域结束前保留，出错时丢弃以便重新获取"""
+        if connection is None:
+            return
+        if connection is getattr(self._local, 'connection', None):
+            if not failed:
+                return
+            self._local.connection = None
+        self._release_connection(connection)
     
     def execute_query(self, query, params=None):
         """执行查询语句"""
+        started = time.perf_counter()
         connection = None
+        cursor = None
+        failed = False
         try:
-            connection = self.get_connection()
+            connection = self._acquire()
             cursor = connection.cursor(dictionary=True)
             cursor.execute(query, params)
             result = cursor.fetchall()
             return result
         except Exception as e:
+            failed = True
             logging.error(f"查询执行失败: {e}")
             raise
         finally:
-            if connection and connection.is_connected():
+            if cursor:
                 cursor.close()
-                connection.close()
+            self._release(connection, failed)
+            # 计入当前请求的数据库阶段耗时（含取连接等待）
+            record_stage('db', time.perf_counter() - started)
     
     def execute_update(self, query, params=None):
         """执行更新语句（INSERT, UPDATE, DELETE）"""
+        started = time.perf_counter()
         connection = None
+        cursor = None
+        failed = False
         try:
-            connection = self.get_connection()
+            connection = self._acquire()
             cursor = connection.cursor()
             cursor.execute(query, params)
             connection.commit()
             return cursor.rowcount
         except Exception as e:
+            failed = True
             if connection:
                 connection.rollback()
             logging.error(f"更新执行失败: {e}")
             raise
         finally:
-            if connection and connection.is_connected():
+            if cursor:
                 cursor.close()
-                connection.close()
+            self._release(connection, failed)
+            record_stage('db', time.perf_counter() - started)
     
     def execute_transaction(self, queries_and_params):
         """执行事务操作"""
+        started = time.perf_counter()
         connection = None
+        cursor = None
+        failed = False
         try:
-            connection = self.get_connection()
+            connection = self._acquire()
             connection.start_transaction()
             cursor = connection.cursor()
             
@@ -176,14 +345,58 @@ class DatabaseConnector:
             connection.commit()
             return cursor.rowcount
         except Exception as e:
+            failed = True
             if connection:
                 connection.rollback()
             logging.error(f"事务执行失败: {e}")
             raise
         finally:
-            if connection and connection.is_connected():
+            if cursor:
+                cursor.close()
+            self._release(connection, failed)
+            record_stage('db', time.perf_counter() - started)
+
+    def execute_batch(self, query, params_seq, extra_queries=None, expected_rowcount=None):
+        """
+        在一个事务中用executemany批量执行同一条语句，再执行附加语句
+        
+        INSERT ... VALUES 语句会被mysql-connector改写为一条多行INSERT，只需一次往返。
+        指定expected_rowcount时，批量语句影响的行数与之不同（如 INSERT IGNORE 忽略了并发写入的重复记录）
+        则回滚整个事务，不执行附加语句。
+        
+        Returns:
+            批量语句影响的行数
+        """
+        started = time.perf_counter()
+        connection = None
+        cursor = None
+        failed = False
+        try:
+            connection = self._acquire()
+            connection.start_transaction()
+            cursor = connection.cursor()
+            
+            cursor.executemany(query, params_seq)
+            rowcount = cursor.rowcount
+            if expected_rowcount is not None and rowcount != expected_rowcount:
+                connection.rollback()
+                return rowcount
+            for extra_query, params in extra_queries or ():
+                cursor.execute(extra_query, params)
+            
+            connection.commit()
+            return rowcount
+        except Exception as e:
+            failed = True
+            if connection:
+                connection.rollback()
+            logging.error(f"批量执行失败: {e}")
+            raise
+        finally:
+            if cursor:
                 cursor.close()
-                connection.close()
+            self._release(connection, failed)
+            record_stage('db', time.perf_counter() - started)
 
 # 延迟初始化全局数据库连接实例
 _db_connector_instance = None
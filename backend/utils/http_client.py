@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+上游服务HTTP客户端
+
+每个上游服务（Coze、Mental Agent）一个客户端：复用 requests.Session，按主机维护keep-alive连接池，
+后续请求不再重复TCP/TLS握手；统一配置连接/读取超时，对连接失败和网关类错误做有限次数的
+抖动退避重试，并按上游服务记录延迟直方图和错误数。
+
+POST等非幂等请求只在请求确定未发出（建立连接失败）或上游明确拒绝处理（429/503）时重试，
+请求发出后连接断开或网关返回502/504时上游可能已在处理（如已扣费的AI对话），不再重试。
+
+requests（urllib3）只支持HTTP/1.1，复用连接已省去每次调用的握手开销；HTTP/2需要换用httpx+h2，
+当前未引入该依赖。
+"""
+
+import os
+import time
+import random
+import logging
+import threading
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError
+
+from utils.latency_stats import get_histogram
+from utils.request_timing import record_stage
+
+logger = logging.getLogger(__name__)
+
+# 幂等请求遇到这些状态码时重试
+RETRY_STATUS_CODES = frozenset([429, 502, 503, 504])
+
+# 上游明确表示未处理请求的状态码，非幂等请求也可以重试
+NON_IDEMPOTENT_RETRY_STATUS_CODES = frozenset([429, 503])
+
+# 重复发送不会产生额外副作用的方法（RFC 9110）
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'TRACE', 'PUT', 'DELETE'])
+
+# 所有上游客户端，用于统一输出指标
+_clients: Dict[str, 'UpstreamClient'] = {}
+
+
+class UpstreamClient:
+    """单个上游服务的连接池化HTTP客户端"""
+
+    def __init__(self, name: str, connect_timeout: float = 5.0, read_timeout: float = 60.0,
+                 retries: int = 2, backoff: float = 0.2, max_backoff: float = 2.0,
+                 pool_maxsize: int = 32, max_retry_after: float = 10.0):
+        self.name = name
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.pool_maxsize = pool_maxsize
+        self.max_retry_after = max_retry_after
+        self._session = None
+        self._session_pid = None
+        self._session_lock = threading.Lock()
+        self._histogram = get_histogram(f'upstream_{name}')
+        self._stats_lock = threading.Lock()
+        self._requests = 0
+        self._retried = 0
+        self._errors = 0
+        _clients[name] = self
+
+    @property
+    def session(self) -> requests.Session:
+        """当前进程的Session（gunicorn fork后每个工作进程各建一个，不共享父进程的连接）"""
+        pid = os.getpid()
+        if self._session_pid != pid:
+            with self._session_lock:
+                if self._session_pid != pid:
+                    session = requests.Session()
+                    # 重试由本客户端控制，连接池内部不重试
+                    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_maxsize,
+                                          max_retries=0, pool_block=False)
+                    session.mount('http://', adapter)
+                    session.mount('https://', adapter)
+                    self._session = session
+                    self._session_pid = pid
+        return self._session
+
+    def request(self, method: str, url: str, timeout: Optional[Any] = None,
+                read_timeout: Optional[float] = None, idempotent: Optional[bool] = None,
+                **kwargs) -> requests.Response:
+        """
+        发送请求，参数与 requests.request 相同
+
+        idempotent: 请求能否重复发送，默认按方法判断（POST/PATCH为否）
+        幂等请求：连接失败（含复用的连接已被上游关闭）和 RETRY_STATUS_CODES 状态码会重试；
+        非幂等请求：只重试建立连接失败和 NON_IDEMPOTENT_RETRY_STATUS_CODES 状态码；
+        读取超时都不重试（上游可能已在处理）。响应带 Retry-After 时按其等待，超过 max_retry_after 则不重试。
+        最终失败时抛出requests的异常或返回最后一次的响应，与直接使用requests时的行为一致。
+        """
+        if timeout is None:
+            timeout = (self.connect_timeout, read_timeout or self.read_timeout)
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+        retry_status_codes = RETRY_STATUS_CODES if idempotent else NON_IDEMPOTENT_RETRY_STATUS_CODES
+
+        for attempt in range(self.retries + 1):
+            start = time.perf_counter()
+            self._count('_requests')
+            try:
+                response = self.session.request(method, url, timeout=timeout, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.ConnectTimeout) as e:
+                self._observe(time.perf_counter() - start)
+                # 幂等请求包括连接池中keep-alive连接已被上游关闭的情况；ReadTimeout不是ConnectionError，不会进入这里
+                if attempt < self.retries and (idempotent or _is_connect_failure(e)):
+                    self._sleep_before_retry(attempt, e)
+                    continue
+                self._count('_errors')
+                raise
+            except requests.exceptions.RequestException:
+                self._observe(time.perf_counter() - start)
+                self._count('_errors')
+                raise
+
+            # stream=True时记录的是收到响应头的耗时
+            self._observe(time.perf_counter() - start)
+            if response.status_code in retry_status_codes and attempt < self.retries:
+                retry_after = _parse_retry_after(response.headers.get('Retry-After'))
+                if retry_after is None or retry_after <= self.max_retry_after:
+                    response.close()
+                    self._sleep_before_retry(attempt, f"HTTP {response.status_code}", retry_after)
+                    continue
+            if response.status_code >= 500:
+                self._count('_errors')
+            return response
+
+    def _count(self, counter: str) -> None:
+        """计数加一（线程模式下多个线程共用同一个客户端）"""
+        with self._stats_lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _observe(self, seconds: float) -> None:
+        self._histogram.observe(seconds)
+        record_stage(f'upstream_{self.name}', seconds)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    def _sleep_before_retry(self, attempt: int, reason: Any, retry_after: Optional[float] = None) -> None:
+        """指数退避加全抖动，避免多个工作进程同时重试；上游给出Retry-After时至少等待该时长"""
+        self._count('_retried')
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt)))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        logger.warning(f"上游服务({self.name})请求失败，{delay:.2f}秒后重试: {reason}")
+        time.sleep(delay)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            counters = {'requests': self._requests, 'retried': self._retried, 'errors': self._errors}
+        counters['latency'] = self._histogram.snapshot()
+        return counters
+
+
+def _is_connect_failure(error: Exception) -> bool:
+    """是否在建立连接时失败（请求一定没有发出）"""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    # requests把urllib3的异常包在 MaxRetryError.reason 中；NewConnectionError（连接被拒绝、DNS失败等）
+    # 是 ConnectTimeoutError 的子类
+    reason = error.args[0] if error.args else None
+    reason = getattr(reason, 'reason', reason)
+    return isinstance(reason, ConnectTimeoutError)
+
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """解析Retry-After（秒数或HTTP日期），无法解析时返回None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def create_upstream_client(name: str, read_timeout: float = 60.0) -> UpstreamClient:
+    """按环境变量创建上游客户端（UPSTREAM_* 为所有上游的默认值）"""
+    return UpstreamClient(
+        name,
+        connect_timeout=float(os.getenv('UPSTREAM_CONNECT_TIMEOUT', 5)),
+        read_timeout=read_timeout,
+        retries=int(os.getenv('UPSTREAM_RETRIES', 2)),
+        backoff=float(os.getenv('UPSTREAM_RETRY_BACKOFF', 0.2)),
+        pool_maxsize=int(os.getenv('UPSTREAM_POOL_MAXSIZE', 32))
+    )
+
+
+def get_upstream_stats() -> Dict[str, Dict[str, Any]]:
+    """所有上游客户端的请求数、重试数、错误数和延迟直方图"""
+    return {name: client.get_stats() for name, client in sorted(_clients.items())}
@@ -1,7 +1,11 @@
 """
 JWT工具模块
 
-提供JWT token的生成、验证和刷新功能
+提供JWT token的生成、验证、刷新和吊销功能
+
+验证通过的token按摘要缓存（见 utils/token_cache.py），同一token在缓存有效期内不再重复签名校验和解码；
+每次验证都查询吊销列表。access token内带有路由需要的用户信息（uuid、username、full_name），
+认证时不查询数据库。
 """
 
 import jwt
@@ -10,6 +14,9 @@ from flask import request, jsonify
 import logging
 from functools import wraps
 
+from utils.token_cache import token_digest, verified_token_cache, token_revocation_list
+from utils.request_timing import span
+
 logger = logging.getLogger(__name__)
 
 # JWT配置
@@ -19,13 +26,14 @@ JWT_EXPIRATION_HOURS = 24  # token有效期24小时
 JWT_REFRESH_EXPIRATION_DAYS = 7  # refresh token有效期7天
 
 
-def generate_access_token(uuid, username):
+def generate_access_token(uuid, username, full_name=None):
     """
     生成访问token
     
     Args:
         uuid: 用户UUID
         username: 用户名
+        full_name: 用户姓名（可选，写入token供路由直接使用）
         
     Returns:
         str: JWT token
@@ -37,18 +45,21 @@ def generate_access_token(uuid, username):
         'iat': datetime.datetime.utcnow(),
         'type': 'access'
     }
+    if full_name:
+        payload['full_name'] = full_name
     
     token = jwt.encode(payload, JWT_SECRET_KEY, algorithm=JWT_ALGORITHM)
     return token
 
 
-def generate_refresh_token(uuid, username):
+def generate_refresh_token(uuid, username, full_name=None):
     """
     生成刷新token
     
     Args:
         uuid: 用户UUID
         username: 用户名
+        full_name: 用户姓名（可选，刷新时写入新的access token）
         
     Returns:
         str: 刷新token
@@ -60,6 +71,8 @@ def generate_refresh_token(uuid, username):
         'iat': datetime.datetime.utcnow(),
         'type': 'refresh'
     }
+    if full_name:
+        payload['full_name'] = full_name
     
     token = jwt.encode(payload, JWT_SECRET_KEY, algorithm=JWT_ALGORITHM)
     return token
@@ -73,17 +86,73 @@ def verify_token(token):
         token: JWT token
         
     Returns:
-        dict: token payload或None
+        dict: token payload（只读）或None
     """
+    with span('auth'):
+        return _verify_token(token)
+
+
+def _verify_token(token):
+    digest = token_digest(token)
+    if token_revocation_list.is_revoked(digest):
+        logger.warning("Token已吊销")
+        return None
+    
+    payload = verified_token_cache.get(digest)
+    if payload is not None:
+        return payload
+    
     try:
         payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
-        return payload
     except jwt.ExpiredSignatureError:
         logger.warning("Token已过期")
         return None
     except jwt.InvalidTokenError:
         logger.warning("无效的token")
         return None
+    
+    # 其他工作进程的吊销通过广播记入本进程列表；广播之前已吊销的token在这里（验证缓存未命中时）查询共享后端
+    if token_revocation_list.is_revoked_shared(digest, payload.get('exp')):
+        logger.warning("Token已吊销")
+        return None
+    verified_token_cache.put(digest, payload)
+    return payload
+
+
+def revoke_token(token):
+    """
+    吊销token（退出登录时调用），吊销记录保留到token过期
+    
+    需要共享缓存后端（见 utils/token_cache.py）；未配置时不吊销，token在过期前仍然有效
+    
+    Args:
+        token: JWT token
+        
+    Returns:
+        bool: 是否吊销成功（未配置共享后端、写入失败、无效或已过期的token返回False）
+    """
+    if not token_revocation_list.supported:
+        return False
+    payload = verify_token(token)
+    if not payload:
+        return False
+    digest = token_digest(token)
+    revoked = token_revocation_list.revoke(digest, payload.get('exp'))
+    verified_token_cache.discard(digest)
+    return revoked
+
+
+def build_current_user(payload):
+    """由token payload生成路由使用的current_user，并写入请求上下文"""
+    current_user = {
+        'uuid': payload['uuid'],
+        'username': payload['username']
+    }
+    if payload.get('full_name'):
+        current_user['full_name'] = payload['full_name']
+    request.uuid = payload['uuid']
+    request.username = payload['username']
+    return current_user
 
 
 def token_required(f):
@@ -135,15 +204,8 @@ def token_required(f):
                 'error_code': 'INVALID_TOKEN_TYPE'
             }), 401
         
-        # 创建用户信息字典
-        current_user = {
-            'uuid': payload['uuid'],
-            'username': payload['username']
-        }
-        
-        # 将用户信息添加到请求上下文
-        request.uuid = payload['uuid']
-        request.username = payload['username']
+        # 创建用户信息字典并添加到请求上下文
+        current_user = build_current_user(payload)
         
         # 将用户信息作为参数传递给被装饰函数
         return f(current_user, *args, **kwargs)
@@ -175,12 +237,7 @@ def token_optional(f):
             
             if payload and payload.get('type') == 'access':
                 # 验证成功，创建用户信息
-                current_user = {
-                    'uuid': payload['uuid'],
-                    'username': payload['username']
-                }
-                request.uuid = payload['uuid']
-                request.username = payload['username']
+                current_user = build_current_user(payload)
             else:
                 # token无效，使用匿名用户
                 current_user = {
@@ -220,10 +277,10 @@ def refresh_token(refresh_token):
         return None
     
     # 生成新的access token
-    new_access_token = generate_access_token(payload['uuid'], payload['username'])
+    new_access_token = generate_access_token(payload['uuid'], payload['username'], payload.get('full_name'))
     
     # 生成新的refresh token（可选，可以延长有效期）
-    new_refresh_token = generate_refresh_token(payload['uuid'], payload['username'])
+    new_refresh_token = generate_refresh_token(payload['uuid'], payload['username'], payload.get('full_name'))
     
     return {
         'access_token': new_access_token,
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+延迟指标统计
+
+- LatencyStats：保留最近N个样本（环形缓冲区），按需计算次数、均值和分位数，
+  用于对比首字延迟（TTFT）等接口耗时
+- LatencyHistogram：固定分桶的累计直方图（与Prometheus histogram相同的语义），
+  用于上游服务调用等长期累计的延迟分布
+
+指标按工作进程独立统计。
+"""
+
+import bisect
+import threading
+from collections import deque
+from typing import Any, Dict, Sequence
+
+# 默认直方图分桶上界（毫秒），覆盖本地调用到AI模型长回复
+DEFAULT_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+
+
+class LatencyStats:
+    """单个延迟指标（单位：秒）"""
+
+    def __init__(self, name: str, max_samples: int = 1024):
+        self.name = name
+        self._samples = deque(maxlen=max_samples)
+        self._lock = threading.Lock()
+        self._count = 0
+        self._total = 0.0
+
+    def observe(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+            self._count += 1
+            self._total += seconds
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            samples = sorted(self._samples)
+            count, total = self._count, self._total
+
+        def percentile(p):
+            if not samples:
+                return None
+            return round(samples[min(len(samples) - 1, int(p * len(samples)))] * 1000, 2)
+
+        return {
+            'count': count,
+            'avg_ms': round(total / count * 1000, 2) if count else None,
+            'p50_ms': percentile(0.5),
+            'p90_ms': percentile(0.9),
+            'p99_ms': percentile(0.99),
+            'max_ms': round(samples[-1] * 1000, 2) if samples else None
+        }
+
+
+class LatencyHistogram:
+    """固定分桶的延迟直方图（observe单位为秒，输出单位为毫秒，与连接池等待直方图格式一致）"""
+
+    def __init__(self, name: str, buckets_ms: Sequence[float] = DEFAULT_BUCKETS_MS):
+        self.name = name
+        self.buckets_ms = tuple(sorted(buckets_ms))
+        self._counts = [0] * (len(self.buckets_ms) + 1)  # 最后一个为 +Inf
+        self._sum_ms = 0.0
+        self._max_ms = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        value_ms = seconds * 1000
+        index = bisect.bisect_left(self.buckets_ms, value_ms)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum_ms += value_ms
+            self._max_ms = max(self._max_ms, value_ms)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """返回累计计数直方图（与Prometheus的le语义一致）、总次数、总耗时和最大值"""
+        with self._lock:
+            counts = list(self._counts)
+            sum_ms, max_ms = self._sum_ms, self._max_ms
+        cumulative = 0
+        histogram = {}
+        for bound, count in zip(list(self.buckets_ms) + ['+Inf'], counts):
+            cumulative += count
+            histogram[str(bound)] = cumulative
+        return {
+            'count': cumulative,
+            'ms_histogram': histogram,
+            'ms_sum': round(sum_ms, 3),
+            'ms_max': round(max_ms, 3)
+        }
+
+
+_registry: Dict[str, LatencyStats] = {}
+_histograms: Dict[str, LatencyHistogram] = {}
+_registry_lock = threading.Lock()
+
+
+def get_latency_stats(name: str) -> LatencyStats:
+    """获取（不存在时创建）指定名称的延迟指标"""
+    stats = _registry.get(name)
+    if stats is None:
+        with _registry_lock:
+            stats = _registry.setdefault(name, LatencyStats(name))
+    return stats
+
+
+def get_histogram(name: str, buckets_ms: Sequence[float] = DEFAULT_BUCKETS_MS) -> LatencyHistogram:
+    """获取（不存在时创建）指定名称的延迟直方图"""
+    histogram = _histograms.get(name)
+    if histogram is None:
+        with _registry_lock:
+            histogram = _histograms.setdefault(name, LatencyHistogram(name, buckets_ms))
+    return histogram
+
+
+def snapshot_all() -> Dict[str, Dict[str, Any]]:
+    """所有延迟指标的当前快照"""
+    with _registry_lock:
+        items = list(_registry.items())
+    return {name: stats.snapshot() for name, stats in sorted(items)}
+
+
+def snapshot_histograms() -> Dict[str, Dict[str, Any]]:
+    """所有延迟直方图的当前快照"""
+    with _registry_lock:
+        items = list(_histograms.items())
+    return {name: histogram.snapshot() for name, histogram in sorted(items)}
@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Prometheus文本格式指标导出
+
+把各模块已有的指标快照（请求耗时、分阶段耗时、上游服务、数据库连接池、缓存、token缓存、
+后台队列、延迟分位数）渲染为Prometheus exposition格式（text/plain; version=0.0.4），由 /metrics 接口返回。
+直方图内部以毫秒分桶，导出时换算为秒（Prometheus约定）。
+
+指标在每个工作进程中各自统计。gunicorn下（master启动时调用 init_multiprocess_dir）每个工作进程
+每 METRICS_FLUSH_INTERVAL 秒把快照写入私有目录中的 <pid>.json，/metrics 由任一工作进程汇总所有快照：
+- counter、histogram 按标签求和；工作进程退出后其值并入 dead.json，汇总值不会因进程重启而回退
+- gauge 对存活的工作进程求和（采样率等配置取最大值）
+- summary（最近样本的分位数）无法合并，带 pid 标签按进程输出
+/metrics 只允许 METRICS_ALLOWED_IPS 中的地址直接访问（默认仅本机，经代理转发的请求不算），
+或携带 Authorization: Bearer <METRICS_TOKEN>。
+"""
+
+import os
+import hmac
+import json
+import time
+import logging
+import ipaddress
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+# 文件锁仅Unix可用（多进程汇总只在gunicorn下启用）
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+PREFIX = 'wellmate'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# 多进程快照目录（由 init_multiprocess_dir 写入环境变量，fork出的工作进程继承）
+MULTIPROC_DIR_ENV = 'METRICS_MULTIPROC_DIR'
+DEAD_SNAPSHOT = 'dead.json'
+
+# 跨进程汇总方式：sum 求和；max 取最大值；pid 不合并，按进程输出（带pid标签）
+AGGREGATE_SUM = 'sum'
+AGGREGATE_MAX = 'max'
+AGGREGATE_PID = 'pid'
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(labels: Dict[str, Any]) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + '}'
+
+
+class _Writer:
+    """按指标名分组收集 HELP/TYPE 和样本"""
+
+    def __init__(self):
+        # 指标名 -> {'type', 'help', 'aggregate', 'samples': [[样本名, 标签, 值], ...]}
+        self.metrics: Dict[str, Dict[str, Any]] = {}
+        self._current: Optional[Dict[str, Any]] = None
+
+    def declare(self, name: str, metric_type: str, help_text: str, aggregate: str = AGGREGATE_SUM) -> None:
+        metric = self.metrics.get(name)
+        if metric is None:
+            metric = self.metrics[name] = {'type': metric_type, 'help': help_text,
+                                           'aggregate': aggregate, 'samples': []}
+        self._current = metric
+
+    def sample(self, name: str, labels: Dict[str, Any], value: Any) -> None:
+        if value is None:
+            return
+        if self._current['aggregate'] == AGGREGATE_PID:
+            labels = dict(labels, pid=os.getpid())
+        self._current['samples'].append([name, {key: str(val) for key, val in labels.items()}, value])
+
+    def histogram_ms(self, name: str, help_text: str, labels: Dict[str, Any],
+                     histogram: Dict[str, int], sum_ms: float) -> None:
+        """毫秒分桶的累计直方图快照 -> 以秒为单位的Prometheus histogram"""
+        self.declare(name, 'histogram', help_text)
+        count = 0
+        for bound, cumulative in histogram.items():
+            le = bound if bound == '+Inf' else repr(float(bound) / 1000)
+            self.sample(f"{name}_bucket", dict(labels, le=le), cumulative)
+            count = cumulative
+        self.sample(f"{name}_sum", labels, round(sum_ms / 1000, 6))
+        self.sample(f"{name}_count", labels, count)
+
+
+def collect_metrics() -> Dict[str, Dict[str, Any]]:
+    """收集当前工作进程的全部指标"""
+    writer = _Writer()
+    for collect in (_collect_requests, _collect_upstreams, _collect_db_pool, _collect_caches,
+                    _collect_background_queues, _collect_latency_summaries):
+        try:
+            collect(writer)
+        except Exception as e:
+            logger.warning(f"指标收集失败({collect.__name__}): {e}")
+    return writer.metrics
+
+
+def render_metrics() -> str:
+    """生成指标文本：多进程模式下汇总所有工作进程，否则只有当前进程"""
+    metrics = collect_metrics()
+    directory = os.getenv(MULTIPROC_DIR_ENV)
+    if directory and fcntl is not None:
+        try:
+            _write_snapshot(directory, os.getpid(), metrics)
+            metrics = _merge_snapshots(directory)
+        except Exception as e:
+            logger.warning(f"汇总工作进程指标失败，只输出当前进程: {e}")
+    return _render(metrics)
+
+
+def _render(metrics: Dict[str, Dict[str, Any]]) -> str:
+    lines: List[str] = []
+    for name, metric in metrics.items():
+        if not metric['samples']:
+            continue
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        for sample_name, labels, value in metric['samples']:
+            if isinstance(value, float):
+                value = round(value, 6)
+            lines.append(f"{sample_name}{_labels(labels)} {value}")
+    return '\n'.join(lines) + '\n'
+
+
+# ---- 多进程汇总 ----
+
+def init_multiprocess_dir() -> Optional[str]:
+    """
+    gunicorn master启动时调用：准备快照目录（当前用户私有）并清除上次运行留下的快照，
+    目录写入环境变量 METRICS_MULTIPROC_DIR 供工作进程使用
+    """
+    from utils.cache_backends import _ensure_private_dir
+
+    directory = os.getenv(MULTIPROC_DIR_ENV) or f"/tmp/wellmate_metrics-{os.getuid()}"
+    try:
+        _ensure_private_dir(directory)
+    except (RuntimeError, OSError) as e:
+        os.environ.pop(MULTIPROC_DIR_ENV, None)
+        logger.error(f"指标快照目录不可用，/metrics只输出处理请求的工作进程: {e}")
+        return None
+    for filename in os.listdir(directory):
+        if filename.endswith('.json'):
+            os.unlink(os.path.join(directory, filename))
+    os.environ[MULTIPROC_DIR_ENV] = directory
+    return directory
+
+
+def start_snapshot_writer() -> None:
+    """工作进程启动后调用：后台线程定期写入本进程的快照（没有处理/metrics请求的进程也会被汇总）"""
+    directory = os.getenv(MULTIPROC_DIR_ENV)
+    if not directory:
+        return
+    interval = float(os.getenv('METRICS_FLUSH_INTERVAL', 5))
+
+    def run():
+        while True:
+            time.sleep(interval)
+            flush_snapshot()
+
+    threading.Thread(target=run, name='metrics-snapshot', daemon=True).start()
+
+
+def flush_snapshot() -> None:
+    """立即写入本进程的快照（工作进程退出前调用一次，保留最后的计数）"""
+    directory = os.getenv(MULTIPROC_DIR_ENV)
+    if not directory:
+        return
+    try:
+        _write_snapshot(directory, os.getpid(), collect_metrics())
+    except Exception as e:
+        logger.warning(f"写入指标快照失败: {e}")
+
+
+def mark_process_dead(pid: int) -> None:
+    """
+    master在工作进程退出后调用：counter/histogram并入 dead.json，gauge/summary丢弃，删除该进程的快照
+    """
+    directory = os.getenv(MULTIPROC_DIR_ENV)
+    if not directory:
+        return
+    path = os.path.join(directory, f"{pid}.json")
+    with _snapshot_lock(directory, fcntl.LOCK_EX):
+        snapshot = _read_snapshot(path)
+        if snapshot is None:
+            return
+        dead = _read_snapshot(os.path.join(directory, DEAD_SNAPSHOT)) or {}
+        retained = {name: metric for name, metric in snapshot.items()
+                    if metric['type'] in ('counter', 'histogram')}
+        _write_json(os.path.join(directory, DEAD_SNAPSHOT), _merge([dead, retained]))
+        os.unlink(path)
+
+
+@contextmanager
+def _snapshot_lock(directory: str, operation: int):
+    """读取所有快照时加共享锁，master合并已退出进程的快照时加排他锁，避免同一进程的计数被读到两次"""
+    with open(os.path.join(directory, 'snapshots.lock'), 'a') as lock_file:
+        fcntl.flock(lock_file, operation)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _write_json(path: str, data: Any) -> None:
+    """先写临时文件再改名，读取方不会读到写了一半的文件"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, separators=(',', ':'))
+    os.replace(tmp_path, path)
+
+
+def _write_snapshot(directory: str, pid: int, metrics: Dict[str, Dict[str, Any]]) -> None:
+    _write_json(os.path.join(directory, f"{pid}.json"), metrics)
+
+
+def _read_snapshot(path: str) -> Optional[Dict[str, Dict[str, Any]]]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except ValueError as e:
+        logger.warning(f"指标快照损坏，已忽略: {path}, {e}")
+        return None
+
+
+def _merge_snapshots(directory: str) -> Dict[str, Dict[str, Any]]:
+    with _snapshot_lock(directory, fcntl.LOCK_SH):
+        snapshots = []
+        for filename in sorted(os.listdir(directory)):
+            if filename.endswith('.json'):
+                snapshot = _read_snapshot(os.path.join(directory, filename))
+                if snapshot:
+                    snapshots.append(snapshot)
+    return _merge(snapshots)
+
+
+def _merge(snapshots: List[Dict[str, Dict[str, Any]]]) -> Dict[str, Dict[str, Any]]:
+    """按指标的汇总方式合并多个进程的快照"""
+    merged: Dict[str, Dict[str, Any]] = {}
+    values: Dict[str, Dict[tuple, list]] = {}
+    for snapshot in snapshots:
+        for name, metric in snapshot.items():
+            if name not in merged:
+                merged[name] = {key: metric[key] for key in ('type', 'help', 'aggregate')}
+                values[name] = {}
+            aggregate = merged[name]['aggregate']
+            samples = values[name]
+            for sample_name, labels, value in metric['samples']:
+                key = (sample_name, tuple(labels.items()))
+                entry = samples.get(key)
+                if entry is None:
+                    samples[key] = [sample_name, labels, value]
+                elif aggregate == AGGREGATE_MAX:
+                    entry[2] = max(entry[2], value)
+                else:
+                    entry[2] += value
+    for name, metric in merged.items():
+        metric['samples'] = list(values[name].values())
+    return merged
+
+
+def metrics_access_allowed(remote_addr: Optional[str], headers) -> bool:
+    """/metrics 访问控制：METRICS_TOKEN 匹配，或直接来自 METRICS_ALLOWED_IPS 中的地址"""
+    token = os.getenv('METRICS_TOKEN', '')
+    authorization = headers.get('Authorization', '')
+    if token and authorization.startswith('Bearer ') and hmac.compare_digest(authorization[7:], token):
+        return True
+    # 经反向代理转发的请求remote_addr是代理地址，不按地址放行
+    if headers.get('X-Forwarded-For') or not remote_addr:
+        return False
+    try:
+        address = ipaddress.ip_address(remote_addr)
+    except ValueError:
+        return False
+    for network in os.getenv('METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(','):
+        network = network.strip()
+        if not network:
+            continue
+        try:
+            if address in ipaddress.ip_network(network, strict=False):
+                return True
+        except ValueError:
+            logger.warning(f"METRICS_ALLOWED_IPS 中的地址无效: {network}")
+    return False
+
+
+def _collect_requests(writer: _Writer) -> None:
+    from utils.request_timing import get_request_timing_stats
+
+    stats = get_request_timing_stats()
+    name = f"{PREFIX}_http_request_duration_seconds"
+    for (method, route, status), snapshot in stats['requests'].items():
+        writer.histogram_ms(name, 'HTTP request duration until response headers',
+                            {'method': method, 'route': route, 'status': status},
+                            snapshot['ms_histogram'], snapshot['ms_sum'])
+
+    name = f"{PREFIX}_request_stage_duration_seconds"
+    for stage, snapshot in stats['stages'].items():
+        writer.histogram_ms(name, 'Per-request time spent in a stage (sampled requests)',
+                            {'stage': stage}, snapshot['ms_histogram'], snapshot['ms_sum'])
+    name = f"{PREFIX}_request_stage_calls_total"
+    writer.declare(name, 'counter', 'Calls made in a stage, e.g. SQL statements (sampled requests)')
+    for stage, snapshot in stats['stages'].items():
+        writer.sample(name, {'stage': stage}, snapshot['calls'])
+
+    name = f"{PREFIX}_request_timing_sampled_total"
+    writer.declare(name, 'counter', 'Requests with per-stage timing')
+    writer.sample(name, {}, stats['sampled_requests'])
+    name = f"{PREFIX}_request_timing_sample_rate"
+    writer.declare(name, 'gauge', 'Configured per-stage timing sample rate', AGGREGATE_MAX)
+    writer.sample(name, {}, stats['sample_rate'])
+
+
+def _collect_upstreams(writer: _Writer) -> None:
+    from utils.http_client import get_upstream_stats
+
+    upstreams = get_upstream_stats()
+    name = f"{PREFIX}_upstream_request_duration_seconds"
+    for upstream, stats in upstreams.items():
+        latency = stats['latency']
+        writer.histogram_ms(name, 'Upstream call duration (until response headers when streaming)',
+                            {'upstream': upstream}, latency['ms_histogram'], latency['ms_sum'])
+    for field, help_text in (('requests', 'Upstream HTTP attempts'),
+                             ('retried', 'Upstream retries'),
+                             ('errors', 'Upstream failures')):
+        name = f"{PREFIX}_upstream_{field}_total"
+        writer.declare(name, 'counter', help_text)
+        for upstream, stats in upstreams.items():
+            writer.sample(name, {'upstream': upstream}, stats[field])
+
+
+def _collect_db_pool(writer: _Writer) -> None:
+    from utils.db_connector import db_connector
+
+    stats = db_connector.get_pool_stats()
+    labels = {'pool': stats['pool_name']}
+    for field, metric_type, help_text in (('pool_size', 'gauge', 'Connection pool size'),
+                                          ('in_use', 'gauge', 'Connections checked out'),
+                                          ('waiters', 'gauge', 'Requests waiting for a connection'),
+                                          ('checkouts', 'counter', 'Connection checkouts'),
+                                          ('checkout_failures', 'counter', 'Failed connection checkouts')):
+        name = f"{PREFIX}_db_pool_{field}" + ('_total' if metric_type == 'counter' else '')
+        writer.declare(name, metric_type, help_text)
+        writer.sample(name, labels, stats[field])
+    writer.histogram_ms(f"{PREFIX}_db_pool_wait_seconds", 'Time spent waiting for a pooled connection',
+                        labels, stats['wait_ms_histogram'], stats['wait_ms_sum'])
+
+
+def _collect_caches(writer: _Writer) -> None:
+    from utils.cache_manager import cache_manager
+    from utils.token_cache import verified_token_cache
+
+    caches = (('data', cache_manager.get_stats()), ('token', verified_token_cache.get_stats()))
+    # 同名指标的样本需要连续输出
+    for field in ('hits', 'misses', 'evictions'):
+        name = f"{PREFIX}_cache_{field}_total"
+        writer.declare(name, 'counter', f"Cache {field}")
+        for cache, stats in caches:
+            writer.sample(name, {'cache': cache}, stats[field])
+    name = f"{PREFIX}_cache_entries"
+    writer.declare(name, 'gauge', 'Cached entries')
+    for cache, stats in caches:
+        writer.sample(name, {'cache': cache}, stats.get('total_items', stats.get('entries')))
+
+
+def _collect_background_queues(writer: _Writer) -> None:
+    from utils.write_behind import get_queue_stats
+
+    queues = get_queue_stats()
+    name = f"{PREFIX}_background_queue_pending"
+    writer.declare(name, 'gauge', 'Background writes/jobs not yet finished')
+    for stats in queues:
+        writer.sample(name, {'queue': stats['name']}, stats['pending'])
+    for field, help_text in (('submitted', 'Background writes/jobs queued'),
+                             ('coalesced', 'Jobs merged into an already pending job'),
+                             ('rejected', 'Submissions run synchronously because the queue was full'),
+                             ('failed', 'Background writes/jobs that failed after retries')):
+        name = f"{PREFIX}_background_queue_{field}_total"
+        writer.declare(name, 'counter', help_text)
+        for stats in queues:
+            writer.sample(name, {'queue': stats['name']}, stats.get(field))
+
+
+def _collect_latency_summaries(writer: _Writer) -> None:
+    from utils.latency_stats import snapshot_all
+
+    name = f"{PREFIX}_latency_seconds"
+    for metric, stats in snapshot_all().items():
+        writer.declare(name, 'summary', 'Recent-sample latency quantiles per worker, e.g. chat time to first token',
+                       AGGREGATE_PID)
+        for quantile, field in (('0.5', 'p50_ms'), ('0.9', 'p90_ms'), ('0.99', 'p99_ms')):
+            if stats[field] is not None:
+                writer.sample(name, {'name': metric, 'quantile': quantile}, round(stats[field] / 1000, 6))
+        writer.sample(f"{name}_count", {'name': metric}, stats['count'])
+        if stats['avg_ms'] is not None:
+            writer.sample(f"{name}_sum", {'name': metric}, round(stats['avg_ms'] * stats['count'] / 1000, 6))
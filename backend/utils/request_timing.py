@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+请求级耗时统计
+
+- 中间件（init_request_timing）：每个请求记录总耗时，按 方法/路由/状态码 计入直方图；
+  按 REQUEST_TIMING_SAMPLE_RATE 抽样的请求额外记录分阶段耗时，并在响应头中返回Server-Timing
+- 分阶段计时（span）：JWT验证（auth）、数据库语句（db，含次数）、上游服务（upstream_<name>）
+  等在各自的调用处用 `with span('db'):` 计时；当前请求未被抽样或不在请求中（如后台写入线程）时为空操作
+
+未被抽样的请求只多两次计时和一次直方图写入；请求头带 X-Request-Timing: 1 时强制抽样，便于排查单个请求。
+流式响应的耗时统计到返回响应头为止。指标在每个工作进程中各自统计，由 /metrics 汇总导出（见 utils/prometheus.py）。
+"""
+
+import os
+import time
+import random
+import logging
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+from flask import Flask, request
+
+from utils.latency_stats import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+REQUEST_TIMING_ENABLED = os.getenv('REQUEST_TIMING_ENABLED', 'True').lower() == 'true'
+REQUEST_TIMING_SAMPLE_RATE = float(os.getenv('REQUEST_TIMING_SAMPLE_RATE', 0.05))
+# 强制抽样请求头 X-Request-Timing 在WSGI环境中的键（直接读environ比经过request.headers快）
+FORCE_SAMPLE_ENVIRON_KEY = 'HTTP_X_REQUEST_TIMING'
+
+# 当前线程（协程模式下为当前协程）正在计时的请求
+_local = threading.local()
+
+_lock = threading.Lock()
+# (方法, 路由, 状态码) -> 请求耗时直方图
+_request_histograms: Dict[Tuple[str, str, str], LatencyHistogram] = {}
+# 阶段 -> 每个抽样请求在该阶段的累计耗时直方图
+_stage_histograms: Dict[str, LatencyHistogram] = {}
+# 阶段 -> 抽样请求中的调用次数（如数据库语句数）
+_stage_calls: Dict[str, int] = {}
+_sampled_requests = 0
+
+
+class RequestTiming:
+    """一个请求的分阶段耗时：阶段 -> [累计秒数, 次数]"""
+
+    __slots__ = ('started', 'stages')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, list] = {}
+
+    def add(self, stage: str, seconds: float, count: int = 1) -> None:
+        entry = self.stages.get(stage)
+        if entry is None:
+            self.stages[stage] = [seconds, count]
+        else:
+            entry[0] += seconds
+            entry[1] += count
+
+    def server_timing(self, total: float) -> str:
+        """生成Server-Timing响应头（单位毫秒）"""
+        parts = []
+        for stage, (seconds, count) in self.stages.items():
+            part = f"{stage};dur={seconds * 1000:.2f}"
+            if count > 1:
+                part += f';desc="{count} calls"'
+            parts.append(part)
+        parts.append(f"total;dur={total * 1000:.2f}")
+        return ', '.join(parts)
+
+
+def current_timing() -> Optional[RequestTiming]:
+    """当前正在计时（被抽样）的请求，没有时返回None"""
+    return getattr(_local, 'timing', None)
+
+
+def record_stage(stage: str, seconds: float, count: int = 1) -> None:
+    """把一段已测得的耗时记入当前请求"""
+    timing = getattr(_local, 'timing', None)
+    if timing is not None:
+        timing.add(stage, seconds, count)
+
+
+class span:
+    """
+    分阶段计时上下文管理器
+
+        with span('db'):
+            cursor.execute(...)
+    """
+
+    __slots__ = ('stage', 'timing', 'start')
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.timing = getattr(_local, 'timing', None)
+        self.start = 0.0
+
+    def __enter__(self):
+        if self.timing is not None:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.timing is not None:
+            self.timing.add(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+def _get_request_histogram(key: Tuple[str, str, str]) -> LatencyHistogram:
+    histogram = _request_histograms.get(key)
+    if histogram is None:
+        with _lock:
+            histogram = _request_histograms.setdefault(key, LatencyHistogram('http_request'))
+    return histogram
+
+
+def _get_stage_histogram(stage: str) -> LatencyHistogram:
+    histogram = _stage_histograms.get(stage)
+    if histogram is None:
+        with _lock:
+            histogram = _stage_histograms.setdefault(stage, LatencyHistogram(stage))
+    return histogram
+
+
+def _before_request() -> None:
+    _local.started = time.perf_counter()
+    if random.random() < REQUEST_TIMING_SAMPLE_RATE or request.environ.get(FORCE_SAMPLE_ENVIRON_KEY) == '1':
+        _local.timing = RequestTiming()
+    else:
+        _local.timing = None
+
+
+def _after_request(response):
+    started = getattr(_local, 'started', None)
+    if started is None:
+        return response
+    total = time.perf_counter() - started
+    req = request._get_current_object()
+    route = req.url_rule.rule if req.url_rule is not None else 'unmatched'
+    _get_request_histogram((req.method, route, str(response.status_code))).observe(total)
+
+    timing = _local.timing
+    if timing is not None:
+        global _sampled_requests
+        for stage, (seconds, count) in timing.stages.items():
+            _get_stage_histogram(stage).observe(seconds)
+            with _lock:
+                _stage_calls[stage] = _stage_calls.get(stage, 0) + count
+        with _lock:
+            _sampled_requests += 1
+        response.headers['Server-Timing'] = timing.server_timing(total)
+    return response
+
+
+def _teardown_request(exc=None) -> None:
+    _local.timing = None
+    _local.started = None
+
+
+def init_request_timing(app: Flask) -> None:
+    """在应用上注册请求计时中间件"""
+    if not REQUEST_TIMING_ENABLED:
+        logger.info("请求耗时统计已关闭")
+        return
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+
+
+def get_request_timing_stats() -> Dict[str, Any]:
+    """请求耗时和分阶段耗时快照（当前工作进程）"""
+    with _lock:
+        requests_items = list(_request_histograms.items())
+        stage_items = list(_stage_histograms.items())
+        stage_calls = dict(_stage_calls)
+        sampled = _sampled_requests
+    return {
+        'sample_rate': REQUEST_TIMING_SAMPLE_RATE,
+        'sampled_requests': sampled,
+        'requests': {key: histogram.snapshot() for key, histogram in sorted(requests_items)},
+        'stages': {stage: dict(histogram.snapshot(), calls=stage_calls.get(stage, 0))
+                   for stage, histogram in sorted(stage_items)}
+    }
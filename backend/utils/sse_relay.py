@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SSE流式转发
+
+把上游的SSE响应按收到的字节原样转发给客户端，不做逐帧的JSON解析和重新序列化：
+- 只按空行切分事件帧，帧首匹配指定事件类型（如 complete）时才解析该帧的JSON，
+  其余帧只做一次字节前缀比较
+- 生成器每次只读一块上游数据，写给客户端之后才读下一块：客户端读得慢时WSGI服务器的写操作阻塞，
+  上游读取随之暂停，由TCP窗口向上游施加背压，进程内不堆积数据
+- 每转发一块检查一次客户端连接；客户端断开（或WSGI服务器关闭生成器）时立即关闭上游响应，
+  上游连接随之断开，上游服务停止生成
+"""
+
+import json
+import socket
+import select
+import logging
+from typing import Any, Callable, Dict, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+# SSE事件帧分隔符
+FRAME_SEPARATOR = b"\n\n"
+
+
+class SSEFrameWatcher:
+    """
+    在转发的字节流中找出指定类型的事件帧
+
+    只识别 `data: {"type": "<event_type>", ...}` 形式的帧（Mental Agent的输出格式），
+    帧首不匹配的帧不解析，匹配的帧解析一次JSON并回调 on_event(该帧的JSON)。
+    """
+
+    def __init__(self, event_type: str, on_event: Callable[[Dict[str, Any]], None]):
+        self.prefixes = (
+            f'data: {{"type": "{event_type}"'.encode('utf-8'),
+            f'data: {{"type":"{event_type}"'.encode('utf-8')
+        )
+        self.on_event = on_event
+        self._buffer = bytearray()
+
+    def feed(self, chunk: bytes) -> None:
+        self._buffer += chunk
+        while True:
+            end = self._buffer.find(FRAME_SEPARATOR)
+            if end < 0:
+                return
+            frame = bytes(self._buffer[:end])
+            del self._buffer[:end + len(FRAME_SEPARATOR)]
+            if frame.startswith(self.prefixes):
+                try:
+                    self.on_event(json.loads(frame[len(b'data: '):]))
+                except ValueError as e:
+                    logger.warning(f"SSE事件帧解析失败: {e}")
+
+
+def client_disconnected(environ: Dict[str, Any]) -> bool:
+    """
+    客户端是否已断开连接
+
+    从WSGI环境中取客户端socket（gunicorn为gunicorn.socket，开发服务器为werkzeug.socket），
+    可读且窥探读到EOF即为已断开；取不到socket或无法判断时返回False，由写失败时关闭生成器兜底。
+    """
+    sock = environ.get('gunicorn.socket') or environ.get('werkzeug.socket')
+    if sock is None:
+        return False
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        if not readable:
+            return False
+        return sock.recv(1, socket.MSG_PEEK) == b''
+    except (ConnectionError, OSError):
+        return True
+    except ValueError:
+        # TLS socket不支持MSG_PEEK
+        return False
+
+
+def relay_sse(response, environ: Optional[Dict[str, Any]] = None,
+              watcher: Optional[SSEFrameWatcher] = None) -> Iterator[bytes]:
+    """
+    原样转发上游SSE响应（requests的stream=True响应）的字节
+
+    Args:
+        response: 上游响应，转发结束、出错或客户端断开时关闭
+        environ: 当前请求的WSGI环境，用于检测客户端断开
+        watcher: 需要检查的事件帧（如complete）
+
+    迭代正常结束表示上游流已读完；客户端断开时提前结束迭代。
+    """
+    try:
+        for chunk in response.iter_content(chunk_size=None):
+            if not chunk:
+                continue
+            if watcher is not None:
+                watcher.feed(chunk)
+            yield chunk
+            if environ is not None and client_disconnected(environ):
+                logger.info("客户端已断开，取消上游流式请求")
+                return
+    finally:
+        # 未读完时关闭会断开上游连接（不会放回连接池），上游随之停止生成
+        response.close()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+已验证token缓存与吊销列表
+
+- VerifiedTokenCache：token摘要 -> 验证通过的payload，容量有上限（LRU淘汰），
+  条目在token的exp或缓存TTL（取较早者）到期后失效，同一token在有效期内只做一次签名校验和解码
+- TokenRevocationList：已吊销token的摘要集合，每次验证都做O(1)查询；条目保留到token本身过期。
+  吊销记录保存在共享缓存后端（CACHE_BACKEND为socket或redis，工作进程重启后仍然存在），
+  写入时广播的失效消息让其他工作进程立即把该token加入本进程列表并清除验证缓存；
+  新启动的工作进程在验证缓存未命中时查询共享后端。
+  未配置共享后端时吊销记录只能保存在单个工作进程中（重启即丢失），因此不支持吊销
+
+两者在每个工作进程中各有一份。
+"""
+
+import os
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from utils.cache_manager import cache_manager
+
+logger = logging.getLogger(__name__)
+
+
+def token_digest(token: str) -> str:
+    """token的摘要，作为缓存和吊销列表的键（不在内存中长期保存原始token）"""
+    return hashlib.blake2b(token.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def generate_revoked_token_cache_key(digest: str) -> str:
+    """生成已吊销token的共享缓存键"""
+    return f"revoked_token:{digest}"
+
+
+class VerifiedTokenCache:
+    """已验证token的有界缓存"""
+
+    def __init__(self, max_entries: int = 10000, ttl: int = 60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._items: 'OrderedDict[str, tuple]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get(self, digest: str) -> Optional[Dict[str, Any]]:
+        """命中且未过期时返回payload（只读，调用方不应修改）"""
+        now = time.time()
+        with self._lock:
+            item = self._items.get(digest)
+            if item is not None:
+                if now < item[1]:
+                    self._items.move_to_end(digest)
+                    self._hits += 1
+                    return item[0]
+                del self._items[digest]
+            self._misses += 1
+            return None
+
+    def put(self, digest: str, payload: Dict[str, Any]) -> None:
+        """缓存验证通过的payload，到期时间不晚于token的exp"""
+        now = time.time()
+        expires_at = now + self.ttl
+        exp = payload.get('exp')
+        if isinstance(exp, (int, float)):
+            expires_at = min(expires_at, exp)
+        if expires_at <= now:
+            return
+        with self._lock:
+            self._items[digest] = (payload, expires_at)
+            self._items.move_to_end(digest)
+            if len(self._items) > self.max_entries:
+                self._evict(now)
+
+    def discard(self, digest: str) -> None:
+        with self._lock:
+            self._items.pop(digest, None)
+
+    def _evict(self, now: float) -> None:
+        """超出容量时先清理已过期的条目，仍超出再按LRU淘汰"""
+        expired = [key for key, item in self._items.items() if item[1] <= now]
+        for key in expired:
+            del self._items[key]
+        while len(self._items) > self.max_entries:
+            self._items.popitem(last=False)
+            self._evictions += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                'entries': len(self._items),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'hit_rate': round(self._hits / total, 4) if total else None
+            }
+
+
+class TokenRevocationList:
+    """已吊销token列表（token摘要 -> token过期时间）"""
+
+    # exp未知时本进程记录的保留时长（不短于refresh token的有效期）
+    DEFAULT_RETENTION = 7 * 24 * 3600
+
+    def __init__(self, sweep_interval: int = 300):
+        self._revoked: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self.sweep_interval = sweep_interval
+        self._next_sweep = time.time() + sweep_interval
+
+    @property
+    def supported(self) -> bool:
+        """是否支持吊销：需要所有工作进程都能看到的共享缓存后端"""
+        return cache_manager.shared
+
+    def revoke(self, digest: str, exp: Optional[float] = None) -> bool:
+        """吊销token，保留到token过期（过期的token本身已无法通过验证）；返回是否已写入共享后端"""
+        if not self.supported:
+            return False
+        now = time.time()
+        expires_at = exp if isinstance(exp, (int, float)) else now + self.DEFAULT_RETENTION
+        ttl = int(expires_at - now)
+        if ttl <= 0:
+            return True
+        self.remember(digest, expires_at)
+        return cache_manager.set(generate_revoked_token_cache_key(digest), True, ttl)
+
+    def remember(self, digest: str, expires_at: Optional[float] = None) -> None:
+        """记入本进程列表"""
+        now = time.time()
+        with self._lock:
+            self._revoked[digest] = expires_at if isinstance(expires_at, (int, float)) else now + self.DEFAULT_RETENTION
+            if now >= self._next_sweep:
+                self._revoked = {key: value for key, value in self._revoked.items() if value > now}
+                self._next_sweep = now + self.sweep_interval
+
+    def is_revoked(self, digest: str) -> bool:
+        """本进程吊销列表查询，O(1)"""
+        return digest in self._revoked
+
+    def is_revoked_shared(self, digest: str, exp: Optional[float] = None) -> bool:
+        """本进程列表未命中时查询共享后端（仅在验证缓存未命中时调用），命中后记入本进程列表"""
+        if digest in self._revoked:
+            return True
+        if not self.supported:
+            return False
+        if cache_manager.get(generate_revoked_token_cache_key(digest)):
+            self.remember(digest, exp)
+            return True
+        return False
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {'revoked': len(self._revoked), 'supported': self.supported}
+
+
+# 全局实例
+verified_token_cache = VerifiedTokenCache(
+    max_entries=int(os.getenv('TOKEN_CACHE_MAX_ENTRIES', 10000)),
+    ttl=int(os.getenv('TOKEN_CACHE_TTL', 60))
+)
+token_revocation_list = TokenRevocationList()
+
+
+def _on_revocation_broadcast(key: str) -> None:
+    """其他工作进程吊销了token：记入本进程列表并清除验证缓存，不等验证缓存过期"""
+    prefix = generate_revoked_token_cache_key('')
+    if key.startswith(prefix):
+        digest = key[len(prefix):]
+        token_revocation_list.remember(digest)
+        verified_token_cache.discard(digest)
+
+
+cache_manager.add_invalidation_listener(_on_revocation_broadcast)
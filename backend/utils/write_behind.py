@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+后台写入队列
+
+- WriteBehindQueue：调用方把写操作放入有界队列后立即返回，由单个后台线程按提交顺序执行，
+  HTTP响应不必等待数据库提交
+- BackgroundJobQueue：响应之后才需要完成的附带操作（会话更新时间、最后登录时间、缓存清理），
+  由固定数量的后台线程执行；带合并键的任务先等待一个合并窗口，窗口内同一个键的多次提交只执行最后一次，
+  例如同一会话一秒内的多次更新时间变成一条UPDATE
+
+队列满时submit返回False，由调用方同步执行（背压而不是丢弃）。
+失败的操作默认按retries重试；不能重复执行的操作（例如没有唯一键保护的INSERT，语句可能已提交、
+只是响应丢失）提交时传 idempotent=False，只执行一次。
+进程退出时（atexit和gunicorn的worker_exit钩子）会在超时时间内把队列中剩余的操作全部执行完，
+等待合并窗口的任务立即执行。
+"""
+
+import os
+import time
+import queue
+import atexit
+import logging
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+from config.db_config import DatabaseConfig
+
+logger = logging.getLogger(__name__)
+
+# 所有已创建的队列，用于进程退出时统一刷新
+_queues: List[Any] = []
+
+
+class WriteBehindQueue:
+    """有界的后台写入队列（单个后台线程，保证同一队列内的写入顺序）"""
+
+    def __init__(self, name: str, maxsize: int = 1000, retries: int = 2,
+                 retry_delay: float = 0.5):
+        self.name = name
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self._queue: 'queue.Queue' = queue.Queue(maxsize=maxsize)
+        self._worker_pid = None
+        self._worker_lock = threading.Lock()
+        self._submitted = 0
+        self._rejected = 0
+        self._failed = 0
+        _queues.append(self)
+
+    def submit(self, func: Callable, *args, idempotent: bool = True,
+               on_done: Optional[Callable[[bool], None]] = None, **kwargs) -> bool:
+        """
+        提交写操作；队列已满时返回False
+
+        idempotent=False 的操作失败后不重试；on_done在操作最终成功（True）或放弃（False）后
+        在后台线程中调用一次，例如提交之后才能更新的缓存版本号。
+        """
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait((func, args, kwargs, idempotent, on_done))
+        except queue.Full:
+            self._rejected += 1
+            logger.warning(f"后台写入队列已满({self.name})，改为同步写入")
+            return False
+        self._submitted += 1
+        return True
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """等待队列中已提交的写操作全部完成，超时返回False"""
+        deadline = time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logger.error(f"后台写入队列({self.name})刷新超时，剩余 {self._queue.unfinished_tasks} 个写操作")
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'name': self.name,
+            'pending': self._queue.unfinished_tasks,
+            'maxsize': self._queue.maxsize,
+            'submitted': self._submitted,
+            'rejected': self._rejected,
+            'failed': self._failed
+        }
+
+    def _ensure_worker(self) -> None:
+        """在当前进程中启动后台线程（gunicorn fork后每个工作进程各启动一个）"""
+        pid = os.getpid()
+        if self._worker_pid == pid:
+            return
+        with self._worker_lock:
+            if self._worker_pid == pid:
+                return
+            threading.Thread(target=self._run, name=f'write-behind-{self.name}', daemon=True).start()
+            self._worker_pid = pid
+
+    def _run(self) -> None:
+        while True:
+            func, args, kwargs, idempotent, on_done = self._queue.get()
+            try:
+                succeeded = self._execute(func, args, kwargs, idempotent)
+                if on_done is not None:
+                    try:
+                        on_done(succeeded)
+                    except Exception as e:
+                        logger.error(f"后台写入完成回调异常({self.name}): {e}")
+            finally:
+                self._queue.task_done()
+
+    def _execute(self, func: Callable, args, kwargs, idempotent: bool) -> bool:
+        retries = self.retries if idempotent else 0
+        for attempt in range(retries + 1):
+            try:
+                func(*args, **kwargs)
+                return True
+            except Exception as e:
+                if attempt < retries:
+                    logger.warning(f"后台写入失败({self.name})，{self.retry_delay}秒后重试: {e}")
+                    time.sleep(self.retry_delay * (attempt + 1))
+                else:
+                    self._failed += 1
+                    logger.error(f"后台写入最终失败({self.name}): {getattr(func, '__name__', func)} {e}")
+        return False
+
+
+class BackgroundJobQueue:
+    """带合并窗口的有界后台任务队列（多个后台线程，任务之间不保证顺序）"""
+
+    def __init__(self, name: str, workers: int = 2, maxsize: int = 1000,
+                 coalesce_window: float = 1.0, retries: int = 1, retry_delay: float = 0.5,
+                 enabled: bool = True):
+        self.name = name
+        self.workers = max(1, workers)
+        self.maxsize = maxsize
+        self.coalesce_window = coalesce_window
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.enabled = enabled
+        self._cond = threading.Condition()
+        self._ready: deque = deque()
+        # 合并键 -> [到期时间, 函数, 位置参数, 关键字参数, 是否可重试]，按到期时间先后排列
+        self._delayed: 'OrderedDict[Hashable, list]' = OrderedDict()
+        self._unfinished = 0
+        self._draining = False
+        self._worker_pid = None
+        self._submitted = 0
+        self._coalesced = 0
+        self._rejected = 0
+        self._failed = 0
+        _queues.append(self)
+
+    def submit(self, func: Callable, *args, coalesce_key: Optional[Hashable] = None,
+               idempotent: bool = True, **kwargs) -> bool:
+        """
+        提交任务；队列未启用或已满时返回False，由调用方同步执行
+
+        指定coalesce_key时任务在合并窗口结束后执行，窗口内同一个键的后续提交替换参数，不再占用队列。
+        idempotent=False 的任务失败后不重试。
+        """
+        if not self.enabled:
+            return False
+        self._ensure_workers()
+        with self._cond:
+            if coalesce_key is not None:
+                job = self._delayed.get(coalesce_key)
+                if job is not None:
+                    job[1:] = [func, args, kwargs, idempotent]
+                    self._coalesced += 1
+                    return True
+            if len(self._ready) + len(self._delayed) >= self.maxsize:
+                self._rejected += 1
+                logger.warning(f"后台任务队列已满({self.name})，改为同步执行")
+                return False
+            if coalesce_key is not None and not self._draining:
+                self._delayed[coalesce_key] = [time.monotonic() + self.coalesce_window, func, args, kwargs, idempotent]
+            else:
+                self._ready.append((func, args, kwargs, idempotent))
+            self._unfinished += 1
+            self._submitted += 1
+            self._cond.notify()
+        return True
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """立即执行等待合并的任务，并等待全部任务完成，超时返回False"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._draining = True
+            try:
+                self._promote(force=True)
+                self._cond.notify_all()
+                while self._unfinished:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        logger.error(f"后台任务队列({self.name})刷新超时，剩余 {self._unfinished} 个任务")
+                        return False
+                    self._cond.wait(remaining)
+            finally:
+                self._draining = False
+        return True
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                'name': self.name,
+                'workers': self.workers,
+                'pending': self._unfinished,
+                'delayed': len(self._delayed),
+                'maxsize': self.maxsize,
+                'submitted': self._submitted,
+                'coalesced': self._coalesced,
+                'rejected': self._rejected,
+                'failed': self._failed
+            }
+
+    def _ensure_workers(self) -> None:
+        """在当前进程中启动后台线程（gunicorn fork后每个工作进程各启动一组）"""
+        pid = os.getpid()
+        if self._worker_pid == pid:
+            return
+        with self._cond:
+            if self._worker_pid == pid:
+                return
+            for index in range(self.workers):
+                threading.Thread(target=self._run, name=f'background-{self.name}-{index}', daemon=True).start()
+            self._worker_pid = pid
+
+    def _promote(self, force: bool = False) -> Optional[float]:
+        """把到期（force时为全部）的合并任务移入待执行队列，返回下一个任务的剩余等待秒数（调用方持有锁）"""
+        now = time.monotonic()
+        while self._delayed:
+            key, job = next(iter(self._delayed.items()))
+            if not force and job[0] > now:
+                return job[0] - now
+            del self._delayed[key]
+            self._ready.append(tuple(job[1:]))
+        return None
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while True:
+                    wait = self._promote()
+                    if self._ready:
+                        func, args, kwargs, idempotent = self._ready.popleft()
+                        break
+                    self._cond.wait(wait)
+            try:
+                self._execute(func, args, kwargs, idempotent)
+            finally:
+                with self._cond:
+                    self._unfinished -= 1
+                    if not self._unfinished:
+                        self._cond.notify_all()
+
+    def _execute(self, func: Callable, args, kwargs, idempotent: bool) -> None:
+        retries = self.retries if idempotent else 0
+        for attempt in range(retries + 1):
+            try:
+                func(*args, **kwargs)
+                return
+            except Exception as e:
+                if attempt < retries:
+                    logger.warning(f"后台任务失败({self.name})，{self.retry_delay}秒后重试: {e}")
+                    time.sleep(self.retry_delay * (attempt + 1))
+                else:
+                    with self._cond:
+                        self._failed += 1
+                    logger.error(f"后台任务最终失败({self.name}): {getattr(func, '__name__', func)} {e}")
+
+
+# 响应之后执行的附带操作（会话更新时间、最后登录时间等）；线程数计入连接池大小（见DatabaseConfig.get_pool_size）
+background_jobs = BackgroundJobQueue(
+    'side_effects',
+    workers=DatabaseConfig.BACKGROUND_JOB_WORKERS,
+    maxsize=DatabaseConfig.BACKGROUND_JOB_QUEUE_SIZE,
+    coalesce_window=DatabaseConfig.BACKGROUND_JOB_COALESCE_SECONDS,
+    enabled=DatabaseConfig.BACKGROUND_JOBS_ENABLED
+)
+
+
+def flush_all(timeout: float = 10.0) -> bool:
+    """刷新所有后台写入和任务队列（进程退出前调用）"""
+    ok = True
+    # 后创建的队列先刷新：其中的写操作完成后可能向先创建的通用任务队列提交任务
+    for write_queue in reversed(_queues):
+        ok = write_queue.flush(timeout) and ok
+    return ok
+
+
+def get_queue_stats() -> List[Dict[str, Any]]:
+    """所有后台队列的运行指标（当前工作进程）"""
+    return [write_queue.get_stats() for write_queue in _queues]
+
+
+atexit.register(flush_all)
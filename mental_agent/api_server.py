@@ -1,10 +1,11 @@
 import json
 import ssl
 import uuid
+import asyncio
 from datetime import datetime
 import os
 from typing import Optional, AsyncGenerator, Dict, Any, List
-from contextlib import asynccontextmanager
+from contextlib import asynccontextmanager, aclosing
 
 import requests
 from fastapi import FastAPI, HTTPException, Query, Path, Depends, Request
@@ -14,7 +15,7 @@ from requests.adapters import HTTPAdapter
 from urllib3.poolmanager import PoolManager
 
 # 假设从配置模块导入服务器配置
-from config import SERVER_CONFIG
+from config import SERVER_CONFIG, SESSION_CONFIG, STREAM_CONFIG
 import logging
 
 # 配置日志
@@ -25,8 +26,8 @@ logging.basicConfig(
 )
 logger = logging.getLogger("api_server")
 
-# 假设从coze客户端模块导入
-from coze_api_client import CozeAPIClient
+# 假设从coze客户端模块导入（异步客户端：在事件循环中await，不阻塞其他请求）
+from coze_async_client import AsyncCozeAPIClient
 from coze_tts_client import CozeTTSClient  # 新增TTS客户端导入
 
 # 从coze_tts_client获取默认voice_id（使用测试代码中的默认值）
@@ -35,6 +36,12 @@ from coze_tts_client import TEST_VOICE_ID  # 新增导入默认音色ID
 # 新增：导入情绪分析功能
 from coze_emotiontag import EmotionAnalyzer
 
+# 有界、可过期、可持久化的会话注册表
+from session_store import SessionStore
+
+# 流式回复的增量合并（替代每个增量后固定等待30ms）
+from stream_coalescer import coalesce_stream
+
 # 全局应用状态存储
 app_state: Dict[str, Any] = {}
 
@@ -46,7 +53,7 @@ async def lifespan(app: FastAPI):
     
     try:
         # 初始化Coze聊天客户端
-        coze_chat_client = CozeAPIClient(debug=SERVER_CONFIG.get("debug", False))
+        coze_chat_client = AsyncCozeAPIClient(debug=SERVER_CONFIG.get("debug", False))
         
         # 初始化Coze TTS客户端
         coze_tts_client = CozeTTSClient(debug=SERVER_CONFIG.get("debug", False))
@@ -58,8 +65,9 @@ async def lifespan(app: FastAPI):
         app_state["coze_chat_client"] = coze_chat_client  # 重命名为明确的聊天客户端
         app_state["coze_tts_client"] = coze_tts_client    # 新增TTS客户端
         app_state["emotion_analyzer"] = emotion_analyzer   # 新增情绪分析器
-        app_state["session_map"] = {}  # session_id -> 会话信息映射
-        app_state["conv_map"] = {}     # conversation_id -> session_id映射（反向查找）
+        # session_id <-> conversation_id 双向绑定（LRU/TTL淘汰，可选SQLite持久化）
+        session_store = SessionStore(**SESSION_CONFIG)
+        app_state["session_store"] = session_store
         
         logger.info("Coze聊天机器人API服务器初始化完成")
         logger.info(f"当前Bot ID: {coze_chat_client.bot_id}")
@@ -71,6 +79,8 @@ async def lifespan(app: FastAPI):
         
         # 关闭时清理
         logger.info("正在关闭Coze聊天机器人API服务器...")
+        await coze_chat_client.close()
+        session_store.close()
         app_state.clear()
         logger.info("Coze聊天机器人API服务器已关闭")
         
@@ -94,6 +104,7 @@ class ChatMessageRequest(BaseModel):
     message: str = Field(..., description="用户消息内容（必填）", min_length=1)
     session_id: Optional[str] = Field(default=None, description="会话ID（可选，默认自动生成）")
     conversation_id: Optional[str] = Field(default=None, description="Coze会话ID（可选，传入则续传该会话）")
+    pacing_ms: Optional[int] = Field(default=None, ge=0, le=500, description="流式节奏模式的最小帧间隔（毫秒，仅/chat/stream；不传用STREAM_PACING_MS，0表示关闭）")
 
 """同步聊天响应"""
 class ChatMessageResponse(BaseModel):
@@ -159,24 +170,13 @@ class EmotionAnalysisResponse(BaseModel):
 # ==================== 核心工具函数 ====================
 """更新会话映射（双向绑定）"""
 def _update_session_mapping(session_id: str, user_id: str, conversation_id: str):
-    """更新会话映射（双向绑定）"""
-    # 移除旧的反向映射（如果该conversation_id已绑定其他session）
-    old_session_id = app_state["conv_map"].get(conversation_id)
-    if old_session_id and old_session_id != session_id:
-        del app_state["session_map"][old_session_id]
-    
-    # 更新正向和反向映射
-    app_state["session_map"][session_id] = {
-        "user_id": user_id,
-        "conversation_id": conversation_id,
-        "last_activity": datetime.now().isoformat()
-    }
-    app_state["conv_map"][conversation_id] = session_id
+    """更新会话映射（双向绑定，该conversation_id原来绑定的其他session会被移除）"""
+    app_state["session_store"].bind(session_id, user_id, conversation_id)
 
 """通过session_id获取绑定的conversation_id"""
 def _get_conversation_id_by_session(session_id: str) -> Optional[str]:
     """通过session_id获取绑定的conversation_id"""
-    session_info = app_state["session_map"].get(session_id)
+    session_info = app_state["session_store"].get(session_id)
     return session_info["conversation_id"] if session_info else None
 
 # -------------------- 新增TTS工具函数 --------------------
@@ -208,8 +208,9 @@ async def health_check():
         "coze_chat_client_status": "initialized" if app_state.get("coze_chat_client") else "uninitialized",
         "coze_tts_client_status": "initialized" if app_state.get("coze_tts_client") else "uninitialized",
         "emotion_analyzer_status": "initialized" if app_state.get("emotion_analyzer") else "uninitialized",  # 新增情绪分析器状态
-        "active_sessions": len(app_state.get("session_map", {})),
-        "active_conversations": len(app_state.get("conv_map", {})),
+        "active_sessions": len(app_state["session_store"]) if app_state.get("session_store") else 0,
+        "session_store": app_state["session_store"].get_stats() if app_state.get("session_store") else None,
+        "stream_config": STREAM_CONFIG,
         "tts_support": "enabled" if app_state.get("coze_tts_client") else "disabled",
         "emotion_analysis_support": "enabled" if app_state.get("emotion_analyzer") else "disabled",  # 新增情绪分析支持状态
         "default_voice_id": TEST_VOICE_ID  # 新增默认音色ID展示
@@ -243,24 +244,23 @@ async def chat(request: ChatMessageRequest):
         # 2. 处理会话续传逻辑（优先级：传入的conversation_id > session_id绑定的conversation_id > 新建）
         target_conv_id = None
         if request.conversation_id:
-            # 传入了conversation_id，直接绑定
-            target_conv_id = request.conversation_id
-            coze_chat_client.set_conversation_id(target_conv_id)
+            # 传入了conversation_id，直接续传
+            target_conv_id = coze_chat_client.validate_conversation_id(request.conversation_id)
             logger.info(f"同步聊天 - 手动传入会话ID: {target_conv_id[:15]}...")
-        elif session_id in app_state["session_map"]:
+        else:
             # 已有session_id绑定的conversation_id，自动续传
             target_conv_id = _get_conversation_id_by_session(session_id)
             if target_conv_id:
-                coze_chat_client.set_conversation_id(target_conv_id)
                 logger.info(f"同步聊天 - 续传session绑定会话ID: {target_conv_id[:15]}...")
         
         logger.info(f"同步聊天请求 - session_id: {session_id}, user_id: {user_id}, message: {request.message[:50]}...")
         
-        # 3. 调用Coze客户端（同步模式）
-        response_text = coze_chat_client.send_message_sync(message=request.message)
+        # 3. 调用Coze客户端（非流式，会话ID随调用传入）
+        result = await coze_chat_client.send_message_sync(message=request.message, conversation_id=target_conv_id)
+        response_text = result["content"]
         
         # 4. 获取实际使用的conversation_id（可能是新建或传入的）
-        actual_conv_id = coze_chat_client.get_current_conversation_id()
+        actual_conv_id = result["conversation_id"]
         if not actual_conv_id:
             raise Exception("Coze API未返回有效的conversation_id")
         
@@ -307,7 +307,6 @@ async def chat_stream(request: ChatMessageRequest):
         
         # 2. 预处理会话续传参数（供生成器使用）
         target_conv_id = request.conversation_id
-        use_existing_session = session_id in app_state["session_map"]
         
         logger.info(f"流式聊天请求 - session_id: {session_id}, user_id: {user_id}, conv_id: {target_conv_id[:15] if target_conv_id else '新建'}, message: {request.message[:50]}...")
         
@@ -318,97 +317,85 @@ async def chat_stream(request: ChatMessageRequest):
                 if not coze_chat_client:
                     raise Exception("Coze聊天客户端未初始化")
                 
-                # 3. 绑定会话ID（续传逻辑）
+                # 3. 确定续传的会话ID（随本次调用传入客户端）
                 actual_conv_id = None
 
                 if target_conv_id:
-                    coze_chat_client.set_conversation_id(target_conv_id)
-                    actual_conv_id = target_conv_id
+                    actual_conv_id = coze_chat_client.validate_conversation_id(target_conv_id)
                     logger.info(f"流式聊天 - 手动绑定会话ID: {actual_conv_id[:15]}...")
-                elif use_existing_session:
+                else:
                     actual_conv_id = _get_conversation_id_by_session(session_id)
                     if actual_conv_id:
-                        coze_chat_client.set_conversation_id(actual_conv_id)
                         logger.info(f"流式聊天 - 续传会话ID: {actual_conv_id[:15]}...")
                 
                 # 4. 初始化会话映射（如果是新会话）
                 if not actual_conv_id:
-                    app_state["session_map"][session_id] = {
-                        "user_id": user_id,
-                        "conversation_id": None,
-                        "last_activity": datetime.now().isoformat()
-                    }
+                    app_state["session_store"].touch(session_id, user_id)
                 
                 chunk_count = 0
                 full_content = ""
+                pacing_ms = STREAM_CONFIG['pacing_ms'] if request.pacing_ms is None else request.pacing_ms
                 
-                # 5. 迭代Coze客户端的流式生成器
-                for stream_data in coze_chat_client.send_message_stream(message=request.message):
-                    stream_type = stream_data.get("type")
+                # 5. 迭代Coze客户端的异步流式生成器（等待上游时让出事件循环），连续的增量按时间窗口/字节数合并后下发
+                upstream = coze_chat_client.send_message_stream(message=request.message, conversation_id=actual_conv_id)
+                coalesced = coalesce_stream(upstream, window_ms=STREAM_CONFIG['coalesce_ms'],
+                                            max_bytes=STREAM_CONFIG['coalesce_bytes'], pacing_ms=pacing_ms)
+                # aclosing：本生成器被取消或关闭时立即关闭合并器和上游生成器（断开Coze连接），不等垃圾回收
+                async with aclosing(upstream), aclosing(coalesced):
+                    async for stream_data in coalesced:
+                        stream_type = stream_data.get("type")
                     
-                    # 内容块：实时返回
-                    if stream_type == "chunk":
-                        chunk_count += 1
-                        content = stream_data.get("content", "")
-                        full_content += content
-                        
-                        # 构建SSE响应数据
-                        response_chunk = {
-                            "type": "chunk",
-                            "data": {
-                                "content": content,
-                                "session_id": session_id,
-                                "message_id": message_id,
-                                "chunk_index": chunk_count,
-                                "conversation_id": stream_data.get("conversation_id"),
-                                "timestamp": datetime.now().isoformat()
-                            }
-                        }
-                        yield f"data: {json.dumps(response_chunk, ensure_ascii=False)}\n\n"
-                        
-                        # 控制流速（可选）
-                        import asyncio
-                        await asyncio.sleep(0.03)
+                        # 内容块：实时返回（精简帧，会话信息和时间戳只在complete中返回）
+                        if stream_type == "chunk":
+                            chunk_count += 1
+                            content = stream_data.get("content", "")
+                            full_content += content
+                            response_chunk = {"type": "chunk", "data": {"content": content, "chunk_index": chunk_count}}
+                            yield f"data: {json.dumps(response_chunk, ensure_ascii=False, separators=(',', ':'))}\n\n"
                     
-                    # 完成标识：返回汇总信息+更新会话映射
-                    elif stream_type == "complete":
-                        actual_conv_id = stream_data.get("conversation_id")
-                        if not actual_conv_id:
-                            raise Exception("流式响应未返回conversation_id")
+                        # 完成标识：返回汇总信息+更新会话映射
+                        elif stream_type == "complete":
+                            actual_conv_id = stream_data.get("conversation_id")
+                            if not actual_conv_id:
+                                raise Exception("流式响应未返回conversation_id")
                         
-                        # 更新双向会话映射
-                        _update_session_mapping(session_id, user_id, actual_conv_id)
+                            # 更新双向会话映射
+                            _update_session_mapping(session_id, user_id, actual_conv_id)
                         
-                        complete_data = {
-                            "type": "complete",
-                            "data": {
-                                "session_id": session_id,
-                                "message_id": message_id,
-                                "total_chunks": chunk_count,
-                                "full_content": full_content,
-                                "conversation_id": actual_conv_id,  # 返回供后续续传
-                                "timestamp": datetime.now().isoformat()
+                            complete_data = {
+                                "type": "complete",
+                                "data": {
+                                    "session_id": session_id,
+                                    "message_id": message_id,
+                                    "total_chunks": chunk_count,
+                                    "full_content": full_content,
+                                    "conversation_id": actual_conv_id,  # 返回供后续续传
+                                    "timestamp": datetime.now().isoformat()
+                                }
                             }
-                        }
-                        logger.info(f"流式聊天完成 - session_id: {session_id}, conv_id: {actual_conv_id[:15]}..., total_chunks: {chunk_count}")
-                        yield f"data: {json.dumps(complete_data, ensure_ascii=False)}\n\n"
+                            logger.info(f"流式聊天完成 - session_id: {session_id}, conv_id: {actual_conv_id[:15]}..., total_chunks: {chunk_count}")
+                            yield f"data: {json.dumps(complete_data, ensure_ascii=False)}\n\n"
                         
-                    # 错误信息：返回错误
-                    elif stream_type == "error":
-                        error_data = {
-                            "type": "error",
-                            "data": {
-                                "message": stream_data.get("message", "未知错误"),
-                                "session_id": session_id,
-                                "message_id": message_id,
-                                "conversation_id": stream_data.get("conversation_id"),
-                                "timestamp": datetime.now().isoformat()
+                        # 错误信息：返回错误
+                        elif stream_type == "error":
+                            error_data = {
+                                "type": "error",
+                                "data": {
+                                    "message": stream_data.get("message", "未知错误"),
+                                    "session_id": session_id,
+                                    "message_id": message_id,
+                                    "conversation_id": stream_data.get("conversation_id"),
+                                    "timestamp": datetime.now().isoformat()
+                                }
                             }
-                        }
-                        logger.error(f"流式聊天错误 - session_id: {session_id}, error: {stream_data.get('message')}")
-                        yield f"data: {json.dumps(error_data, ensure_ascii=False)}\n\n"
-                        break
+                            logger.error(f"流式聊天错误 - session_id: {session_id}, error: {stream_data.get('message')}")
+                            yield f"data: {json.dumps(error_data, ensure_ascii=False)}\n\n"
+                            break
                 
+            except asyncio.CancelledError:
+                # 前端断开：取消沿生成器传到Coze客户端，上游连接随之关闭
+                logger.info(f"流式聊天客户端断开，已取消上游请求 - session_id: {session_id}")
+                raise
             except ValueError as ve:
                 # 无效conversation_id异常
                 error_msg = f"会话ID参数错误: {str(ve)}"
@@ -474,10 +461,11 @@ async def bind_conversation(session_id: str, request: BindConversationRequest):
         
         conversation_id = request.conversation_id
         # 校验conversation_id有效性（调用coze_client的校验逻辑）
-        coze_chat_client.set_conversation_id(conversation_id)
+        coze_chat_client.validate_conversation_id(conversation_id)
         
         # 获取用户ID（如果session已存在则复用，否则自动生成）
-        user_id = app_state["session_map"].get(session_id, {}).get("user_id") or f"user_{uuid.uuid4().hex[:8]}"
+        session_info = app_state["session_store"].get(session_id)
+        user_id = (session_info or {}).get("user_id") or f"user_{uuid.uuid4().hex[:8]}"
         
         # 更新双向映射
         _update_session_mapping(session_id, user_id, conversation_id)
@@ -509,20 +497,10 @@ async def clear_session(session_id: str):
     - 同时清除session_id与conversation_id的绑定关系
     """
     try:
-        coze_chat_client = app_state.get("coze_chat_client")
-        if not coze_chat_client:
-            raise HTTPException(status_code=500, detail="Coze聊天客户端未初始化")
-        
-        # 1. 清除客户端会话上下文
-        coze_chat_client.clear_conversation()
-        
-        # 2. 清除双向映射
-        session_info = app_state["session_map"].get(session_id)
+        # 清除双向映射（客户端不保存会话，解除绑定后该session_id的下一条消息新建会话）
+        session_info = app_state["session_store"].remove(session_id)
         if session_info:
             conversation_id = session_info["conversation_id"]
-            if conversation_id in app_state["conv_map"]:
-                del app_state["conv_map"][conversation_id]
-            del app_state["session_map"][session_id]
             logger.info(f"会话清除成功 - session_id: {session_id}, conv_id: {conversation_id[:15] if conversation_id else '无'}")
         else:
             logger.warning(f"会话清除 - session_id: {session_id} 不存在")
@@ -548,7 +526,7 @@ async def get_session_info(session_id: str):
     - 返回session_id、user_id、conversation_id、最后活动时间
     """
     try:
-        session_info = app_state["session_map"].get(session_id)
+        session_info = app_state["session_store"].get(session_id)
         if not session_info:
             raise HTTPException(status_code=404, detail=f"会话不存在 - session_id: {session_id}")
         
@@ -579,11 +557,11 @@ async def get_session_by_conversation(conversation_id: str):
     - 反向查找：已知conversation_id，获取对应的会话信息
     """
     try:
-        session_id = app_state["conv_map"].get(conversation_id)
-        if not session_id:
+        session_info = app_state["session_store"].get_by_conversation(conversation_id)
+        if not session_info:
             raise HTTPException(status_code=404, detail=f"未找到绑定的会话 - conversation_id: {conversation_id}")
         
-        session_info = app_state["session_map"][session_id]
+        session_id = session_info["session_id"]
         return {
             "conversation_id": conversation_id,
             "session_id": session_id,
@@ -600,29 +578,27 @@ async def get_session_by_conversation(conversation_id: str):
         raise HTTPException(status_code=500, detail=f"查询会话失败: {str(e)}")
 
 """
-    列出当前活跃的会话（分页）
+    列出当前活跃的会话（游标分页）
+    - 按会话创建顺序返回，翻页期间会话有新消息、新建或过期都不会重复或遗漏
     - 仅返回基础信息，不包含历史消息
     """
 @app.get("/sessions")
-async def list_sessions(limit: int = Query(10, ge=1, le=50), offset: int = Query(0, ge=0)):
+async def list_sessions(limit: int = Query(10, ge=1, le=50),
+                        cursor: Optional[int] = Query(None, ge=0, description="上一页返回的next_cursor，不传从头开始")):
     """
-    列出当前活跃的会话（分页）
+    列出当前活跃的会话（游标分页）
+    - 按会话创建顺序返回，翻页期间会话有新消息、新建或过期都不会重复或遗漏
     - 仅返回基础信息，不包含历史消息
     """
     try:
-        session_list = list(app_state["session_map"].items())[offset:offset+limit]
+        session_store = app_state["session_store"]
+        sessions, next_cursor = session_store.page(limit, cursor)
         return {
-            "total": len(app_state["session_map"]),
+            "total": len(session_store),
             "limit": limit,
-            "offset": offset,
-            "sessions": [
-                {
-                    "session_id": sid,
-                    "user_id": info["user_id"],
-                    "conversation_id": info["conversation_id"],
-                    "last_activity": info["last_activity"]
-                } for sid, info in session_list
-            ],
+            "cursor": cursor,
+            "next_cursor": next_cursor,
+            "sessions": sessions,
             "timestamp": datetime.now().isoformat()
         }
     except Exception as e:
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+并发流式聊天基准：一个进程（一个事件循环）同时服务 N 个流式对话
+
+本地启动一个Coze流式接口桩服务（每条回复 BENCH_DELTAS 个增量，间隔 BENCH_DELTA_MS 毫秒），对比：
+- 阻塞客户端：在事件循环中直接迭代 CozeAPIClient.send_message_stream（改造前 api_server 的做法）
+- 异步客户端：AsyncCozeAPIClient.send_message_stream
+统计 N 个流全部完成的总耗时，以及同一事件循环中一个10ms定时任务的最大延迟（反映其他请求被卡住多久）。
+最后验证取消传播：读到几个增量后取消任务，桩服务应看到连接断开。
+运行方式（在mental_agent目录下）：python benchmark_concurrent_streams.py
+"""
+
+import os
+import time
+import asyncio
+from contextlib import aclosing
+
+STUB_PORT = int(os.getenv('BENCH_STUB_PORT', 18765))
+os.environ['COZE_BASE_URL'] = f"http://127.0.0.1:{STUB_PORT}/v3"
+os.environ.setdefault('COZE_API_TOKEN', 'bench_token')
+os.environ.setdefault('COZE_BOT_ID', 'bench_bot')
+
+from coze_api_client import CozeAPIClient
+from coze_async_client import AsyncCozeAPIClient
+from coze_stub_server import CozeStubServer
+
+STREAMS = int(os.getenv('BENCH_STREAMS', 50))
+DELTAS = int(os.getenv('BENCH_DELTAS', 20))
+DELTA_SECONDS = float(os.getenv('BENCH_DELTA_MS', 20)) / 1000
+
+stub = CozeStubServer(STUB_PORT, deltas=DELTAS, delta_seconds=DELTA_SECONDS)
+
+
+async def blocking_stream(client):
+    count = 0
+    for item in client.send_message_stream("你好"):
+        count += item['type'] == 'chunk'
+    return count
+
+
+async def async_stream(client):
+    count = 0
+    async for item in client.send_message_stream("你好"):
+        count += item['type'] == 'chunk'
+    return count
+
+
+async def measure(name, stream_func, client):
+    """并发跑 STREAMS 个流，同时用10ms定时任务测事件循环的最大停顿"""
+    max_lag = 0.0
+    stop = False
+
+    async def ticker():
+        nonlocal max_lag
+        while not stop:
+            expected = time.perf_counter() + 0.01
+            await asyncio.sleep(0.01)
+            max_lag = max(max_lag, time.perf_counter() - expected)
+
+    ticker_task = asyncio.create_task(ticker())
+    start = time.perf_counter()
+    counts = await asyncio.gather(*(stream_func(client) for _ in range(STREAMS)))
+    elapsed = time.perf_counter() - start
+    stop = True
+    await ticker_task
+    assert all(count == DELTAS for count in counts), counts
+    print(f"{name:<6} {STREAMS}个流总耗时 {elapsed:6.2f} s | 事件循环最大停顿 {max_lag * 1000:7.1f} ms")
+
+
+async def check_cancel(client):
+    """读到3个增量后取消任务，确认上游连接被关闭"""
+    async def consume():
+        count = 0
+        stream = client.send_message_stream("你好")
+        async with aclosing(stream):
+            async for item in stream:
+                count += item['type'] == 'chunk'
+                if count == 3:
+                    await asyncio.sleep(3600)
+
+    before = stub.stats['disconnected']
+    task = asyncio.create_task(consume())
+    await asyncio.sleep(DELTA_SECONDS * 5)
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    await asyncio.sleep(0.2)
+    print(f"取消传播: 桩服务检测到断开 {stub.stats['disconnected'] - before} 次（期望1）")
+
+
+async def main():
+    stub.start()
+    single = DELTAS * DELTA_SECONDS
+    print(f"{STREAMS} 个并发流，每个 {DELTAS} 个增量 x {DELTA_SECONDS * 1000:.0f} ms（单流约 {single:.2f} s）")
+    await measure("阻塞客户端", blocking_stream, CozeAPIClient())
+    client = AsyncCozeAPIClient()
+    try:
+        await measure("异步客户端", async_stream, client)
+        await check_cancel(client)
+    finally:
+        await client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+会话注册表基准：原来的 session_map / conv_map 字典 vs SessionStore
+
+模拟 BENCH_SESSIONS（默认10万）个匿名会话各聊一轮（新建会话 + 绑定conversation_id），对比：
+- 内存占用（tracemalloc统计）和最终保留的会话数
+- 每个会话写入的平均耗时（SessionStore 分别测纯内存和SQLite持久化）
+- /sessions 取最后一页的耗时（原来每次 list(session_map.items()) 再切片，现在按游标直接定位）
+运行方式（在mental_agent目录下）：python benchmark_session_store.py
+"""
+
+import os
+import time
+import tempfile
+import tracemalloc
+from datetime import datetime
+
+from session_store import SessionStore
+
+SESSIONS = int(os.getenv('BENCH_SESSIONS', 100000))
+MAX_SESSIONS = int(os.getenv('BENCH_MAX_SESSIONS', 10000))
+PAGE_SIZE = 10
+
+
+def fill_dicts():
+    """改造前 api_server 的做法"""
+    session_map, conv_map = {}, {}
+    for i in range(SESSIONS):
+        session_id = f"session_{i:012x}"
+        conversation_id = f"conv_{i:016x}"
+        session_map[session_id] = {"user_id": f"user_{i:08x}", "conversation_id": None,
+                                   "last_activity": datetime.now().isoformat()}
+        session_map[session_id] = {"user_id": f"user_{i:08x}", "conversation_id": conversation_id,
+                                   "last_activity": datetime.now().isoformat()}
+        conv_map[conversation_id] = session_id
+    return session_map, conv_map
+
+
+def fill_store(store):
+    for i in range(SESSIONS):
+        session_id = f"session_{i:012x}"
+        store.touch(session_id, f"user_{i:08x}")
+        store.bind(session_id, f"user_{i:08x}", f"conv_{i:016x}")
+    return store
+
+
+def measure_fill(name, func):
+    """先计时（不开tracemalloc，避免拖慢），再重新跑一遍统计内存"""
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    result = func()
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f"{name:<16} 每会话 {elapsed / SESSIONS * 1e6:6.1f} µs | 内存 {memory / 1024 / 1024:6.1f} MB")
+    return result
+
+
+def persistent_store():
+    return fill_store(SessionStore(max_sessions=MAX_SESSIONS, db_path=os.path.join(tempfile.mkdtemp(), 'sessions.db')))
+
+
+def measure_last_page(name, func, repeat=20):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        items = func()
+    assert len(items) == PAGE_SIZE
+    print(f"{name:<16} 取最后一页 {(time.perf_counter() - start) / repeat * 1000:7.3f} ms")
+
+
+if __name__ == "__main__":
+    print(f"{SESSIONS} 个会话，SessionStore 容量 {MAX_SESSIONS}")
+    session_map, conv_map = measure_fill("原字典", fill_dicts)
+    store = measure_fill("SessionStore内存", lambda: fill_store(SessionStore(max_sessions=MAX_SESSIONS)))
+    persistent = measure_fill("SessionStore+SQLite", persistent_store)
+    print(f"保留会话数: 原字典 {len(session_map)} | SessionStore {len(store)}；指标: {store.get_stats()}")
+
+    measure_last_page("原字典", lambda: list(session_map.items())[SESSIONS - PAGE_SIZE:SESSIONS])
+    # 客户端翻到最后一页时持有的游标
+    _, cursor = store.page(len(store) - PAGE_SIZE)
+    measure_last_page("SessionStore游标", lambda: store.page(PAGE_SIZE, cursor)[0])
+
+    persistent.close()
+    start = time.perf_counter()
+    restored = SessionStore(max_sessions=MAX_SESSIONS, db_path=persistent.db_path)
+    print(f"重启恢复: {len(restored)} 个会话，耗时 {(time.perf_counter() - start) * 1000:.0f} ms")
+    restored.close()
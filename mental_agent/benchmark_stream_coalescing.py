@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+流式聊天（/chat/stream）下发基准：逐增量+每帧等待30ms vs 增量合并
+
+对接本地Coze桩服务（BENCH_DELTAS 个增量，间隔 BENCH_DELTA_MS 毫秒），按 api_server 中 stream_generator 的做法生成SSE帧，统计：
+- 首字节时间（第一个chunk帧）和末字节时间（complete帧）
+- chunk帧数、下发的总字节数
+对比：
+- 改造前：每个增量一帧（带会话信息和时间戳的完整帧），每帧后固定等待30ms
+- 逐增量：每个增量一个精简帧，不等待
+- 合并（默认配置）：STREAM_COALESCE_MS / STREAM_COALESCE_BYTES 的默认值
+- 节奏模式：pacing_ms=30，相邻帧至少间隔30ms（只补足间隔）
+运行方式（在mental_agent目录下）：python benchmark_stream_coalescing.py
+"""
+
+import os
+import json
+import time
+import uuid
+import asyncio
+from datetime import datetime
+from contextlib import aclosing
+
+STUB_PORT = int(os.getenv('BENCH_STUB_PORT', 18768))
+os.environ['COZE_BASE_URL'] = f"http://127.0.0.1:{STUB_PORT}/v3"
+os.environ.setdefault('COZE_API_TOKEN', 'bench_token')
+os.environ.setdefault('COZE_BOT_ID', 'bench_bot')
+
+from config import STREAM_CONFIG
+from coze_async_client import AsyncCozeAPIClient
+from coze_stub_server import CozeStubServer
+from stream_coalescer import coalesce_stream
+
+DELTAS = int(os.getenv('BENCH_DELTAS', 600))
+DELTA_SECONDS = float(os.getenv('BENCH_DELTA_MS', 5)) / 1000
+
+
+def legacy_frame(stream_data, session_id, message_id, chunk_index):
+    """改造前的chunk帧"""
+    return {"type": "chunk", "data": {
+        "content": stream_data.get("content", ""), "session_id": session_id, "message_id": message_id,
+        "chunk_index": chunk_index, "conversation_id": stream_data.get("conversation_id"),
+        "timestamp": datetime.now().isoformat()
+    }}
+
+
+async def frames(client, legacy, window_ms=0, max_bytes=0, pacing_ms=0):
+    """按 stream_generator 的做法生成SSE帧"""
+    session_id = f"session_{uuid.uuid4().hex[:12]}"
+    message_id = f"msg_{uuid.uuid4().hex[:16]}"
+    chunk_count = 0
+    full_content = ""
+    upstream = client.send_message_stream("讲个长一点的故事")
+    coalesced = coalesce_stream(upstream, window_ms=window_ms, max_bytes=max_bytes, pacing_ms=pacing_ms)
+    async with aclosing(upstream), aclosing(coalesced):
+        async for stream_data in coalesced:
+            if stream_data["type"] == "chunk":
+                chunk_count += 1
+                full_content += stream_data["content"]
+                if legacy:
+                    yield "chunk", f"data: {json.dumps(legacy_frame(stream_data, session_id, message_id, chunk_count), ensure_ascii=False)}\n\n"
+                    await asyncio.sleep(0.03)
+                else:
+                    frame = {"type": "chunk", "data": {"content": stream_data["content"], "chunk_index": chunk_count}}
+                    yield "chunk", f"data: {json.dumps(frame, ensure_ascii=False, separators=(',', ':'))}\n\n"
+            elif stream_data["type"] == "complete":
+                complete = {"type": "complete", "data": {
+                    "session_id": session_id, "message_id": message_id, "total_chunks": chunk_count,
+                    "full_content": full_content, "conversation_id": stream_data["conversation_id"],
+                    "timestamp": datetime.now().isoformat()
+                }}
+                yield "complete", f"data: {json.dumps(complete, ensure_ascii=False)}\n\n"
+            else:
+                raise RuntimeError(stream_data.get("message"))
+
+
+async def measure(client, name, **kwargs):
+    start = time.perf_counter()
+    first = last = None
+    chunk_frames = chunk_bytes = 0
+    async for frame_type, frame in frames(client, **kwargs):
+        if frame_type == "chunk":
+            first = first or time.perf_counter() - start
+            chunk_frames += 1
+            chunk_bytes += len(frame.encode('utf-8'))
+        last = time.perf_counter() - start
+    print(f"  {name:<10} 首字节 {first * 1000:6.0f} ms | 末字节 {last:6.2f} s | "
+          f"chunk帧 {chunk_frames:4d} 个，共 {chunk_bytes / 1024:6.1f} KB")
+
+
+async def main():
+    CozeStubServer(STUB_PORT, deltas=DELTAS, delta_seconds=DELTA_SECONDS).start()
+    client = AsyncCozeAPIClient()
+    print(f"{DELTAS} 个增量 x {DELTA_SECONDS * 1000:.0f} ms（上游生成共 {DELTAS * DELTA_SECONDS:.1f} s），"
+          f"合并配置 {STREAM_CONFIG['coalesce_ms']:.0f} ms / {STREAM_CONFIG['coalesce_bytes']} B：")
+    try:
+        await measure(client, "改造前", legacy=True)
+        await measure(client, "逐增量", legacy=False)
+        await measure(client, "合并", legacy=False, window_ms=STREAM_CONFIG['coalesce_ms'],
+                      max_bytes=STREAM_CONFIG['coalesce_bytes'])
+        await measure(client, "节奏模式", legacy=False, pacing_ms=30)
+    finally:
+        await client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+非流式聊天（/chat）基准：轮询消息列表 vs 基于流式接口聚合
+
+对接本地Coze桩服务（回复生成耗时分别为 BENCH_REPLY_SECONDS 中的各个值），每种方式并发跑 BENCH_CHATS 次对话，统计：
+- 每次对话的平均耗时、比回复生成耗时多等待的时间
+- 每次对话发出的HTTP请求数（创建Chat + 消息列表查询）
+对比三种方式：
+- 固定1秒轮询：改造前的 send_message_sync（创建非流式Chat后每秒查询一次消息列表）
+- 自适应退避轮询：现在的回退方式（0.2秒起，每次x1.5，最长1秒）
+- 流式聚合：现在的 send_message_sync（一次流式请求，聚合增量到对话完成）
+运行方式（在mental_agent目录下）：python benchmark_sync_chat.py
+"""
+
+import os
+import time
+import asyncio
+
+STUB_PORT = int(os.getenv('BENCH_STUB_PORT', 18767))
+os.environ['COZE_API_TOKEN'] = os.getenv('COZE_API_TOKEN', 'bench_token')
+os.environ['COZE_BOT_ID'] = os.getenv('COZE_BOT_ID', 'bench_bot')
+
+from coze_async_client import AsyncCozeAPIClient
+from coze_stub_server import CozeStubServer
+
+CHATS = int(os.getenv('BENCH_CHATS', 10))
+REPLY_SECONDS = [float(value) for value in os.getenv('BENCH_REPLY_SECONDS', '0.5,2.5').split(',')]
+DELTA_SECONDS = 0.02
+
+
+def polling(initial, backoff):
+    async def run(client, message):
+        client.poll_initial_interval = initial
+        client.poll_backoff = backoff
+        return await client._send_message_polling(message)
+    return run
+
+
+async def streaming(client, message):
+    return await client.send_message_sync(message)
+
+
+MODES = [
+    ("固定1秒轮询", polling(1.0, 1.0)),
+    ("自适应退避轮询", polling(0.2, 1.5)),
+    ("流式聚合", streaming),
+]
+
+
+async def measure(stub, client, name, chat_func, reply_seconds):
+    before = dict(stub.stats)
+
+    async def one(i):
+        start = time.perf_counter()
+        result = await chat_func(client, f"消息{i}")
+        assert result['content'].startswith(result['conversation_id']), result
+        return time.perf_counter() - start
+
+    latencies = await asyncio.gather(*(one(i) for i in range(CHATS)))
+    avg = sum(latencies) / len(latencies)
+    requests = sum(stub.stats[key] - before[key] for key in ('chat_requests', 'message_list_requests'))
+    print(f"  {name:<8} 平均耗时 {avg:5.2f} s（多等 {avg - reply_seconds:5.2f} s）| "
+          f"每次对话 {requests / CHATS:4.1f} 个HTTP请求")
+
+
+async def main():
+    for index, reply_seconds in enumerate(REPLY_SECONDS):
+        deltas = max(1, round(reply_seconds / DELTA_SECONDS))
+        stub = CozeStubServer(STUB_PORT + index, deltas=deltas, delta_seconds=DELTA_SECONDS).start()
+        os.environ['COZE_BASE_URL'] = stub.base_url
+        client = AsyncCozeAPIClient()
+        print(f"回复生成耗时 {reply_seconds:.1f} s，{CHATS} 次并发对话：")
+        try:
+            for name, chat_func in MODES:
+                await measure(stub, client, name, chat_func, reply_seconds)
+        finally:
+            await client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -31,5 +31,19 @@ SERVER_CONFIG = {
     'max_request_size': 10 * 1024 * 1024,  # 最大请求大小（10MB）
 }
 
+# 会话注册表配置（session_id <-> conversation_id 绑定）
+SESSION_CONFIG = {
+    'max_sessions': int(os.getenv('SESSION_MAX_COUNT', 10000)),  # 最多保留的会话数，超出时淘汰最久未活动的
+    'ttl_seconds': float(os.getenv('SESSION_TTL_SECONDS', 7 * 24 * 3600)),  # 超过该时间未活动的会话过期
+    'db_path': os.getenv('SESSION_DB_PATH', ''),  # SQLite文件路径（如 logs/sessions.db），为空时只保存在内存
+}
+
+# 流式回复配置（/chat/stream 的增量合并与节奏）
+STREAM_CONFIG = {
+    'coalesce_ms': float(os.getenv('STREAM_COALESCE_MS', 50)),  # 合并时间窗口（毫秒），0表示不按时间合并
+    'coalesce_bytes': int(os.getenv('STREAM_COALESCE_BYTES', 256)),  # 缓存达到该字节数立即下发，0表示不按大小合并
+    'pacing_ms': float(os.getenv('STREAM_PACING_MS', 0)),  # 默认节奏模式最小帧间隔（毫秒），0表示关闭；请求可单独指定
+}
+
 # 创建日志目录（必要目录）
 os.makedirs(BASE_DIR / 'logs', exist_ok=True)
\ No newline at end of file
@@ -0,0 +1,468 @@
+#!/usr/bin/env python3
+"""
+基于Coze V3 API的异步心理聊天客户端（asyncio + aiohttp）
+与 CozeAPIClient 的 send_message_sync / send_message_stream 语义一致，供 FastAPI 服务在事件循环中直接await：
+- 连接池：一个客户端共用一个 aiohttp.ClientSession，长连接复用（COZE_POOL_SIZE、COZE_KEEPALIVE_TIMEOUT）
+- 异步SSE解析：按行解析 event/data，等待上游数据时不阻塞事件循环，一个慢流不再拖住同一进程的其他请求
+- 取消传播：调用方取消任务或提前关闭生成器（如前端断开）时立即关闭上游响应，Coze侧随之停止生成
+- 非流式聊天（send_message_sync）内部走流式接口，聚合增量到 conversation.chat.completed 即返回，
+  不再轮询消息列表；Chat已创建但没有拿到回复时按chat_id轮询（自适应退避），
+  只有请求确定未被Coze受理（连接失败、HTTP状态错误）时才回退到重新发送，对话失败直接抛出
+- 无状态：客户端不保存会话，conversation_id 每次调用传入、随结果返回，多个对话可以并发共用一个客户端和连接池
+  （ClientSession 绑定创建它的事件循环，每个事件循环/工作进程使用各自的客户端实例）
+"""
+
+import os
+import json
+import ssl
+import time
+import asyncio
+import traceback
+from contextlib import contextmanager, aclosing
+from typing import Optional, Dict, Any, AsyncIterator, List
+
+import aiohttp
+from dotenv import load_dotenv
+
+# 加载环境变量
+load_dotenv()
+
+# 每个客户端的最大并发连接数 / 空闲长连接保持时间（秒）
+COZE_POOL_SIZE = int(os.getenv('COZE_POOL_SIZE', 100))
+COZE_KEEPALIVE_TIMEOUT = float(os.getenv('COZE_KEEPALIVE_TIMEOUT', 30))
+
+
+# 请求未送达/未被Coze受理的异常：建连失败（含建连超时，aiohttp>=3.10）、响应体开始前的HTTP状态错误
+_NOT_SENT_ERRORS = (aiohttp.ClientConnectorError, aiohttp.ClientResponseError) + (
+    (aiohttp.ConnectionTimeoutError,) if hasattr(aiohttp, 'ConnectionTimeoutError') else ()
+)
+
+
+class CozeRequestNotSentError(Exception):
+    """消息未被Coze受理（响应体开始之前失败），可以安全地重新发送"""
+
+
+def _create_ssl_context() -> ssl.SSLContext:
+    """与 TLSAdapter 相同的SSL配置：开发环境不校验证书，强制TLSv1.2+"""
+    context = ssl.create_default_context(ssl.Purpose.SERVER_AUTH)
+    context.check_hostname = False  # 开发环境禁用主机名验证
+    context.verify_mode = ssl.CERT_NONE  # 开发环境禁用证书验证
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    return context
+
+
+class AsyncCozeAPIClient:
+    def __init__(self, debug: bool = False):
+        # 核心配置（与 CozeAPIClient 一致）
+        self.base_url = os.getenv('COZE_BASE_URL', "https://api.coze.cn/v3")
+        self.api_token = os.getenv('COZE_API_TOKEN')
+        self.bot_id = os.getenv('COZE_BOT_ID')
+        self.user_id = os.getenv('COZE_USER_ID', 'default_user_123')
+
+        self.debug = debug  # 调试模式：打印详细日志
+
+        # 超时配置（贴合Coze API响应特性）
+        self.sync_timeout = 60  # 同步请求总超时（含消息轮询）
+        self.stream_timeout = 60  # 流式请求两次收到数据之间的最长等待
+        # 回退轮询：首次间隔 poll_initial_interval，每次乘以 poll_backoff，最长 poll_interval（秒）
+        self.poll_initial_interval = 0.2
+        self.poll_backoff = 1.5
+        self.poll_interval = 1
+
+        # 校验必填配置（官方文档强制要求）
+        if not self.api_token:
+            raise ValueError("❌ 请设置COZE_API_TOKEN环境变量（从Coze开放平台获取）")
+        if not self.bot_id:
+            raise ValueError("❌ 请设置COZE_BOT_ID环境变量（从Coze开放平台获取）")
+
+        # ClientSession 必须在事件循环中创建，首次请求时初始化
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """获取共用的连接池会话（懒加载）"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=COZE_POOL_SIZE,
+                keepalive_timeout=COZE_KEEPALIVE_TIMEOUT,
+                ssl=_create_ssl_context()
+            )
+            self._session = aiohttp.ClientSession(connector=connector, headers=self._get_headers())
+        return self._session
+
+    async def close(self):
+        """关闭连接池（应用关闭时调用）"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def _get_headers(self) -> Dict[str, str]:
+        """获取Coze官方规范的请求头"""
+        return {
+            "Authorization": f"Bearer {self.api_token}",
+            "Content-Type": "application/json",
+            "User-Agent": "Coze-Python-Client/1.0 (Psychological Agent Compatible)"
+        }
+
+    @contextmanager
+    def _handle_request_errors(self, operation: str, url: str = "", params: dict = None, data: dict = None,
+                               not_sent: tuple = ()):
+        """
+        错误处理：打印完整请求信息+异常信息（任务取消不在此处理，直接向上传播）
+        not_sent 中的异常表示请求未被受理，包装为 CozeRequestNotSentError，其余包装为 Exception
+        """
+        try:
+            yield
+        except aiohttp.ClientError as e:
+            error_msg = f"\n❌ {operation}失败！"
+            error_msg += f"\n请求URL: {url}"
+            if params:
+                error_msg += f"\n请求参数: {json.dumps(params, ensure_ascii=False)}"
+            if data:
+                error_msg += f"\n请求体: {json.dumps(data, ensure_ascii=False)}"
+            error_msg += f"\n错误类型: {type(e).__name__}"
+            error_msg += f"\n错误描述: {str(e)}"
+            if isinstance(e, aiohttp.ClientResponseError):
+                error_msg += f"\n响应状态码: {e.status}"
+            error_msg += f"\n异常堆栈:\n{traceback.format_exc()}"
+            raise (CozeRequestNotSentError if isinstance(e, not_sent) else Exception)(error_msg)
+        except asyncio.TimeoutError:
+            raise Exception(f"\n❌ {operation}失败！\n请求URL: {url}\n错误类型: 超时\n异常堆栈:\n{traceback.format_exc()}")
+        except Exception as e:
+            error_msg = f"\n❌ {operation}失败！"
+            error_msg += f"\n错误类型: {type(e).__name__}"
+            error_msg += f"\n错误描述: {str(e)}"
+            error_msg += f"\n异常堆栈:\n{traceback.format_exc()}"
+            raise Exception(error_msg)
+
+    def _build_chat_url(self, conversation_id: Optional[str]) -> str:
+        """构建聊天API URL（附加conversation_id，关联上下文）"""
+        url = f"{self.base_url}/chat"
+        if conversation_id:
+            url += f"?conversation_id={conversation_id}"
+        return url
+
+    def _build_chat_body(self, message: str, stream: bool) -> Dict[str, Any]:
+        return {
+            "bot_id": self.bot_id,
+            "user_id": self.user_id,
+            "stream": stream,
+            "auto_save_history": True,
+            "additional_messages": [
+                {"role": "user", "content": message, "content_type": "text"}
+            ]
+        }
+
+    async def _get_raw_chat_messages(self, chat_id: str, conversation_id: str) -> List[Dict[str, Any]]:
+        """调用官方「查看对话消息详情API」：获取原始消息列表"""
+        messages_url = f"{self.base_url}/chat/message/list"
+        params = {
+            "chat_id": chat_id,
+            "conversation_id": conversation_id,
+            "role": "assistant",
+            "content_type": "text",
+            "order": "desc",
+            "top": 30
+        }
+
+        with self._handle_request_errors(operation="查询对话消息", url=messages_url, params=params):
+            async with self._get_session().get(
+                messages_url, params=params, timeout=aiohttp.ClientTimeout(total=30)
+            ) as response:
+                response.raise_for_status()
+                result = await response.json(content_type=None)
+
+            if result.get('code') != 0:
+                raise Exception(f"获取消息失败：code={result['code']}, msg={result['msg']}")
+            return result.get('data', [])
+
+    async def _poll_chat_messages(self, chat_id: str, conversation_id: str) -> str:
+        """
+        轮询查询消息列表：直到拿到type=answer的最终回复或超时（等待期间让出事件循环）
+        轮询间隔从 poll_initial_interval 开始按 poll_backoff 递增到 poll_interval：
+        短回复很快拿到，长回复也不会频繁请求
+        """
+        start_time = time.time()
+        interval = self.poll_initial_interval
+        while time.time() - start_time < self.sync_timeout:
+            messages = await self._get_raw_chat_messages(chat_id, conversation_id)
+
+            for msg in messages:
+                if msg.get('type') == 'answer' and msg.get('content', '').strip():
+                    answer_content = msg.get('content').strip()
+                    if self.debug:
+                        print(f"[调试] 找到type=answer的最终回复（耗时：{time.time()-start_time:.1f}秒）：{answer_content[:100]}...")
+                    return answer_content
+
+            if self.debug:
+                print(f"[调试] 未找到type=answer的消息，等待{interval:.1f}秒后重试...")
+            await asyncio.sleep(interval)
+            interval = min(interval * self.poll_backoff, self.poll_interval)
+
+        raise Exception(f"超时（{self.sync_timeout}秒）未获取到最终回复，chat_id={chat_id}")
+
+    def _parse_verbose_content(self, content: str) -> str:
+        """解析verbose类型消息的JSON内容，兼容插件结构"""
+        try:
+            verbose_data = json.loads(content)
+            if isinstance(verbose_data.get('data'), dict):
+                wrapped_text = verbose_data['data'].get('wraped_text', '').strip()
+                if wrapped_text:
+                    return wrapped_text
+            for key in ['content', 'text', 'message', 'result', 'reply']:
+                if key in verbose_data:
+                    val = str(verbose_data[key]).strip()
+                    if val and val not in ['{}', '[]', '""']:
+                        return val
+            if isinstance(verbose_data.get('data'), str):
+                try:
+                    nested_data = json.loads(verbose_data['data'])
+                    for nested_key in ['wraped_text', 'content', 'text']:
+                        nested_val = str(nested_data.get(nested_key, '')).strip()
+                        if nested_val:
+                            return nested_val
+                except:
+                    pass
+            return ""
+        except:
+            return ""
+
+    async def _get_chat_messages(self, chat_id: str, conversation_id: str) -> str:
+        """提取助手最终回复（优先type=answer，兼容verbose）"""
+        try:
+            return await self._poll_chat_messages(chat_id, conversation_id)
+        except Exception as e:
+            if self.debug:
+                print(f"[调试] 轮询type=answer失败：{str(e)}，尝试解析verbose消息")
+
+        messages = await self._get_raw_chat_messages(chat_id, conversation_id)
+        for msg in messages:
+            if msg.get('type') == 'verbose' and msg.get('content', '').strip():
+                parsed_content = self._parse_verbose_content(msg.get('content'))
+                if parsed_content:
+                    return parsed_content
+
+        return "你好呀～ 很高兴能成为你的心理陪伴伙伴～ 不管你现在是什么心情，有什么想聊的，都可以告诉我，我会一直在这里倾听和陪伴你～"
+
+    async def send_message_sync(self, message: str, conversation_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        非流式聊天：内部调用流式接口，聚合增量直到对话完成后一次返回
+        
+        一次HTTP请求拿到完整回复，回复生成完即返回（轮询方式每条回复要多发若干次消息列表请求，
+        且平均多等半个轮询间隔）。失败时：
+        - 请求未被受理（建连失败、响应体开始前的HTTP状态错误）：回退到创建非流式Chat + 轮询
+        - 已创建Chat但没有拿到回复（中途断开、回复只在verbose消息里）：按chat_id轮询，不重复发送消息
+        - 上游报告对话失败（conversation.chat.failed），或请求可能已受理但没有拿到chat_id：直接抛出，
+          避免同一条消息被发送两次
+        
+        参数：conversation_id - 续传的Coze会话ID，不传则新建会话
+        返回：{"content": 最终回复, "chat_id": ..., "conversation_id": 实际使用的会话ID}
+        """
+        chat_id = None
+        complete = None
+        failure = None
+        try:
+            async with aclosing(self.send_message_stream(message, conversation_id)) as stream:
+                async for item in stream:
+                    chat_id = item.get('chat_id') or chat_id
+                    conversation_id = item.get('conversation_id') or conversation_id
+                    if item['type'] == 'complete':
+                        complete = item
+                    elif item['type'] == 'error':
+                        if item.get('fatal'):
+                            failure = item['message']
+                        elif self.debug:
+                            print(f"[调试] 流式聚合收到错误：{item.get('message')}")
+        except CozeRequestNotSentError as e:
+            if self.debug:
+                print(f"[调试] 流式请求未被受理，回退到轮询：{str(e)[:200]}")
+            return await self._send_message_polling(message, conversation_id)
+        except Exception as e:
+            if not chat_id:
+                raise
+            if self.debug:
+                print(f"[调试] 流式聚合中断，按chat_id轮询：{str(e)[:200]}")
+
+        if failure:
+            raise Exception(failure)
+
+        # 与轮询得到的完整answer一致：只去掉首尾空白，段落、换行和列表格式保持原样
+        reply = complete['full_content'].strip() if complete else ''
+        if reply:
+            return {"content": reply, "chat_id": chat_id, "conversation_id": conversation_id}
+        if not chat_id or not conversation_id:
+            raise Exception(f"创建Chat失败：返回数据不完整（chat_id={chat_id}, conversation_id={conversation_id}）")
+
+        reply = await self._get_chat_messages(chat_id, conversation_id)
+        return {"content": reply, "chat_id": chat_id, "conversation_id": conversation_id}
+
+    async def _send_message_polling(self, message: str, conversation_id: Optional[str] = None) -> Dict[str, Any]:
+        """非流式聊天（回退方式）：创建非流式Chat后轮询消息列表获取最终回复"""
+        url = self._build_chat_url(conversation_id)
+        data = self._build_chat_body(message, stream=False)
+
+        with self._handle_request_errors(operation="创建Chat", url=url, data=data):
+            async with self._get_session().post(
+                url, json=data, timeout=aiohttp.ClientTimeout(total=30)
+            ) as response:
+                response.raise_for_status()
+                result = await response.json(content_type=None)
+
+            if result.get('code') != 0:
+                raise Exception(f"创建Chat失败：code={result['code']}, msg={result['msg']}")
+            chat_id = result['data'].get('id')
+            conversation_id = result['data'].get('conversation_id')
+
+            if not chat_id or not conversation_id:
+                raise Exception(f"创建Chat失败：返回数据不完整（chat_id={chat_id}, conversation_id={conversation_id}）")
+
+            if self.debug:
+                print(f"[调试] 创建Chat成功：chat_id={chat_id}, conversation_id={conversation_id}")
+
+            reply = await self._get_chat_messages(chat_id, conversation_id)
+            return {"content": reply, "chat_id": chat_id, "conversation_id": conversation_id}
+
+    @staticmethod
+    async def _iter_lines(response: aiohttp.ClientResponse) -> AsyncIterator[str]:
+        """按行读取SSE响应（自行分行，不受aiohttp单行长度限制）"""
+        buffer = b""
+        async for chunk in response.content.iter_any():
+            buffer += chunk
+            while True:
+                newline = buffer.find(b"\n")
+                if newline < 0:
+                    break
+                line, buffer = buffer[:newline], buffer[newline + 1:]
+                yield line.decode('utf-8', errors='ignore').strip()
+        if buffer:
+            yield buffer.decode('utf-8', errors='ignore').strip()
+
+    async def send_message_stream(self, message: str,
+                                  conversation_id: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        流式聊天：解析Coze官方SSE格式（event: 事件类型\\n data: 消息数据\\n\\n）
+        产出与 CozeAPIClient.send_message_stream 相同的 chunk / error / complete 字典，
+        其中 conversation_id 为本次调用实际使用的会话ID（新建会话时取自 conversation.chat.created 事件）。
+        收到 conversation.chat.completed 即产出 complete 结束，不再等待后续的 done 事件；
+        conversation.chat.failed 产出 fatal=True 的 error 后结束。
+        响应体开始之前失败（请求未被受理）抛出 CozeRequestNotSentError，调用方可以安全重发。
+        调用方取消或关闭生成器时立即关闭上游连接。
+        
+        参数：conversation_id - 续传的Coze会话ID，不传则新建会话
+        """
+        url = self._build_chat_url(conversation_id)
+        data = self._build_chat_body(message, stream=True)
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=self.stream_timeout)
+
+        with self._handle_request_errors(operation="流式创建Chat", url=url, data=data, not_sent=_NOT_SENT_ERRORS):
+            response = await self._get_session().post(url, json=data, timeout=timeout)
+            try:
+                response.raise_for_status()
+            except aiohttp.ClientResponseError:
+                response.release()
+                raise
+
+        with self._handle_request_errors(operation="流式读取回复", url=url, data=data):
+            current_chat_id = None
+            try:
+                full_content = ""
+                current_event = None  # 记录当前SSE事件类型
+
+                async for line in self._iter_lines(response):
+                    if not line:
+                        continue
+                    try:
+                        # 1. 解析event类型（官方SSE：event: xxx）
+                        if line.startswith('event:'):
+                            current_event = line.split(':', 1)[1].strip()
+                            continue
+
+                        # 2. 解析data内容（官方SSE：data: xxx）
+                        if not (line.startswith('data:') and current_event):
+                            continue
+                        data_part = line.split(':', 1)[1].strip()
+
+                        # 官方结束标识：event=done + data="[DONE]"
+                        if current_event == 'done' and data_part == '"[DONE]"':
+                            break
+                        if not data_part:
+                            continue
+
+                        msg = json.loads(data_part)
+
+                        # 3. 会话创建事件：记录chat_id和conversation_id
+                        if current_event == 'conversation.chat.created':
+                            current_chat_id = msg.get('id')
+                            conversation_id = msg.get('conversation_id', conversation_id)
+                            if self.debug:
+                                print(f"[调试] 流式会话创建：chat_id={current_chat_id}, conversation_id={conversation_id}")
+
+                        # 4. 对话完成事件：回复已全部下发，直接结束（后续只剩 done 事件）
+                        elif current_event == 'conversation.chat.completed':
+                            current_chat_id = msg.get('id') or current_chat_id
+                            conversation_id = msg.get('conversation_id') or conversation_id
+                            break
+
+                        # 5. 对话失败事件：返回错误信息并结束（fatal：本次对话不会再有回复）
+                        elif current_event == 'conversation.chat.failed':
+                            last_error = msg.get('last_error') or {}
+                            yield {
+                                "type": "error",
+                                "message": f"Coze对话失败：code={last_error.get('code')}, msg={last_error.get('msg')}",
+                                "chat_id": current_chat_id,
+                                "conversation_id": conversation_id,
+                                "fatal": True
+                            }
+                            break
+
+                        # 6. 增量回复事件：只取助手的text类型answer
+                        # 增量原样转发（只跳过空字符串）：换行、空格等只含空白的增量也是回复内容的一部分
+                        elif current_event == 'conversation.message.delta':
+                            if (msg.get('role') == 'assistant'
+                                    and msg.get('content_type') == 'text'
+                                    and msg.get('type') == 'answer'):
+                                content = msg.get('content') or ''
+                                if content:
+                                    full_content += content
+                                    yield {
+                                        "type": "chunk",
+                                        "content": content,
+                                        "chat_id": current_chat_id,
+                                        "conversation_id": conversation_id
+                                    }
+                    except Exception as e:
+                        error_msg = f"[调试] 流式解析异常：{str(e)}"
+                        if self.debug:
+                            print(error_msg)
+                        yield {
+                            "type": "error",
+                            "message": error_msg,
+                            "chat_id": current_chat_id,
+                            "conversation_id": conversation_id
+                        }
+            except (asyncio.CancelledError, GeneratorExit):
+                # 调用方已不再读取：直接断开上游连接（不放回连接池），Coze侧随之停止生成
+                response.close()
+                if self.debug:
+                    print(f"[调试] 流式聊天被取消，已关闭上游连接：chat_id={current_chat_id}")
+                raise
+            finally:
+                response.release()
+
+            # 流式结束：返回完整结果
+            yield {
+                "type": "complete",
+                "full_content": full_content,
+                "chat_id": current_chat_id,
+                "conversation_id": conversation_id,
+                "is_success": len(full_content) > 0
+            }
+
+    @staticmethod
+    def validate_conversation_id(conversation_id: str) -> str:
+        """
+        校验传入的会话ID（续传已有会话前调用）
+        参数：conversation_id - Coze官方返回的会话ID（长度通常>10）
+        """
+        if not conversation_id or not isinstance(conversation_id, str) or len(conversation_id) < 10:
+            raise ValueError("❌ 无效的conversation_id：必须是长度≥10的字符串（从Coze API获取）")
+        return conversation_id
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+本地Coze接口桩服务（基准测试和压力测试用）
+
+模拟 Coze V3 的 /v3/chat：
+- 流式：先发 conversation.chat.created，再按固定间隔发 deltas 个 conversation.message.delta，
+  然后发 conversation.chat.completed 和 done。增量内容为 "<conversation_id>|<序号>"，便于检查回复是否串到了别的会话
+- 非流式：立即返回chat_id
+- 两种方式的回复都在 deltas x delta_seconds 之后才能通过 /v3/chat/message/list 查到
+在独立线程的事件循环中运行，调用方即使阻塞自己的事件循环也不影响桩服务。
+"""
+
+import json
+import time
+import uuid
+import asyncio
+import threading
+from typing import Dict
+
+from aiohttp import web
+
+
+def _sse(event: str, data) -> bytes:
+    return f"event:{event}\ndata:{json.dumps(data, ensure_ascii=False)}\n\n".encode('utf-8')
+
+
+class CozeStubServer:
+    def __init__(self, port: int, deltas: int = 20, delta_seconds: float = 0.02):
+        self.port = port
+        self.deltas = deltas
+        self.delta_seconds = delta_seconds
+        self.base_url = f"http://127.0.0.1:{port}/v3"
+        # 统计：各接口请求数、客户端中途断开数
+        self.stats: Dict[str, int] = {'chat_requests': 0, 'message_list_requests': 0, 'disconnected': 0}
+        # 非流式Chat：chat_id -> (回复可查询的时间, 回复内容)
+        self._answers: Dict[str, tuple] = {}
+
+    def _answer(self, conversation_id: str) -> str:
+        return ''.join(f"{conversation_id}|{i}" for i in range(self.deltas))
+
+    async def _chat(self, request: web.Request) -> web.StreamResponse:
+        """模拟 /v3/chat"""
+        self.stats['chat_requests'] += 1
+        body = await request.json()
+        conversation_id = request.query.get('conversation_id') or f"conv_{uuid.uuid4().hex}"
+        chat_id = f"chat_{uuid.uuid4().hex[:16]}"
+        ready_at = time.monotonic() + self.deltas * self.delta_seconds
+        self._answers[chat_id] = (ready_at, self._answer(conversation_id))
+        if not body.get('stream'):
+            return web.json_response({'code': 0, 'msg': '', 'data': {
+                'id': chat_id, 'conversation_id': conversation_id, 'status': 'in_progress'
+            }})
+
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+        await response.prepare(request)
+        try:
+            await response.write(_sse('conversation.chat.created', {'id': chat_id, 'conversation_id': conversation_id}))
+            for i in range(self.deltas):
+                await asyncio.sleep(self.delta_seconds)
+                await response.write(_sse('conversation.message.delta', {
+                    'role': 'assistant', 'type': 'answer', 'content_type': 'text',
+                    'content': f"{conversation_id}|{i}", 'conversation_id': conversation_id
+                }))
+            await response.write(_sse('conversation.chat.completed', {
+                'id': chat_id, 'conversation_id': conversation_id, 'status': 'completed'
+            }))
+            await response.write(b'event:done\ndata:"[DONE]"\n\n')
+        except ConnectionResetError:
+            # 客户端已断开，停止生成
+            self.stats['disconnected'] += 1
+        except asyncio.CancelledError:
+            self.stats['disconnected'] += 1
+            raise
+        return response
+
+    async def _message_list(self, request: web.Request) -> web.Response:
+        """模拟 /v3/chat/message/list：回复生成完之前返回空列表"""
+        self.stats['message_list_requests'] += 1
+        ready_at, answer = self._answers.get(request.query.get('chat_id'), (None, None))
+        messages = []
+        if ready_at is not None and time.monotonic() >= ready_at:
+            messages.append({'role': 'assistant', 'type': 'answer', 'content_type': 'text', 'content': answer})
+        return web.json_response({'code': 0, 'msg': '', 'data': messages})
+
+    def start(self) -> 'CozeStubServer':
+        """在后台线程中启动，返回时已可接受连接"""
+        ready = threading.Event()
+
+        def run():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            app = web.Application()
+            app.router.add_post('/v3/chat', self._chat)
+            app.router.add_get('/v3/chat/message/list', self._message_list)
+            runner = web.AppRunner(app)
+            loop.run_until_complete(runner.setup())
+            loop.run_until_complete(web.TCPSite(runner, '127.0.0.1', self.port, backlog=1024).start())
+            ready.set()
+            loop.run_forever()
+
+        threading.Thread(target=run, daemon=True).start()
+        ready.wait()
+        return self
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+心理智能体的会话注册表：session_id <-> Coze conversation_id 双向绑定
+
+替代 app_state 中只增不减的 session_map / conv_map 两个字典：
+- 有界：最多 max_sessions 个会话，超出时淘汰最久未活动的（LRU）；超过 ttl_seconds 未活动的会话过期
+- O(1) 查询：session_id -> 会话信息、conversation_id -> session_id 两个方向都是字典查找
+- 稳定的游标分页：按会话创建顺序（单调递增的序号）翻页，翻页期间有会话活动、新建或被淘汰都不会重复或跳过
+- 可选持久化：配置 SQLite 文件路径后写穿到文件，重启后恢复未过期的绑定
+- 内存指标：会话数、估算占用字节、淘汰/过期计数（/health 返回）
+
+淘汰在写入时顺带进行：会话按最后活动时间排在有序字典中，过期和超量的都在头部，每次只弹出需要淘汰的部分。
+"""
+
+import sys
+import time
+import bisect
+import sqlite3
+import logging
+import threading
+from datetime import datetime
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, Tuple
+
+logger = logging.getLogger("session_store")
+
+
+class SessionStore:
+    def __init__(self, max_sessions: int = 10000, ttl_seconds: float = 7 * 24 * 3600, db_path: Optional[str] = None):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.db_path = db_path or None
+
+        self._lock = threading.RLock()
+        # session_id -> {"user_id", "conversation_id", "last_activity"(时间戳), "seq"}，按最后活动时间从旧到新排列
+        self._sessions: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # conversation_id -> session_id（反向查找）
+        self._by_conversation: Dict[str, str] = {}
+        # 分页索引：按创建序号升序的序号列表（删除时延迟清理）+ 序号 -> session_id
+        self._seqs: List[int] = []
+        self._seq_to_session: Dict[int, str] = {}
+        self._next_seq = 1
+
+        self._bytes = 0
+        self._stats = {'evicted_lru': 0, 'expired': 0}
+
+        self._db: Optional[sqlite3.Connection] = None
+        if self.db_path:
+            self._open_db()
+
+    # ==================== 持久化 ====================
+    def _open_db(self):
+        """打开SQLite文件并加载未过期的会话（最近活动的 max_sessions 个）"""
+        self._db = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                user_id TEXT,
+                conversation_id TEXT,
+                last_activity REAL NOT NULL,
+                seq INTEGER NOT NULL
+            )
+        """)
+        cutoff = time.time() - self.ttl_seconds
+        self._db.execute("DELETE FROM sessions WHERE last_activity < ?", (cutoff,))
+        rows = self._db.execute(
+            "SELECT session_id, user_id, conversation_id, last_activity, seq FROM sessions "
+            "ORDER BY last_activity DESC LIMIT ?", (self.max_sessions,)
+        ).fetchall()
+        for session_id, user_id, conversation_id, last_activity, seq in sorted(rows, key=lambda row: row[4]):
+            self._insert(session_id, user_id, conversation_id, last_activity, seq)
+        # 按活动时间重排LRU顺序
+        for session_id, *_ in sorted(rows, key=lambda row: row[3]):
+            self._sessions.move_to_end(session_id)
+        self._next_seq = max((row[4] for row in rows), default=0) + 1
+        if len(rows) == self.max_sessions:
+            self._db.execute("DELETE FROM sessions WHERE seq NOT IN (SELECT seq FROM sessions "
+                             "ORDER BY last_activity DESC LIMIT ?)", (self.max_sessions,))
+        logger.info(f"会话注册表已从 {self.db_path} 恢复 {len(self._sessions)} 个会话")
+
+    def _persist(self, session_id: str, info: Dict[str, Any]):
+        if self._db is not None:
+            self._db.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, user_id, conversation_id, last_activity, seq) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (session_id, info['user_id'], info['conversation_id'], info['last_activity'], info['seq'])
+            )
+
+    def _unpersist(self, session_ids: List[str]):
+        if self._db is not None and session_ids:
+            self._db.executemany("DELETE FROM sessions WHERE session_id = ?", [(sid,) for sid in session_ids])
+
+    def close(self):
+        """关闭SQLite连接（应用关闭时调用）"""
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    # ==================== 内部增删 ====================
+    @staticmethod
+    def _entry_size(session_id: str, info: Dict[str, Any]) -> int:
+        """一个会话在两个字典和分页索引中的估算占用（字节）"""
+        size = sys.getsizeof(session_id) + sys.getsizeof(info) + sys.getsizeof(info['user_id'] or '') + 64
+        if info['conversation_id']:
+            size += sys.getsizeof(info['conversation_id']) + 32
+        return size
+
+    def _insert(self, session_id: str, user_id: str, conversation_id: Optional[str],
+                last_activity: float, seq: int) -> Dict[str, Any]:
+        info = {"user_id": user_id, "conversation_id": conversation_id, "last_activity": last_activity, "seq": seq}
+        self._sessions[session_id] = info
+        if conversation_id:
+            self._by_conversation[conversation_id] = session_id
+        self._seqs.append(seq)
+        self._seq_to_session[seq] = session_id
+        self._bytes += self._entry_size(session_id, info)
+        return info
+
+    def _delete(self, session_id: str) -> Optional[Dict[str, Any]]:
+        info = self._sessions.pop(session_id, None)
+        if info is None:
+            return None
+        if info['conversation_id'] and self._by_conversation.get(info['conversation_id']) == session_id:
+            del self._by_conversation[info['conversation_id']]
+        self._seq_to_session.pop(info['seq'], None)
+        self._bytes -= self._entry_size(session_id, info)
+        # 分页序号列表中已删除的序号超过一半时压缩
+        if len(self._seqs) > 2 * len(self._seq_to_session) + 64:
+            self._seqs = [seq for seq in self._seqs if seq in self._seq_to_session]
+        return info
+
+    def _evict(self):
+        """淘汰过期会话和超出容量的最久未活动会话（都在有序字典头部）"""
+        removed = []
+        cutoff = time.time() - self.ttl_seconds
+        while self._sessions:
+            session_id, info = next(iter(self._sessions.items()))
+            if info['last_activity'] >= cutoff and len(self._sessions) <= self.max_sessions:
+                break
+            self._stats['expired' if info['last_activity'] < cutoff else 'evicted_lru'] += 1
+            self._delete(session_id)
+            removed.append(session_id)
+        self._unpersist(removed)
+
+    def _alive(self, session_id: Optional[str]) -> Optional[Dict[str, Any]]:
+        """取未过期的会话信息，已过期的顺带删除"""
+        info = self._sessions.get(session_id) if session_id else None
+        if info is not None and info['last_activity'] < time.time() - self.ttl_seconds:
+            self._stats['expired'] += 1
+            self._delete(session_id)
+            self._unpersist([session_id])
+            return None
+        return info
+
+    @staticmethod
+    def _public(session_id: str, info: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "session_id": session_id,
+            "user_id": info['user_id'],
+            "conversation_id": info['conversation_id'],
+            "last_activity": datetime.fromtimestamp(info['last_activity']).isoformat()
+        }
+
+    # ==================== 对外接口 ====================
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """按session_id查询会话（user_id、conversation_id、last_activity），不存在或已过期返回None"""
+        with self._lock:
+            info = self._alive(session_id)
+            return self._public(session_id, info) if info else None
+
+    def get_by_conversation(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        """按conversation_id反查绑定的会话"""
+        with self._lock:
+            session_id = self._by_conversation.get(conversation_id)
+            info = self._alive(session_id)
+            return self._public(session_id, info) if info else None
+
+    def touch(self, session_id: str, user_id: str) -> Dict[str, Any]:
+        """记录会话活动（不存在则新建一个尚未绑定conversation_id的会话）"""
+        with self._lock:
+            info = self._alive(session_id)
+            if info is None:
+                return self._public(session_id, self._upsert(session_id, user_id, None))
+            return self._public(session_id, self._upsert(session_id, info['user_id'], info['conversation_id']))
+
+    def bind(self, session_id: str, user_id: str, conversation_id: str) -> Dict[str, Any]:
+        """
+        绑定 session_id 与 conversation_id（双向）
+        该conversation_id已绑定到其他会话时，解除并删除那个会话；本会话原来绑定的其他conversation_id同时解除。
+        """
+        with self._lock:
+            old_session_id = self._by_conversation.get(conversation_id)
+            if old_session_id and old_session_id != session_id:
+                self._delete(old_session_id)
+                self._unpersist([old_session_id])
+            return self._public(session_id, self._upsert(session_id, user_id, conversation_id))
+
+    def _upsert(self, session_id: str, user_id: str, conversation_id: Optional[str]) -> Dict[str, Any]:
+        info = self._sessions.get(session_id)
+        now = time.time()
+        if info is None:
+            info = self._insert(session_id, user_id, conversation_id, now, self._next_seq)
+            self._next_seq += 1
+        else:
+            if info['conversation_id'] != conversation_id:
+                self._bytes -= self._entry_size(session_id, info)
+                if info['conversation_id'] and self._by_conversation.get(info['conversation_id']) == session_id:
+                    del self._by_conversation[info['conversation_id']]
+                info['conversation_id'] = conversation_id
+                if conversation_id:
+                    self._by_conversation[conversation_id] = session_id
+                self._bytes += self._entry_size(session_id, info)
+            info['user_id'] = user_id
+            info['last_activity'] = now
+            self._sessions.move_to_end(session_id)
+        self._persist(session_id, info)
+        self._evict()
+        return info
+
+    def remove(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """删除会话及其conversation_id绑定，返回被删除的会话信息"""
+        with self._lock:
+            info = self._delete(session_id)
+            if info is None:
+                return None
+            self._unpersist([session_id])
+            return self._public(session_id, info)
+
+    def page(self, limit: int, cursor: Optional[int] = None) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+        """
+        按创建顺序分页列出会话
+
+        参数：cursor - 上一页返回的next_cursor（不传从头开始）
+        返回：(会话列表, next_cursor)，没有更多时next_cursor为None
+        """
+        with self._lock:
+            cutoff = time.time() - self.ttl_seconds
+            sessions = []
+            index = bisect.bisect_right(self._seqs, cursor or 0)
+            while index < len(self._seqs) and len(sessions) <= limit:
+                seq = self._seqs[index]
+                index += 1
+                session_id = self._seq_to_session.get(seq)
+                if session_id is None:
+                    continue
+                info = self._sessions[session_id]
+                if info['last_activity'] < cutoff:
+                    continue
+                sessions.append((seq, self._public(session_id, info)))
+            if len(sessions) > limit:
+                sessions = sessions[:limit]
+                return [item for _, item in sessions], sessions[-1][0]
+            return [item for _, item in sessions], None
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def __contains__(self, session_id: str) -> bool:
+        return self.get(session_id) is not None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """会话数、容量、估算内存占用和淘汰计数"""
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "conversations": len(self._by_conversation),
+                "max_sessions": self.max_sessions,
+                "ttl_seconds": self.ttl_seconds,
+                "approx_memory_bytes": self._bytes + sys.getsizeof(self._sessions)
+                + sys.getsizeof(self._by_conversation) + sys.getsizeof(self._seqs)
+                + sys.getsizeof(self._seq_to_session),
+                "evicted_lru": self._stats['evicted_lru'],
+                "expired": self._stats['expired'],
+                "persistent": self._db is not None,
+                "db_path": self.db_path
+            }
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+流式回复的增量合并：把Coze逐个下发的小增量合并成较少的SSE帧
+
+Coze每个 conversation.message.delta 通常只有一两个字，逐个转发时每个增量都要一帧SSE（外加JSON封装和一次写socket）。
+coalesce_stream 包在 AsyncCozeAPIClient.send_message_stream 外面：
+- 第一个增量立即下发（首字延迟不变）
+- 之后的增量先缓存，缓存满 max_bytes（UTF-8字节）或距缓存中第一个增量超过 window_ms 时合并成一个chunk下发
+- complete / error 到达时先下发缓存的内容，再原样下发
+- window_ms 和 max_bytes 都为0时不合并，逐个下发
+可选的节奏模式（pacing_ms > 0）：不合并，相邻两帧至少间隔 pacing_ms（只补足间隔，不在每帧后固定等待），用于前端打字机效果。
+
+等待上游时不会取消正在读取的 __anext__（取消会中断上游生成器），而是让它留在后台任务中，超时只负责下发缓存。
+"""
+
+import time
+import asyncio
+from typing import AsyncIterator, Dict, Any, List, Optional
+
+
+def _merge(chunks: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """把连续的chunk合并成一个，其余字段取最后一个增量的"""
+    if len(chunks) == 1:
+        return chunks[0]
+    merged = dict(chunks[-1])
+    merged["content"] = "".join(chunk.get("content", "") for chunk in chunks)
+    return merged
+
+
+async def coalesce_stream(upstream: AsyncIterator[Dict[str, Any]], window_ms: float = 0, max_bytes: int = 0,
+                          pacing_ms: float = 0) -> AsyncIterator[Dict[str, Any]]:
+    """
+    合并上游流中连续的chunk
+
+    参数：upstream - send_message_stream 返回的异步生成器（调用方负责用 aclosing 关闭）
+          window_ms - 合并时间窗口（毫秒），0表示不按时间合并
+          max_bytes - 缓存达到该字节数立即下发，0表示不按大小合并
+          pacing_ms - 节奏模式的最小帧间隔（毫秒），大于0时忽略前两个参数
+    返回：与上游相同格式的 chunk / complete / error 字典
+    """
+    if pacing_ms > 0:
+        interval = pacing_ms / 1000
+        last_sent = None
+        async for item in upstream:
+            if item.get("type") == "chunk" and last_sent is not None:
+                delay = interval - (time.monotonic() - last_sent)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            yield item
+            last_sent = time.monotonic()
+        return
+
+    if window_ms <= 0 and max_bytes <= 0:
+        async for item in upstream:
+            yield item
+        return
+
+    window = window_ms / 1000 if window_ms > 0 else None
+    iterator = upstream.__aiter__()
+    buffer: List[Dict[str, Any]] = []
+    buffer_bytes = 0
+    deadline: Optional[float] = None
+    first_sent = False
+    pending: Optional[asyncio.Task] = None
+
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+
+            if not done:
+                # 时间窗口到期：下发缓存，继续等待同一个上游读取
+                yield _merge(buffer)
+                buffer, buffer_bytes, deadline = [], 0, None
+                continue
+
+            task, pending = pending, None
+            try:
+                item = task.result()
+            except StopAsyncIteration:
+                break
+
+            if item.get("type") != "chunk":
+                if buffer:
+                    yield _merge(buffer)
+                    buffer, buffer_bytes, deadline = [], 0, None
+                yield item
+                continue
+
+            if not first_sent:
+                first_sent = True
+                yield item
+                continue
+
+            buffer.append(item)
+            buffer_bytes += len(item.get("content", "").encode("utf-8"))
+            if max_bytes > 0 and buffer_bytes >= max_bytes:
+                yield _merge(buffer)
+                buffer, buffer_bytes, deadline = [], 0, None
+            elif deadline is None and window is not None:
+                deadline = time.monotonic() + window
+
+        if buffer:
+            yield _merge(buffer)
+    finally:
+        # 提前关闭（前端断开或出错）：先停掉还在读取上游的任务，调用方的 aclosing 才能关闭上游生成器
+        if pending is not None and not pending.done():
+            pending.cancel()
+            try:
+                await pending
+            except (asyncio.CancelledError, StopAsyncIteration):
+                pass
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+多会话并发压力测试：检查并发流式对话之间没有串话
+
+一个 AsyncCozeAPIClient（一个连接池）同时跑 BENCH_STREAMS（默认200）个流式对话，对接本地Coze桩服务：
+- 一半续传各自已有的会话ID，一半新建会话
+- 每10个流中有1个在读到几个增量后被取消（模拟前端断开）
+桩服务的增量内容为 "<conversation_id>|<序号>"。检查每个流收到的每个增量、chunk/complete 中的
+conversation_id 都属于本流的会话，新建的会话ID互不相同，且被取消的流不影响其他流。
+运行方式（在mental_agent目录下）：python stress_test_conversations.py
+"""
+
+import os
+import time
+import uuid
+import asyncio
+from contextlib import aclosing
+
+STUB_PORT = int(os.getenv('BENCH_STUB_PORT', 18766))
+STREAMS = int(os.getenv('BENCH_STREAMS', 200))
+os.environ['COZE_BASE_URL'] = f"http://127.0.0.1:{STUB_PORT}/v3"
+os.environ.setdefault('COZE_API_TOKEN', 'bench_token')
+os.environ.setdefault('COZE_BOT_ID', 'bench_bot')
+os.environ.setdefault('COZE_POOL_SIZE', str(STREAMS))
+
+from coze_async_client import AsyncCozeAPIClient
+from coze_stub_server import CozeStubServer
+
+DELTAS = int(os.getenv('BENCH_DELTAS', 30))
+DELTA_SECONDS = float(os.getenv('BENCH_DELTA_MS', 10)) / 1000
+CANCEL_EVERY = 10
+
+
+async def run_stream(client: AsyncCozeAPIClient, index: int, paused: asyncio.Event):
+    """
+    跑一个流式对话，返回 (实际会话ID, 问题列表)
+
+    偶数序号续传自己的会话，奇数序号新建会话；每CANCEL_EVERY个流中的一个读到3个增量后停下等待取消。
+    """
+    expected = f"conv_existing_{index}_{uuid.uuid4().hex[:8]}" if index % 2 == 0 else None
+    problems = []
+    seen_conversation = expected
+    received = 0
+    complete = None
+
+    # 与 api_server 一致：用 aclosing 保证本流被取消时立即关闭上游连接
+    stream = client.send_message_stream(f"消息{index}", conversation_id=expected)
+    async with aclosing(stream):
+        async for item in stream:
+            conversation_id = item.get('conversation_id')
+            if seen_conversation is None:
+                seen_conversation = conversation_id
+            if conversation_id != seen_conversation:
+                problems.append(f"流{index}: conversation_id {conversation_id} != {seen_conversation}")
+            if item['type'] == 'chunk':
+                owner, sequence = item['content'].rsplit('|', 1)
+                if owner != seen_conversation or int(sequence) != received:
+                    problems.append(f"流{index}: 收到不属于本会话的增量 {item['content']}")
+                received += 1
+                if index % CANCEL_EVERY == 0 and received == 3:
+                    # 模拟前端断开：不再读取，等待调用方取消
+                    paused.set()
+                    await asyncio.sleep(3600)
+            elif item['type'] == 'complete':
+                complete = item
+            elif item['type'] == 'error':
+                problems.append(f"流{index}: {item['message']}")
+
+    if complete is None or received != DELTAS:
+        problems.append(f"流{index}: 收到 {received}/{DELTAS} 个增量，complete={complete is not None}")
+    elif complete['full_content'] != ''.join(f"{seen_conversation}|{i}" for i in range(DELTAS)):
+        problems.append(f"流{index}: full_content 与本会话增量不一致")
+    return seen_conversation, problems
+
+
+async def main():
+    stub = CozeStubServer(STUB_PORT, deltas=DELTAS, delta_seconds=DELTA_SECONDS).start()
+    client = AsyncCozeAPIClient()
+    print(f"{STREAMS} 个并发流（一半续传、一半新建，每{CANCEL_EVERY}个取消1个），每个 {DELTAS} 个增量 x {DELTA_SECONDS * 1000:.0f} ms")
+
+    start = time.perf_counter()
+    paused = [asyncio.Event() for _ in range(STREAMS)]
+    tasks = [asyncio.create_task(run_stream(client, i, paused[i])) for i in range(STREAMS)]
+    cancelled = [task for i, task in enumerate(tasks) if i % CANCEL_EVERY == 0]
+    # 等要取消的流都读到几个增量（上游正在生成）后再取消
+    await asyncio.gather(*(paused[i].wait() for i in range(0, STREAMS, CANCEL_EVERY)))
+    for task in cancelled:
+        task.cancel()
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    elapsed = time.perf_counter() - start
+    await client.close()
+
+    problems = []
+    new_conversations = []
+    for i, result in enumerate(results):
+        if i % CANCEL_EVERY == 0:
+            if not isinstance(result, asyncio.CancelledError):
+                problems.append(f"流{i}: 应被取消，实际结果 {result!r}")
+            continue
+        if isinstance(result, BaseException):
+            problems.append(f"流{i}: 异常 {result!r}")
+            continue
+        conversation_id, stream_problems = result
+        problems.extend(stream_problems)
+        if i % 2 == 1:
+            new_conversations.append(conversation_id)
+    if len(set(new_conversations)) != len(new_conversations):
+        problems.append("新建会话的conversation_id出现重复")
+
+    await asyncio.sleep(0.2)
+    print(f"总耗时 {elapsed:.2f} s | 完成 {STREAMS - len(cancelled)} 个，取消 {len(cancelled)} 个，"
+          f"桩服务检测到断开 {stub.stats['disconnected']} 次")
+    if problems:
+        print(f"发现 {len(problems)} 个问题：")
+        for problem in problems[:20]:
+            print(f"  {problem}")
+        raise SystemExit(1)
+    print("未发现跨会话串话")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())